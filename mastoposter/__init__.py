@@ -16,15 +16,27 @@ GNU General Public License for more details.
 from asyncio import gather
 from configparser import ConfigParser
 from logging import getLogger
-from typing import Dict, List, Optional
+from typing import Dict, FrozenSet, List, Optional, Sequence, Union
 from mastoposter.filters import run_filters
-from mastoposter.filters.base import BaseFilter, FilterInstance
+from mastoposter.filters.base import BaseFilter, FilterContext, FilterInstance
 
 from mastoposter.integrations import (
     DiscordIntegration,
     FilteredIntegration,
     TelegramIntegration,
 )
+from mastoposter.integrations.base import (
+    BaseIntegration,
+    DeliveryError,
+    is_retryable,
+)
+from mastoposter.metrics import (
+    DELIVERIES,
+    DELIVERY_LAG,
+    STAGE_SECONDS,
+    lag_since,
+)
+from mastoposter.outbox import Outbox
 from mastoposter.types import Status
 
 __version__ = "0.2"
@@ -61,32 +73,80 @@ def load_integrations_from(config: ConfigParser) -> List[FilteredIntegration]:
             logger.info("Running post-initialization hook for %r", finst)
             finst.filter.post_init(filters, config)
 
+        sources: Optional[FrozenSet[str]] = None
+        if "sources" in mod:
+            sources = frozenset(mod["sources"].split())
+
         # TODO: make a registry of integrations
         # INFO: mastoposter/integrations/base.py@__init__
         if mod["type"] == "telegram":
-            modules.append(
-                FilteredIntegration(
-                    TelegramIntegration.from_section(mod),
-                    list(filters.values()),
-                )
-            )
+            sink: BaseIntegration = TelegramIntegration.from_section(mod)
         elif mod["type"] == "discord":
-            modules.append(
-                FilteredIntegration(
-                    DiscordIntegration.from_section(mod),
-                    list(filters.values()),
-                )
-            )
+            sink = DiscordIntegration.from_section(mod)
         else:
             raise ValueError("Invalid module type %r" % mod["type"])
+        sink.name = module_name
+        modules.append(
+            FilteredIntegration(
+                sink, list(filters.values()), module_name, sources
+            )
+        )
     return modules
 
 
+def _filter(
+    sink: FilteredIntegration, status: Status, ctx: FilterContext
+) -> bool:
+    with STAGE_SECONDS.time(stage="filter", module=sink.name):
+        return run_filters(sink.filters, status, ctx)
+
+
+async def _deliver(sink: FilteredIntegration, status: Status) -> Optional[str]:
+    outcome = "error"
+    try:
+        with STAGE_SECONDS.time(stage="deliver", module=sink.name):
+            result = await sink.sink(status)
+        outcome = "ok"
+        return result
+    finally:
+        DELIVERIES.inc(module=sink.name, outcome=outcome)
+        DELIVERY_LAG.observe(
+            lag_since(status.created_at), module=sink.name, outcome=outcome
+        )
+
+
 async def execute_integrations(
-    status: Status, sinks: List[FilteredIntegration]
-) -> List[Optional[str]]:
+    status: Status,
+    sinks: List[FilteredIntegration],
+    outbox: Optional[Outbox] = None,
+    sources: Sequence[str] = (),
+) -> List[Union[str, None, BaseException]]:
     logger.info("Executing integrations...")
-    return await gather(
-        *[sink[0](status) for sink in sinks if run_filters(sink[1], status)],
+    ctx = FilterContext(status)
+    sinks = [
+        sink
+        for sink in sinks
+        if sink.accepts(sources) and _filter(sink, status, ctx)
+    ]
+    if outbox is None:
+        return await gather(
+            *[_deliver(sink, status) for sink in sinks],
+            return_exceptions=True,
+        )
+
+    jobs = await outbox.add(status, [sink.name for sink in sinks])
+    results = await gather(
+        *[_deliver(sink, status) for sink in sinks],
         return_exceptions=True,
     )
+    for job_id, result in zip(jobs, results):
+        if isinstance(result, BaseException):
+            outbox.failed(
+                job_id,
+                0,
+                is_retryable(result),
+                result.targets if isinstance(result, DeliveryError) else (),
+            )
+        else:
+            outbox.done(job_id)
+    return results
@@ -15,7 +15,7 @@ GNU General Public License for more details.
 """
 from argparse import ArgumentParser
 from asyncio import run
-from configparser import ConfigParser, ExtendedInterpolation
+from configparser import ConfigParser, ExtendedInterpolation, SectionProxy
 from logging import (
     INFO,
     Formatter,
@@ -26,24 +26,80 @@ from logging import (
 )
 from os import getenv
 from sys import stdout
-from typing import AsyncGenerator, Callable, List
+from functools import partial
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
 from httpx import Client, HTTPTransport
 
 from mastoposter import (
-    execute_integrations,
+    offload,
+    templates,
     load_integrations_from,
     __version__,
     __description__,
 )
+from mastoposter.checkpoint import Checkpoint
+from mastoposter.clients import close_clients
+from mastoposter.dedup import SeenCache
+from mastoposter.health import ConnectionHealth
+from mastoposter.metrics import CONNECTION, export_fields, serve_metrics
 from mastoposter.integrations import FilteredIntegration
-from mastoposter.sources import websocket_source
-from mastoposter.types import Account, Status
+from mastoposter.outbox import Outbox
+from mastoposter.pipeline import Pipeline
+from mastoposter.prefilter import Prefilter
+from mastoposter.sources import (
+    SharedSource,
+    timeline_source,
+    websocket_source,
+)
+from mastoposter.types import (
+    CORE_FIELDS,
+    Account,
+    Status,
+    measure_projection,
+    set_projection,
+)
 from mastoposter.utils import normalize_config
 
 
 WSOCK_TEMPLATE = "wss://{instance}/api/v1/streaming"
 VERIFY_CREDS_TEMPLATE = "https://{instance}/api/v1/accounts/verify_credentials"
+# Timelines to backfill each stream from, with their query parameters
+TIMELINE_TEMPLATES: Dict[str, Tuple[str, Dict[str, str]]] = {
+    "list": ("https://{instance}/api/v1/timelines/list/{list}", {}),
+    "user": ("https://{instance}/api/v1/timelines/home", {}),
+    "public": ("https://{instance}/api/v1/timelines/public", {}),
+    "public:local": (
+        "https://{instance}/api/v1/timelines/public",
+        {"local": "true"},
+    ),
+    "public:remote": (
+        "https://{instance}/api/v1/timelines/public",
+        {"remote": "true"},
+    ),
+    "hashtag": ("https://{instance}/api/v1/timelines/tag/{tag}", {}),
+    "hashtag:local": (
+        "https://{instance}/api/v1/timelines/tag/{tag}",
+        {"local": "true"},
+    ),
+}
+ACCOUNT_STATUSES_TEMPLATE = (
+    "https://{instance}/api/v1/accounts/{user_id}/statuses"
+)
+
+# Keys that sources inherit from [main] if they don't set them
+SOURCE_DEFAULTS = (
+    "user",
+    "replies_to_other_accounts_should_not_be_skipped",
+    "auto_reconnect",
+    "reconnect_delay",
+    "reconnect_max_delay",
+    "stable_after",
+    "ping_interval",
+    "ping_timeout",
+    "connect_timeout",
+    "backfill_pages",
+)
 
 logger = getLogger()
 
@@ -61,47 +117,115 @@ def init_logger(loglevel: int = INFO):
 
 
 async def listen(
-    source: Callable[..., AsyncGenerator[Status, None]],
-    drains: List[FilteredIntegration],
-    user: str,
-    replies_to_other_accounts_should_not_be_skipped: bool = False,
-    /,
-    **kwargs,
+    pipeline: Pipeline,
+    sources: List[SharedSource],
+    metrics: Optional[str] = None,
 ):
+    server = None
+    if metrics is not None:
+        server = await serve_metrics(metrics)
     logger.info("Starting listening...")
-    async for status in source(**kwargs):
-        logger.info("New status: %s", status.uri)
-        logger.debug("Got status: %r", status)
-        if status.account.id != user and user != "all":
-            logger.info(
-                "Skipping status %s (account.id=%r != %r)",
-                status.uri,
-                status.account.id,
-                user,
-            )
-            continue
-
-        # TODO: add option/filter to handle that
-        if status.visibility in ("direct",):
-            logger.info(
-                "Skipping post %s (status.visibility=%r)",
-                status.uri,
-                status.visibility,
-            )
-            continue
-
-        # TODO: find a better way to handle threads
-        if (
-            status.in_reply_to_account_id is not None
-            and status.in_reply_to_account_id != user
-        ) and not replies_to_other_accounts_should_not_be_skipped:
-            logger.info(
-                "Skipping post %s because it's a reply to another person",
-                status.uri,
+    try:
+        await pipeline.run_feeds([source.feed() for source in sources])
+    finally:
+        offload.shutdown()
+        if server is not None:
+            server.close()
+        for source in sources:
+            logger.info("%r", source.kwargs.get("health"))
+            for name, prefilter in source.members.items():
+                logger.info("Source %s: %r", name, prefilter)
+        await close_clients()
+
+
+def health_gauges(health: ConnectionHealth) -> ConnectionHealth:
+    export_fields(
+        CONNECTION,
+        health,
+        (
+            "connected",
+            "uptime",
+            "frame_rate",
+            "last_frame_age",
+            "connect_latency",
+            "connects",
+            "reconnects",
+            "failures",
+        ),
+        source=health.name,
+    )
+    return health
+
+
+def load_sources(conf: ConfigParser) -> Dict[str, SectionProxy]:
+    if "sources" not in conf["main"]:
+        return {"main": conf["main"]}
+
+    sections: Dict[str, SectionProxy] = {}
+    for name in conf["main"]["sources"].split():
+        section = conf["source/" + name]
+        for key in SOURCE_DEFAULTS:
+            if key not in section and conf.has_option("main", key):
+                section[key] = conf.get("main", key, raw=True)
+        sections[name] = section
+    return sections
+
+
+def get_user_id(section: SectionProxy, retries: int) -> str:
+    user_id: str = section.get("user", "auto")
+    if user_id == "auto":
+        logger.info("%s.user is set to auto, getting user ID", section.name)
+        with Client(transport=HTTPTransport(retries=retries)) as c:
+            rq = c.get(
+                VERIFY_CREDS_TEMPLATE.format(**section),
+                params={"access_token": section["token"]},
             )
-            continue
+            user_id = Account.from_dict(rq.json()).id
+    return user_id
 
-        logger.info(await execute_integrations(status, drains))
+
+def get_status_fields(
+    modules: List[FilteredIntegration],
+) -> Optional[FrozenSet[str]]:
+    fields = CORE_FIELDS
+    for module in modules:
+        if module.status_fields is None:
+            logger.info("%s reads the whole status", module.name)
+            return None
+        fields |= module.status_fields
+    return fields
+
+
+def report_projection(
+    section: SectionProxy,
+    user_id: str,
+    fields: FrozenSet[str],
+    retries: int,
+):
+    # Decodes a few recent statuses with and without the projection
+    try:
+        with Client(transport=HTTPTransport(retries=retries)) as c:
+            rq = c.get(
+                ACCOUNT_STATUSES_TEMPLATE.format(**section, user_id=user_id),
+                params={"access_token": section["token"], "limit": 20},
+            )
+            rq.raise_for_status()
+            statuses = rq.json()
+    except Exception as e:
+        logger.info("Can't fetch statuses to measure projection: %r", e)
+        return
+    if not statuses:
+        return
+    savings = measure_projection(statuses, fields)
+    logger.info(
+        "Projection on %d statuses: decode %.0fus -> %.0fus, "
+        "memory %.1fKiB -> %.1fKiB",
+        len(statuses),
+        savings.full_time * 1e6,
+        savings.projected_time * 1e6,
+        savings.full_memory / 1024,
+        savings.projected_memory / 1024,
+    )
 
 
 def main():
@@ -120,44 +244,132 @@ def main():
     init_logger(getLevelName(conf["main"].get("loglevel", "INFO")))
     normalize_config(conf)
 
+    offload.configure(
+        conf["main"].get("render_executor", "thread"),
+        conf["main"].getint("render_workers", None),
+    )
+
+    templates.configure(conf["main"].get("template_cache", None))
     modules: List[FilteredIntegration] = load_integrations_from(conf)
     retries: int = conf["main"].getint("http-retries", 5)
 
     logger.info("Loaded %d integrations", len(modules))
 
-    user_id: str = conf["main"]["user"]
-    if user_id == "auto":
-        logger.info("config.main.user is set to auto, getting user ID")
-        with Client(transport=HTTPTransport(retries=retries)) as c:
-            rq = c.get(
-                VERIFY_CREDS_TEMPLATE.format(**conf["main"]),
-                params={"access_token": conf["main"]["token"]},
+    Status.content_formats = frozenset().union(
+        *(module.content_formats for module in modules)
+    )
+    logger.info(
+        "Content formats: %s", ", ".join(sorted(Status.content_formats))
+    )
+
+    status_fields = get_status_fields(modules)
+    if status_fields is not None:
+        for name, dropped in set_projection(status_fields).items():
+            logger.info("%s fields dropped: %s", name, dropped)
+
+    checkpoints: Dict[str, Checkpoint] = {}
+    sources: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], SharedSource] = {}
+    for name, section in load_sources(conf).items():
+        user_id = get_user_id(section, retries)
+        logger.info("%s: account.id=%s", name, user_id)
+        if status_fields is not None and not sources:
+            report_projection(section, user_id, status_fields, retries)
+
+        prefilter = Prefilter(
+            user_id,
+            [module for module in modules if module.accepts([name])],
+            section.getboolean(
+                "replies_to_other_accounts_should_not_be_skipped", False
+            ),
+            name,
+        )
+
+        url = section.get("streaming_url", WSOCK_TEMPLATE.format(**section))
+        params = {
+            "stream": section.get("stream", "list"),
+            "access_token": section["token"],
+        }
+        if params["stream"] == "list":
+            params["list"] = section["list"]
+        if "tag" in section:
+            params["tag"] = section["tag"]
+
+        key = (url, tuple(sorted(params.items())))
+        if key in sources:
+            logger.info("%s shares the connection with %r", name, sources[key])
+        else:
+            sources[key] = SharedSource(
+                websocket_source,
+                url=url,
+                reconnect=section.getboolean("auto_reconnect", False),
+                reconnect_delay=section.getfloat("reconnect_delay", 1.0),
+                reconnect_max_delay=section.getfloat(
+                    "reconnect_max_delay", 300.0
+                ),
+                stable_after=section.getfloat("stable_after", 60.0),
+                connect_timeout=section.getfloat("connect_timeout", 60.0),
+                ping_interval=section.getfloat("ping_interval", 20.0) or None,
+                ping_timeout=section.getfloat("ping_timeout", 20.0) or None,
+                health=health_gauges(ConnectionHealth(name)),
+                json_codec=conf["main"].get("json", "auto"),
+                **params,
             )
-            user_id = Account.from_dict(rq.json()).id
+        source = sources[key]
+        source.add(name, prefilter)
 
-    logger.info("account.id=%s", user_id)
+        if "checkpoint" in section:
+            checkpoints[name] = Checkpoint(section["checkpoint"])
+            timeline = TIMELINE_TEMPLATES.get(params["stream"])
+            if timeline is None:
+                logger.warning(
+                    "%s: stream %r has no timeline to backfill from, "
+                    "checkpoint won't have any effect",
+                    name,
+                    params["stream"],
+                )
+            elif "backfill" not in source.kwargs:
+                source.kwargs["backfill"] = partial(
+                    timeline_source,
+                    timeline[0].format(**section),
+                    checkpoints[name],
+                    access_token=section["token"],
+                    retries=retries,
+                    max_pages=section.getint("backfill_pages", 10),
+                    tagger=source.tags,
+                    query=timeline[1],
+                )
 
-    url = conf["main"].get(
-        "streaming_url",
-        "wss://{}/api/v1/streaming".format(conf["main"]["instance"]),
+    logger.info(
+        "Loaded %d sources over %d connections",
+        sum(len(source.members) for source in sources.values()),
+        len(sources),
+    )
+
+    pipeline = Pipeline(
+        modules,
+        queue_size=conf["main"].getint("queue_size", 100),
+        workers=conf["main"].getint("workers", 1),
+        checkpoints=checkpoints,
+        seen=SeenCache(
+            max_size=conf["main"].getint("dedup_size", 10000),
+            ttl=conf["main"].getfloat("dedup_ttl", 86400.0),
+            boost_window=conf["main"].getfloat("boost_window", 3600.0),
+            snapshot=conf["main"].get("dedup_snapshot"),
+        ),
+        outbox=(
+            Outbox(
+                conf["main"]["outbox"],
+                max_attempts=conf["main"].getint("outbox_attempts", 5),
+            )
+            if "outbox" in conf["main"]
+            else None
+        ),
+        retry_interval=conf["main"].getfloat("outbox_retry_interval", 300.0),
     )
 
     run(
         listen(
-            websocket_source,
-            modules,
-            user_id,
-            url=url,
-            replies_to_other_accounts_should_not_be_skipped=conf[
-                "main"
-            ].getboolean(
-                "replies_to_other_accounts_should_not_be_skipped", False
-            ),
-            reconnect=conf["main"].getboolean("auto_reconnect", False),
-            reconnect_delay=conf["main"].getfloat("reconnect_delay", 1.0),
-            connect_timeout=conf["main"].getfloat("connect_timeout", 60.0),
-            list=conf["main"]["list"],
-            access_token=conf["main"]["token"],
+            pipeline, list(sources.values()), conf["main"].get("metrics")
         )
     )
 
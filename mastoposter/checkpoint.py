@@ -0,0 +1,67 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from logging import getLogger
+from os import replace
+from typing import Optional, Tuple
+
+logger = getLogger("checkpoint")
+
+
+def status_id_key(status_id: str) -> Tuple[int, str]:
+    # Mastodon uses numeric snowflakes, Pleroma uses fixed-length flake IDs,
+    # in both cases longer means newer and same length compares as a string
+    return len(status_id), status_id
+
+
+class Checkpoint:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.last_id: Optional[str] = self.load()
+
+    def load(self) -> Optional[str]:
+        if self.path is None:
+            return None
+        try:
+            with open(self.path, "r") as f:
+                last_id = f.read().strip() or None
+        except FileNotFoundError:
+            return None
+        logger.info("Loaded checkpoint %r from %s", last_id, self.path)
+        return last_id
+
+    def save(self):
+        if self.path is None or self.last_id is None:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.last_id)
+        replace(tmp_path, self.path)
+
+    def update(self, status_id: str):
+        if self.last_id is not None and (
+            status_id_key(status_id) <= status_id_key(self.last_id)
+        ):
+            return
+        self.last_id = status_id
+        try:
+            self.save()
+        except OSError as e:
+            logger.error("Failed to save checkpoint to %s: %r", self.path, e)
+
+    def __repr__(self) -> str:
+        return "<Checkpoint path={path!r} last_id={last_id!r}>".format(
+            path=self.path, last_id=self.last_id
+        )
@@ -0,0 +1,139 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from configparser import SectionProxy
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Dict, Tuple
+from urllib.parse import urlsplit
+
+from httpx import AsyncClient, AsyncHTTPTransport, Limits, Request
+
+from mastoposter.metrics import HTTP_CLIENT, export_fields
+
+logger = getLogger("clients")
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    retries: int = 5
+    max_connections: int = 10
+    max_keepalive_connections: int = 5
+    keepalive_expiry: float = 60.0
+    http2: bool = False
+
+    @classmethod
+    def from_section(cls, section: SectionProxy) -> "PoolConfig":
+        def get(name: str, default: Any) -> Any:
+            if name in section:
+                return section[name]
+            if section.parser.has_section("main"):
+                return section.parser["main"].get(name, default)
+            return default
+
+        return cls(
+            retries=int(get("http_retries", cls.retries)),
+            max_connections=int(
+                get("http_max_connections", cls.max_connections)
+            ),
+            max_keepalive_connections=int(
+                get("http_max_keepalive", cls.max_keepalive_connections)
+            ),
+            keepalive_expiry=float(
+                get("http_keepalive_expiry", cls.keepalive_expiry)
+            ),
+            http2=str(get("http2", cls.http2)).lower()
+            in ("1", "yes", "true", "on"),
+        )
+
+
+class ClientStats:
+    def __init__(self, host: str):
+        self.host = host
+        self.requests: int = 0
+        self.connections: int = 0
+
+    @property
+    def reused(self) -> int:
+        return max(0, self.requests - self.connections)
+
+    async def on_request(self, request: Request):
+        self.requests += 1
+        request.extensions["trace"] = self.trace
+
+    async def trace(self, event_name: str, info: Dict[str, Any]):
+        if event_name in (
+            "connection.connect_tcp.complete",
+            "connection.connect_unix_socket.complete",
+        ):
+            self.connections += 1
+
+    def __repr__(self) -> str:
+        return (
+            "<ClientStats host={host!r} requests={requests} "
+            "connections={connections} reused={reused}>"
+        ).format(
+            host=self.host,
+            requests=self.requests,
+            connections=self.connections,
+            reused=self.reused,
+        )
+
+
+clients: Dict[Tuple[str, PoolConfig], AsyncClient] = {}
+stats: Dict[str, ClientStats] = {}
+
+
+def get_client(url: str, config: PoolConfig = PoolConfig()) -> AsyncClient:
+    host = urlsplit(url).netloc
+    if (host, config) in clients:
+        return clients[host, config]
+
+    logger.info("Creating HTTP client for %s (%r)", host, config)
+    if host not in stats:
+        stats[host] = ClientStats(host)
+        export_fields(
+            HTTP_CLIENT,
+            stats[host],
+            ("requests", "connections", "reused"),
+            host=host,
+        )
+    host_stats = stats[host]
+    limits = Limits(
+        max_connections=config.max_connections,
+        max_keepalive_connections=config.max_keepalive_connections,
+        keepalive_expiry=config.keepalive_expiry,
+    )
+    try:
+        transport = AsyncHTTPTransport(
+            retries=config.retries, limits=limits, http2=config.http2
+        )
+    except ImportError:
+        logger.warning("HTTP/2 support is not installed, using HTTP/1.1")
+        transport = AsyncHTTPTransport(retries=config.retries, limits=limits)
+
+    client = AsyncClient(
+        transport=transport,
+        event_hooks={"request": [host_stats.on_request]},
+    )
+    clients[host, config] = client
+    return client
+
+
+async def close_clients():
+    while clients:
+        (host, _), client = clients.popitem()
+        logger.info("Closing HTTP client for %s (%r)", host, stats.get(host))
+        await client.aclose()
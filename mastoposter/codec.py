@@ -0,0 +1,100 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from logging import getLogger
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+
+logger = getLogger("codec")
+
+# Streaming frames come as bytes, str is accepted for anything else
+Data = Union[str, bytes]
+
+
+class StreamEvent(NamedTuple):
+    event: Optional[str]
+    payload: Optional[Data]
+    error: Optional[str]
+
+
+class Codec:
+    name: str = "json"
+
+    def __init__(self):
+        from json import loads
+
+        self.loads: Callable[[Data], Any] = loads
+
+    def decode_event(self, msg: Data) -> StreamEvent:
+        event: Dict[str, Any] = self.loads(msg)
+        return StreamEvent(
+            event.get("event"), event.get("payload"), event.get("error")
+        )
+
+    def decode(self, data: Data) -> Any:
+        return self.loads(data)
+
+    def __repr__(self) -> str:
+        return f"<Codec {self.name}>"
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+
+    def __init__(self):
+        from orjson import loads
+
+        self.loads = loads
+
+
+class MsgspecCodec(Codec):
+    name = "msgspec"
+
+    def __init__(self):
+        from msgspec import Struct
+        from msgspec.json import Decoder
+
+        class Event(Struct):
+            event: Optional[str] = None
+            payload: Optional[str] = None
+            error: Optional[str] = None
+
+        self._events = Decoder(Event)
+        self.loads = Decoder().decode
+
+    def decode_event(self, msg: Data) -> StreamEvent:
+        event = self._events.decode(msg)
+        return StreamEvent(event.event, event.payload, event.error)
+
+
+CODECS: Dict[str, Callable[[], Codec]] = {
+    "json": Codec,
+    "orjson": OrjsonCodec,
+    "msgspec": MsgspecCodec,
+}
+
+
+def get_codec(name: str = "auto") -> Codec:
+    if name != "auto":
+        if name not in CODECS:
+            raise KeyError(f"unknown JSON codec {name!r}")
+        return CODECS[name]()
+    for factory in (OrjsonCodec, MsgspecCodec, Codec):
+        try:
+            codec = factory()
+        except ImportError:
+            continue
+        logger.info("Using %s to decode JSON", codec.name)
+        return codec
+    raise RuntimeError("unreachable")
@@ -0,0 +1,199 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from collections import OrderedDict
+from json import dump, load
+from logging import getLogger
+from os import replace
+from time import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from mastoposter.types import Status
+
+logger = getLogger("dedup")
+
+
+class SeenCache:
+    def __init__(
+        self,
+        max_size: int = 10000,
+        ttl: float = 86400.0,
+        boost_window: float = 3600.0,
+        snapshot: Optional[str] = None,
+        snapshot_interval: float = 60.0,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.boost_window = boost_window
+        self.snapshot = snapshot
+        self.snapshot_interval = snapshot_interval
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.boost_hits: int = 0
+
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        # keys of statuses still waiting for delivery and how many jobs
+        # they're in, those are left out of the snapshot
+        self._pending: Dict[str, Tuple[Set[str], int]] = {}
+        self._dirty: bool = False
+        self._saved_at: float = time()
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def _lookup(self, key: str, now: float) -> bool:
+        expires_at = self._seen.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= now:
+            del self._seen[key]
+            return False
+        self._seen.move_to_end(key)
+        return True
+
+    def _remember(
+        self, key: str, expires_at: float, status: Optional[Status] = None
+    ):
+        if status is not None and status.uri in self._pending:
+            self._pending[status.uri][0].add(key)
+        self._seen[key] = expires_at
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        self._dirty = True
+
+    def check(self, status: Status, pending: bool = False) -> bool:
+        # With pending, a status that wasn't seen is about to be queued and
+        # is left out of the snapshot until done() is called for it
+        now = time()
+        keys: List[str] = ["id:" + status.id, "uri:" + status.uri]
+
+        if any([self._lookup(key, now) for key in keys]):
+            self.hits += 1
+            logger.info("Skipping %s: already seen", status.uri)
+            return True
+
+        if status.reblog is not None:
+            boost_key = "reblog:" + status.reblog.id
+            if self._lookup(boost_key, now):
+                self.hits += 1
+                self.boost_hits += 1
+                logger.info(
+                    "Skipping %s: %s was already boosted recently",
+                    status.uri,
+                    status.reblog.uri,
+                )
+                return True
+
+        self.misses += 1
+        if pending:
+            self.queued(status)
+        if status.reblog is not None:
+            self._remember(boost_key, now + self.boost_window, status)
+        for key in keys:
+            self._remember(key, now + self.ttl, status)
+
+        if now - self._saved_at >= self.snapshot_interval:
+            self.save()
+        return False
+
+    def _source_key(self, status: Status, name: str) -> str:
+        # boosts of one status count as the same one within a source
+        target = status.reblog if status.reblog is not None else status
+        return "source:" + name + ":" + target.uri
+
+    def sources_seen(self, status: Status, names: Iterable[str]) -> Set[str]:
+        now = time()
+        return {
+            name
+            for name in names
+            if self._lookup(self._source_key(status, name), now)
+        }
+
+    def add_sources(self, status: Status, names: Iterable[str]):
+        expires_at = time() + self.ttl
+        for name in names:
+            self._remember(self._source_key(status, name), expires_at, status)
+
+    def queued(self, status: Status):
+        keys, jobs = self._pending.get(status.uri, (set(), 0))
+        self._pending[status.uri] = (keys, jobs + 1)
+
+    def done(self, status: Status, delivered: bool = True):
+        # A status that failed is forgotten, so that it gets through when
+        # it comes again from another connection or the backfill
+        keys, jobs = self._pending.pop(status.uri, (set(), 0))
+        if not delivered:
+            for key in keys:
+                self._seen.pop(key, None)
+        elif jobs > 1:
+            self._pending[status.uri] = (keys, jobs - 1)
+        else:
+            self._dirty = True
+
+    def load(self):
+        if self.snapshot is None:
+            return
+        try:
+            with open(self.snapshot, "r") as f:
+                data: Dict[str, float] = load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logger.error("Snapshot %s is corrupted: %r", self.snapshot, e)
+            return
+
+        now = time()
+        for key, expires_at in sorted(data.items(), key=lambda kv: kv[1]):
+            if expires_at > now:
+                self._seen[key] = expires_at
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+        logger.info(
+            "Loaded %d entries from %s", len(self._seen), self.snapshot
+        )
+
+    def save(self):
+        self._saved_at = time()
+        if self.snapshot is None or not self._dirty:
+            return
+        tmp_path = self.snapshot + ".tmp"
+        try:
+            pending = set().union(*(k for k, _ in self._pending.values()))
+            with open(tmp_path, "w") as f:
+                dump(
+                    {k: v for k, v in self._seen.items() if k not in pending},
+                    f,
+                )
+            replace(tmp_path, self.snapshot)
+        except OSError as e:
+            logger.error("Failed to save %s: %r", self.snapshot, e)
+            return
+        self._dirty = False
+        logger.debug("Saved %d entries to %s", len(self._seen), self.snapshot)
+
+    def __repr__(self) -> str:
+        return (
+            "<SeenCache size={size}/{max_size} "
+            "hits={hits} misses={misses} boost_hits={boost_hits}>"
+        ).format(
+            size=len(self._seen),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            boost_hits=self.boost_hits,
+        )
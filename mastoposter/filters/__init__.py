@@ -14,10 +14,10 @@ GNU General Public License for more details.
 """
 
 from logging import getLogger
-from typing import List
+from typing import Any, Dict, List, Optional
 
 from mastoposter.types import Status
-from .base import FilterInstance
+from .base import FilterContext, FilterInstance
 from mastoposter.filters.boost import BoostFilter  # NOQA
 from mastoposter.filters.combined import CombinedFilter  # NOQA
 from mastoposter.filters.mention import MentionFilter  # NOQA
@@ -29,23 +29,37 @@ from mastoposter.filters.visibility import VisibilityFilter  # NOQA
 logger = getLogger("filters")
 
 
-def run_filters(filters: List[FilterInstance], status: Status) -> bool:
+def run_filters(
+    filters: List[FilterInstance],
+    status: Status,
+    ctx: Optional[FilterContext] = None,
+) -> bool:
     logger.debug("Running filters on %r", status.id)
 
     if not filters:
         logger.debug("No filters, returning True")
         return True
 
-    results: List[bool] = []
+    if ctx is None:
+        ctx = FilterContext(status)
     for fil in filters:
-        result = fil.filter(status)
-        logger.debug(
-            "%r -> %r ^ %r -> %r",
-            fil.filter,
-            result,
-            fil.inverse,
-            result ^ fil.inverse,
-        )
-        results.append(result ^ fil.inverse)
-    logger.debug("Result: %r", all(results))
-    return all(results)
+        if not ctx.evaluate(fil):
+            logger.debug("Result: False")
+            return False
+    logger.debug("Result: True")
+    return True
+
+
+def run_filters_raw(
+    filters: List[FilterInstance], data: Dict[str, Any]
+) -> Optional[bool]:
+    # False only if some filter is sure to reject the status, None if the
+    # parsed status is needed to decide.
+    result: Optional[bool] = True
+    for fil in filters:
+        passed = fil.check_raw(data)
+        if passed is False:
+            return False
+        if passed is None:
+            result = None
+    return result
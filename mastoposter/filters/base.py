@@ -15,16 +15,33 @@ GNU General Public License for more details.
 
 from abc import ABC, abstractmethod
 from configparser import ConfigParser, SectionProxy
-from typing import ClassVar, Dict, NamedTuple, Type
+from logging import getLogger
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    FrozenSet,
+    NamedTuple,
+    Optional,
+    Type,
+)
+from mastoposter.text import VALID_OUTPUT_TYPES
 from mastoposter.types import Status
 from re import Pattern, compile as regexp
 
 UNUSED = lambda *_: None  # NOQA
 
+logger = getLogger("filters")
+
 
 class FilterInstance(NamedTuple):
     inverse: bool
     filter: "BaseFilter"
+    name: str = ""
+
+    def check_raw(self, data: Dict[str, Any]) -> Optional[bool]:
+        result = self.filter.check_raw(data)
+        return None if result is None else result ^ self.inverse
 
     def __repr__(self):
         if self.inverse:
@@ -32,6 +49,30 @@ class FilterInstance(NamedTuple):
         return repr(self.filter)
 
 
+class FilterContext:
+    def __init__(self, status: Status):
+        self.status = status
+        self.results: Dict[str, bool] = {}
+        self.hits: int = 0
+
+    def evaluate(self, fil: FilterInstance) -> bool:
+        if fil.name and fil.name in self.results:
+            result = self.results[fil.name]
+            self.hits += 1
+        else:
+            result = fil.filter.evaluate(self)
+            if fil.name:
+                self.results[fil.name] = result
+        logger.debug(
+            "%r -> %r ^ %r -> %r",
+            fil.filter,
+            result,
+            fil.inverse,
+            result ^ fil.inverse,
+        )
+        return result ^ fil.inverse
+
+
 class BaseFilter(ABC):
     FILTER_REGISTRY: ClassVar[Dict[str, Type["BaseFilter"]]] = {}
     FILTER_NAME_REGEX: ClassVar[Pattern] = regexp(r"^([a-z_]+)$")
@@ -41,6 +82,16 @@ class BaseFilter(ABC):
     def __init__(self):
         pass
 
+    @property
+    def content_formats(self) -> FrozenSet[VALID_OUTPUT_TYPES]:
+        # Status.content_* formats the filter reads
+        return frozenset()
+
+    @property
+    def status_fields(self) -> Optional[FrozenSet[str]]:
+        # Status attribute paths the filter reads, None if unknown
+        return None
+
     def __init_subclass__(cls, filter_name: str, **kwargs):
         super().__init_subclass__(**kwargs)
         if not cls.FILTER_NAME_REGEX.match(filter_name):
@@ -54,6 +105,15 @@ class BaseFilter(ABC):
     def __call__(self, status: Status) -> bool:
         raise NotImplementedError
 
+    def evaluate(self, ctx: FilterContext) -> bool:
+        return self(ctx.status)
+
+    def check_raw(self, data: Dict[str, Any]) -> Optional[bool]:
+        # Same check on the raw API dict, before Status.from_dict runs.
+        # None means the filter can't tell without the parsed status.
+        UNUSED(data)
+        return None
+
     def post_init(
         self, filters: Dict[str, FilterInstance], config: ConfigParser
     ):
@@ -77,4 +137,5 @@ class BaseFilter(ABC):
         return FilterInstance(
             inverse=name[:1] in "~!",
             filter=cls.load_filter(section["type"], section),
+            name=name.lstrip("~!"),
         )
@@ -15,15 +15,19 @@ GNU General Public License for more details.
 
 from configparser import SectionProxy
 from fnmatch import fnmatch
-from typing import List
+from typing import Any, Dict, List, Optional
 from mastoposter.filters.base import BaseFilter
+from mastoposter.filters.matcher import AccountMatcher
 from mastoposter.types import Status
 
 
 class BoostFilter(BaseFilter, filter_name="boost"):
+    status_fields = frozenset(("reblog.account.acct",))
+
     def __init__(self, accounts: List[str]):
         super().__init__()
         self.list = accounts
+        self.matcher = AccountMatcher(accounts)
 
     @classmethod
     def from_section(cls, section: SectionProxy) -> "BoostFilter":
@@ -38,12 +42,14 @@ class BoostFilter(BaseFilter, filter_name="boost"):
             return False
         if not self.list:
             return True
-        return any(
-            [
-                self.check_account("@" + status.reblog.account.acct, mask)
-                for mask in self.list
-            ]
-        )
+        return self.matcher.match("@" + status.reblog.account.acct)
+
+    def check_raw(self, data: Dict[str, Any]) -> Optional[bool]:
+        if data.get("reblog") is None:
+            return False
+        if not self.list:
+            return True
+        return self.matcher.match("@" + data["reblog"]["account"]["acct"])
 
     def __repr__(self):
         if not self.list:
@@ -14,16 +14,35 @@ GNU General Public License for more details.
 """
 
 from configparser import ConfigParser, SectionProxy
-from typing import Callable, ClassVar, Dict, List, Sequence
-from mastoposter.filters.base import BaseFilter, FilterInstance
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+)
+from mastoposter.filters.base import BaseFilter, FilterContext, FilterInstance
+from mastoposter.text import VALID_OUTPUT_TYPES
 from mastoposter.types import Status
 
 
+def _single(results: Iterable[bool]) -> bool:
+    matched = False
+    for result in results:
+        if result and matched:
+            return False
+        matched = matched or result
+    return matched
+
+
 class CombinedFilter(BaseFilter, filter_name="combined"):
-    OPERATORS: ClassVar[Dict[str, Callable[[Sequence[bool]], bool]]] = {
+    OPERATORS: ClassVar[Dict[str, Callable[[Iterable[bool]], bool]]] = {
         "all": lambda d: all(d),
         "any": lambda d: any(d),
-        "single": lambda d: sum(d) == 1,
+        "single": _single,
     }
 
     def __init__(self, filter_names: List[str], operator: str):
@@ -48,10 +67,36 @@ class CombinedFilter(BaseFilter, filter_name="combined"):
             for name in self._filter_names
         ]
 
+    @property
+    def content_formats(self) -> FrozenSet[VALID_OUTPUT_TYPES]:
+        return frozenset().union(
+            *(f.filter.content_formats for f in self.filters)
+        )
+
+    @property
+    def status_fields(self) -> Optional[FrozenSet[str]]:
+        fields: FrozenSet[str] = frozenset()
+        for fil in self.filters:
+            if fil.filter.status_fields is None:
+                return None
+            fields |= fil.filter.status_fields
+        return fields
+
     def __call__(self, post: Status) -> bool:
+        return self.evaluate(FilterContext(post))
+
+    def evaluate(self, ctx: FilterContext) -> bool:
         if self.OPERATORS[self._operator_name] is not self.operator:
             self._operator_name = str(self.operator)
-        return self.operator([f[1](post) ^ f[0] for f in self.filters])
+        return self.operator(ctx.evaluate(f) for f in self.filters)
+
+    def check_raw(self, data: Dict[str, Any]) -> Optional[bool]:
+        results = [f.check_raw(data) for f in self.filters]
+        if self._operator_name == "all" and False in results:
+            return False
+        if None in results:
+            return None
+        return self.operator(result is True for result in results)
 
     def __repr__(self):
         if self.filters:
@@ -0,0 +1,119 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+
+def is_word_char(c: str) -> bool:
+    return c.isalnum() or c == "_"
+
+
+def load_keywords(path: str) -> List[str]:
+    with open(path, "r") as f:
+        return [
+            line.strip()
+            for line in f
+            if line.strip() and not line.lstrip().startswith("#")
+        ]
+
+
+class KeywordMatcher:
+    # Aho-Corasick automaton: all keywords are found in a single pass over
+    # the text, no matter how many of them there are
+    def __init__(
+        self,
+        keywords: Iterable[str],
+        ignore_case: bool = True,
+        whole_words: bool = False,
+    ):
+        self.ignore_case = ignore_case
+        self.whole_words = whole_words
+        self.keywords: List[str] = []
+
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+
+        for keyword in keywords:
+            if ignore_case:
+                keyword = keyword.casefold()
+            if keyword:
+                self._insert(keyword)
+        self._link()
+
+    def _insert(self, keyword: str):
+        state = 0
+        for c in keyword:
+            if c not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][c] = len(self.goto) - 1
+            state = self.goto[state][c]
+        if not self.output[state]:
+            self.output[state].append(len(self.keywords))
+            self.keywords.append(keyword)
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and c not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(c, 0)
+                if self.fail[child] == child:
+                    self.fail[child] = 0
+                self.output[child] = (
+                    self.output[child] + self.output[self.fail[child]]
+                )
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def _is_whole_word(self, text: str, start: int, end: int) -> bool:
+        return (start == 0 or not is_word_char(text[start - 1])) and (
+            end == len(text) or not is_word_char(text[end])
+        )
+
+    def search(self, text: str) -> Optional[str]:
+        if self.ignore_case:
+            text = text.casefold()
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for i, c in enumerate(text):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for idx in output[state]:
+                keyword = self.keywords[idx]
+                if not self.whole_words or self._is_whole_word(
+                    text, i + 1 - len(keyword), i + 1
+                ):
+                    return keyword
+        return None
+
+    def __repr__(self) -> str:
+        return (
+            "KeywordMatcher({count} keywords, ignore_case={ic}, "
+            "whole_words={ww})"
+        ).format(
+            count=len(self.keywords),
+            ic=self.ignore_case,
+            ww=self.whole_words,
+        )
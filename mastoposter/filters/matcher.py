@@ -0,0 +1,63 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from fnmatch import translate
+from re import Pattern, compile as regexp
+from typing import Iterable, List, Optional, Set
+
+WILDCARDS = "*?["
+
+
+def is_pattern(mask: str) -> bool:
+    return any(c in mask for c in WILDCARDS)
+
+
+class AccountMatcher:
+    # Same results as running fnmatch against every mask, but plain masks
+    # are looked up in a set, `@*@instance` ones are indexed by instance,
+    # and everything else is compiled into a single regular expression
+    def __init__(self, masks: Iterable[str]):
+        self.masks: List[str] = list(masks)
+        self.exact: Set[str] = set()
+        self.instances: Set[str] = set()
+        patterns: List[str] = []
+        for mask in self.masks:
+            if not is_pattern(mask):
+                self.exact.add(mask)
+            elif mask.startswith("@*@") and not is_pattern(mask[3:]):
+                self.instances.add(mask[3:])
+            else:
+                patterns.append(translate(mask))
+        self.regexp: Optional[Pattern] = (
+            regexp(str.join("|", patterns)) if patterns else None
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.masks)
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def match(self, acct: str) -> bool:
+        if acct in self.exact:
+            return True
+        if self.instances:
+            user, _, instance = acct.rpartition("@")
+            if user.startswith("@") and instance in self.instances:
+                return True
+        return self.regexp is not None and self.regexp.match(acct) is not None
+
+    def __repr__(self) -> str:
+        return "AccountMatcher({!r})".format(self.masks)
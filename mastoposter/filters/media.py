@@ -20,6 +20,8 @@ from mastoposter.types import Status
 
 
 class MediaFilter(BaseFilter, filter_name="media"):
+    status_fields = frozenset(("media_attachments",))
+
     def __init__(
         self,
         valid_media: Set[str],
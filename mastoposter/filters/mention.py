@@ -15,18 +15,21 @@ GNU General Public License for more details.
 
 from configparser import SectionProxy
 from re import Pattern, compile as regexp
-from typing import ClassVar, Set
+from typing import Any, ClassVar, Dict, Optional, Set
 from fnmatch import fnmatch
 from mastoposter.filters.base import BaseFilter
+from mastoposter.filters.matcher import AccountMatcher
 from mastoposter.types import Status
 
 
 class MentionFilter(BaseFilter, filter_name="mention"):
     MENTION_REGEX: ClassVar[Pattern] = regexp(r"@([^@]+)(@([^@]+))?")
+    status_fields = frozenset(("mentions",))
 
     def __init__(self, accounts: Set[str]):
         super().__init__()
         self.accounts = accounts
+        self.matcher = AccountMatcher(accounts)
 
     @classmethod
     def from_section(cls, section: SectionProxy) -> "MentionFilter":
@@ -39,15 +42,17 @@ class MentionFilter(BaseFilter, filter_name="mention"):
     def __call__(self, status: Status) -> bool:
         if not self.accounts and status.mentions:
             return True
-        # XXX: make it better somehow. and faster. and stronger.
         return any(
-            (
-                any(
-                    self.check_account(mention.acct, mask)
-                    for mask in self.accounts
-                )
-                for mention in status.mentions
-            )
+            self.matcher.match("@" + mention.acct)
+            for mention in status.mentions
+        )
+
+    def check_raw(self, data: Dict[str, Any]) -> Optional[bool]:
+        mentions = data.get("mentions") or []
+        if not self.accounts and mentions:
+            return True
+        return any(
+            self.matcher.match("@" + mention["acct"]) for mention in mentions
         )
 
     def __repr__(self):
@@ -20,6 +20,8 @@ from mastoposter.types import Status
 
 
 class SpoilerFilter(BaseFilter, filter_name="spoiler"):
+    status_fields = frozenset(("spoiler_text",))
+
     def __init__(self, regex: str = "^.*$"):
         super().__init__()
         self.regexp: Pattern = regexp(regex)
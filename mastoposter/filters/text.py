@@ -15,31 +15,68 @@ GNU General Public License for more details.
 
 from configparser import SectionProxy
 from re import Pattern, compile as regexp
-from typing import Optional, Set
+from typing import FrozenSet, Optional, Set
 
 from mastoposter.filters.base import BaseFilter
+from mastoposter.filters.keywords import KeywordMatcher, load_keywords
+from mastoposter.text import VALID_OUTPUT_TYPES
 from mastoposter.types import Status
 
 
 class TextFilter(BaseFilter, filter_name="content"):
     def __init__(
-        self, regex: Optional[str] = None, tags: Optional[Set[str]] = None
+        self,
+        regex: Optional[str] = None,
+        tags: Optional[Set[str]] = None,
+        keywords: Optional[KeywordMatcher] = None,
     ):
         super().__init__()
-        assert regex is not None or tags
+        assert regex is not None or tags or keywords is not None
 
         self.tags: Optional[Set[str]] = tags
         self.regexp: Optional[Pattern] = regexp(regex) if regex else None
+        self.keywords: Optional[KeywordMatcher] = keywords
 
     @classmethod
     def from_section(cls, section: SectionProxy) -> "TextFilter":
-        if "regexp" in section and "tags" in section:
-            raise AssertionError("you can't use both tags and regexp")
+        modes = {"regexp", "tags", "keywords", "keywords_file"} & set(
+            section.keys()
+        )
+        if len(modes) > 1:
+            raise AssertionError(
+                "you can use only one of regexp, tags or keywords"
+            )
         elif "regexp" in section:
             return cls(regex=section["regexp"])
         elif "tags" in section:
             return cls(tags=set(section["tags"].split()))
-        raise AssertionError("neither regexp or tags were set")
+        elif "keywords" in section or "keywords_file" in section:
+            return cls(
+                keywords=KeywordMatcher(
+                    (
+                        load_keywords(section["keywords_file"])
+                        if "keywords_file" in section
+                        else section["keywords"].strip().splitlines()
+                    ),
+                    ignore_case=section.getboolean("ignore_case", True),
+                    whole_words=section.getboolean("whole_words", False),
+                )
+            )
+        raise AssertionError("neither regexp, tags or keywords were set")
+
+    @property
+    def content_formats(self) -> FrozenSet[VALID_OUTPUT_TYPES]:
+        if self.tags:
+            return frozenset()
+        return frozenset(("plain",))
+
+    @property
+    def status_fields(self) -> FrozenSet[str]:
+        if self.tags:
+            return frozenset(("reblog_or_status.tags",))
+        return frozenset(
+            ("reblog_or_status.content", "reblog_or_status.spoiler_text")
+        )
 
     def __call__(self, status: Status) -> bool:
         source = status.reblog or status
@@ -47,8 +84,15 @@ class TextFilter(BaseFilter, filter_name="content"):
             return self.regexp.search(source.content_plaintext) is not None
         elif self.tags:
             return len(self.tags & {t.name.lower() for t in source.tags}) > 0
+        elif self.keywords is not None:
+            return (
+                self.keywords.search(
+                    source.spoiler_text + "\n" + source.content_plaintext
+                )
+                is not None
+            )
         else:
-            raise ValueError("Neither regexp or tags were set. Why?")
+            raise ValueError("Neither regexp, tags or keywords were set. Why?")
 
     def __repr__(self):
         if self.regexp is not None:
@@ -63,4 +107,10 @@ class TextFilter(BaseFilter, filter_name="content"):
                 name=self.filter_name,
                 tags=self.tags,
             )
+        elif self.keywords is not None:
+            return str.format(
+                "Filter:{name}(keywords={keywords!r})",
+                name=self.filter_name,
+                keywords=self.keywords,
+            )
         return "Filter:{name}(invalid)".format(name=self.filter_name)
@@ -14,12 +14,14 @@ GNU General Public License for more details.
 """
 
 from configparser import SectionProxy
-from typing import Set
+from typing import Any, Dict, Optional, Set
 from mastoposter.filters.base import BaseFilter
 from mastoposter.types import Status
 
 
 class VisibilityFilter(BaseFilter, filter_name="visibility"):
+    status_fields = frozenset(("visibility",))
+
     def __init__(self, options: Set[str]):
         super().__init__()
         self.options = options
@@ -31,5 +33,8 @@ class VisibilityFilter(BaseFilter, filter_name="visibility"):
     def __call__(self, status: Status) -> bool:
         return status.visibility in self.options
 
+    def check_raw(self, data: Dict[str, Any]) -> Optional[bool]:
+        return data.get("visibility") in self.options
+
     def __repr__(self):
         return str.format("Filter:{}({})", self.filter_name, self.options)
@@ -0,0 +1,119 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from logging import getLogger
+from random import uniform
+from time import monotonic
+from typing import Optional
+
+logger = getLogger("health")
+
+
+class Backoff:
+    # Capped exponential backoff with full jitter: the n-th delay in a row
+    # is random between 0 and min(cap, base * 2 ** n)
+    def __init__(self, base: float = 1.0, cap: float = 300.0):
+        self.base = base
+        self.cap = max(base, cap)
+        self.attempt: int = 0
+
+    def next_delay(self) -> float:
+        ceiling = min(self.cap, self.base * 2 ** min(self.attempt, 32))
+        self.attempt += 1
+        return uniform(0, ceiling)
+
+    def reset(self):
+        self.attempt = 0
+
+    def __repr__(self) -> str:
+        return "<Backoff base={base} cap={cap} attempt={attempt}>".format(
+            base=self.base, cap=self.cap, attempt=self.attempt
+        )
+
+
+class ConnectionHealth:
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.connects: int = 0
+        self.reconnects: int = 0
+        self.failures: int = 0
+        self.frames: int = 0
+        self.connect_latency: Optional[float] = None
+        self.connected_at: Optional[float] = None
+        self.last_frame_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._session_frames: int = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.connected_at is not None
+
+    @property
+    def uptime(self) -> float:
+        if self.connected_at is None:
+            return 0.0
+        return monotonic() - self.connected_at
+
+    @property
+    def frame_rate(self) -> float:
+        # frames per second over the current connection
+        uptime = self.uptime
+        return self._session_frames / uptime if uptime > 0 else 0.0
+
+    @property
+    def last_frame_age(self) -> Optional[float]:
+        if self.last_frame_at is None:
+            return None
+        return monotonic() - self.last_frame_at
+
+    def on_connect(self, latency: float):
+        if self.connects:
+            self.reconnects += 1
+        self.connects += 1
+        self.connect_latency = latency
+        self.connected_at = monotonic()
+        self._session_frames = 0
+        logger.info("%s: connected in %.3fs", self.name, latency)
+
+    def on_frame(self):
+        self.frames += 1
+        self._session_frames += 1
+        self.last_frame_at = monotonic()
+
+    def on_disconnect(self, error: Optional[BaseException] = None) -> float:
+        uptime = self.uptime
+        self.connected_at = None
+        if error is not None:
+            self.failures += 1
+            self.last_error = repr(error)
+        logger.info(
+            "%s: disconnected after %.1fs, %r", self.name, uptime, self
+        )
+        return uptime
+
+    def __repr__(self) -> str:
+        return (
+            "<ConnectionHealth {name} connected={connected} "
+            "uptime={uptime:.1f}s connects={connects} "
+            "reconnects={reconnects} failures={failures} frames={frames}>"
+        ).format(
+            name=self.name,
+            connected=self.connected,
+            uptime=self.uptime,
+            connects=self.connects,
+            reconnects=self.reconnects,
+            failures=self.failures,
+            frames=self.frames,
+        )
@@ -13,8 +13,9 @@ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 GNU General Public License for more details.
 """
 
-from typing import List, NamedTuple
+from typing import FrozenSet, List, NamedTuple, Optional, Sequence
 from mastoposter.filters.base import FilterInstance
+from mastoposter.text import VALID_OUTPUT_TYPES
 
 from mastoposter.integrations.base import BaseIntegration
 from .telegram import TelegramIntegration  # NOQA
@@ -24,3 +25,26 @@ from .discord import DiscordIntegration  # NOQA
 class FilteredIntegration(NamedTuple):
     sink: BaseIntegration
     filters: List[FilterInstance]
+    name: str = ""
+    # Names of the sources this module receives statuses from, or all
+    sources: Optional[FrozenSet[str]] = None
+
+    @property
+    def content_formats(self) -> FrozenSet[VALID_OUTPUT_TYPES]:
+        return self.sink.content_formats.union(
+            *(f.filter.content_formats for f in self.filters)
+        )
+
+    @property
+    def status_fields(self) -> Optional[FrozenSet[str]]:
+        fields = self.sink.status_fields
+        for fil in self.filters:
+            if fields is None or fil.filter.status_fields is None:
+                return None
+            fields |= fil.filter.status_fields
+        return fields
+
+    def accepts(self, sources: Sequence[str]) -> bool:
+        if self.sources is None or not sources:
+            return True
+        return not self.sources.isdisjoint(sources)
@@ -14,17 +14,58 @@ GNU General Public License for more details.
 """
 
 from abc import ABC, abstractmethod
+from asyncio import TimeoutError as AsyncTimeoutError
 from configparser import SectionProxy
-from typing import Optional
+from typing import FrozenSet, Optional, Sequence
 
+from httpx import HTTPStatusError, TransportError
+
+from mastoposter.text import VALID_OUTPUT_TYPES
 from mastoposter.types import Status
 
 
+class DeliveryError(Exception):
+    # A post the API refused. Rate limits and server errors may pass later,
+    # anything else would fail the same way every time it's retried.
+    # When some targets did get the post, only `targets` are to be retried.
+    def __init__(
+        self,
+        message: str,
+        retryable: bool = False,
+        targets: Sequence[str] = (),
+    ):
+        super().__init__(message)
+        self.retryable = retryable
+        self.targets = targets
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, DeliveryError):
+        return error.retryable
+    if isinstance(error, HTTPStatusError):
+        code = error.response.status_code
+        return code == 429 or code >= 500
+    return isinstance(error, (TransportError, OSError, AsyncTimeoutError))
+
+
 class BaseIntegration(ABC):
+    # module name from the config, used as a metrics label
+    name: str = ""
+
     # TODO: make a registry of integrations
     def __init__(self):
         pass
 
+    @property
+    def content_formats(self) -> FrozenSet[VALID_OUTPUT_TYPES]:
+        # Status.content_* formats the integration reads
+        return frozenset()
+
+    @property
+    def status_fields(self) -> Optional[FrozenSet[str]]:
+        # Status attribute paths the integration reads, None if unknown
+        return None
+
     @classmethod
     def from_section(cls, section: SectionProxy) -> "BaseIntegration":
         raise NotImplementedError
@@ -32,3 +73,9 @@ class BaseIntegration(ABC):
     @abstractmethod
     async def __call__(self, status: Status) -> Optional[str]:
         raise NotImplementedError
+
+    async def retry(
+        self, status: Status, targets: Sequence[str]
+    ) -> Optional[str]:
+        # Posts again to some of the targets only, to all of them by default
+        return await self(status)
@@ -14,11 +14,16 @@ GNU General Public License for more details.
 """
 
 from configparser import SectionProxy
+from dataclasses import replace
 from logging import getLogger
-from typing import List, Optional
-from httpx import AsyncClient, AsyncHTTPTransport
+from typing import ClassVar, Dict, List, Optional
+from httpx import AsyncClient, Headers
 from zlib import crc32
+from mastoposter.clients import PoolConfig, get_client
 from mastoposter.integrations.base import BaseIntegration
+from mastoposter.metrics import STAGE_SECONDS
+from mastoposter.offload import convert
+from mastoposter.ratelimit import HeaderBucket
 from mastoposter.integrations.discord.types import (
     DiscordEmbed,
     DiscordEmbedAuthor,
@@ -30,13 +35,70 @@ logger = getLogger("integrations.discord")
 
 
 class DiscordIntegration(BaseIntegration):
-    def __init__(self, webhook: str, retries: int = 5):
+    buckets: ClassVar[Dict[str, HeaderBucket]] = {}
+    bucket_ids: ClassVar[Dict[str, HeaderBucket]] = {}
+    content_formats = frozenset(("markdown",))
+    status_fields = frozenset(
+        (
+            "link",
+            "account.acct",
+            "account.avatar_static",
+            "reblog_or_status.content",
+            "reblog_or_status.spoiler_text",
+            "reblog_or_status.created_at",
+            "reblog_or_status.media_attachments",
+            "reblog_or_status.account.acct",
+            "reblog_or_status.account.display_name",
+            "reblog_or_status.account.url",
+            "reblog_or_status.account.avatar_static",
+            "reblog_or_status.account.id",
+        )
+    )
+
+    def __init__(
+        self,
+        webhook: str,
+        retries: int = 5,
+        pool: Optional[PoolConfig] = None,
+    ):
         self.webhook = webhook
         self.retries = retries
+        self.pool = pool or PoolConfig(retries=retries)
 
     @classmethod
     def from_section(cls, section: SectionProxy) -> "DiscordIntegration":
-        return cls(section["webhook"], section.getint("retries", 5))
+        retries = section.getint("retries", 5)
+        return cls(
+            section["webhook"],
+            retries,
+            replace(PoolConfig.from_section(section), retries=retries),
+        )
+
+    @property
+    def client(self) -> AsyncClient:
+        return get_client(self.webhook, self.pool)
+
+    @property
+    def bucket_key(self) -> str:
+        return self.webhook.split("?", 1)[0]
+
+    @property
+    def bucket(self) -> HeaderBucket:
+        key = self.bucket_key
+        if key not in self.buckets:
+            webhook_id = key.split("/webhooks/")[-1].split("/")[0]
+            self.buckets[key] = HeaderBucket("discord:" + webhook_id)
+        return self.buckets[key]
+
+    def _track_bucket(self, bucket: HeaderBucket, headers: Headers):
+        bucket.update(headers)
+        if (bucket_id := headers.get("x-ratelimit-bucket")) is None:
+            return
+        shared = self.bucket_ids.setdefault(bucket_id, bucket)
+        if shared is not bucket:
+            logger.debug("%s shares bucket %s", self.bucket_key, bucket_id)
+            shared.update(headers)
+            self.buckets[self.bucket_key] = shared
 
     async def execute_webhook(
         self,
@@ -45,35 +107,50 @@ class DiscordIntegration(BaseIntegration):
         avatar_url: Optional[str] = None,
         embeds: Optional[List[DiscordEmbed]] = None,
     ) -> None:
-        async with AsyncClient(
-            transport=AsyncHTTPTransport(retries=self.retries)
-        ) as c:
-            json = {
-                "content": content,
-                "username": username,
-                "avatar_url": avatar_url,
-                "embeds": (
-                    [embed.asdict() for embed in embeds]
-                    if embeds is not None
-                    else []
-                ),
-            }
-
-            logger.debug("Executing webhook with %r", json)
+        json = {
+            "content": content,
+            "username": username,
+            "avatar_url": avatar_url,
+            "embeds": (
+                [embed.asdict() for embed in embeds]
+                if embeds is not None
+                else []
+            ),
+        }
+
+        logger.debug("Executing webhook with %r", json)
+
+        for attempt in range(self.retries + 1):
+            bucket = self.bucket
+            async with bucket.lock:
+                await bucket.wait()
+                response = await self.client.post(self.webhook, json=json)
+                self._track_bucket(bucket, response.headers)
+            if response.status_code != 429:
+                break
+            retry_after = float(response.json().get("retry_after", 1.0))
+            logger.warning(
+                "Discord rate limit hit, retrying in %.3fs (attempt %d)",
+                retry_after,
+                attempt + 1,
+            )
+            self.bucket.pause(retry_after)
 
-            result = (
-                await c.post(
-                    self.webhook,
-                    json=json,
-                )
-            ).json()
-            logger.debug("Result: %r", result)
+        if response.is_error:
+            logger.error(
+                "Discord error %d: %s", response.status_code, response.text
+            )
+            # Raised so the delivery isn't marked as done in the outbox
+            response.raise_for_status()
+        if response.content:
+            logger.debug("Result: %r", response.json())
 
     async def __call__(self, status: Status) -> Optional[str]:
         source = status.reblog or status
         embeds: List[DiscordEmbed] = []
 
-        text = source.content_markdown
+        with STAGE_SECONDS.time(stage="render", module=self.name):
+            text = await convert(source, "markdown")
         if source.spoiler_text:
             text = f"{source.spoiler_text}\n||{text}||"
 
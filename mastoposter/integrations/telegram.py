@@ -13,14 +13,51 @@ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 GNU General Public License for more details.
 """
 
+from asyncio import Lock, Task, create_task, gather, wait
+from collections import OrderedDict
 from configparser import SectionProxy
+from contextlib import AsyncExitStack, asynccontextmanager
 from dataclasses import dataclass
+from functools import partial
+from json import dumps
 from logging import getLogger
-from typing import Any, List, Mapping, Optional, Tuple
-from httpx import AsyncClient, AsyncHTTPTransport
+from posixpath import basename
+from secrets import token_hex
+from tempfile import SpooledTemporaryFile
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    ClassVar,
+    Coroutine,
+    Dict,
+    FrozenSet,
+    IO,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+from urllib.parse import urlsplit
+from httpx import AsyncClient
 from jinja2 import Template
-from mastoposter.integrations.base import BaseIntegration
-from mastoposter.types import Attachment, Poll, Status
+from mastoposter.clients import PoolConfig, get_client
+from mastoposter.integrations.base import (
+    BaseIntegration,
+    DeliveryError,
+    is_retryable,
+)
+from mastoposter.metrics import STAGE_SECONDS
+from mastoposter.offload import render_status
+from mastoposter.ratelimit import TokenBucket
+from mastoposter.templates import get_template, template_fields
+from mastoposter.text import VALID_OUTPUT_TYPES
+from mastoposter.types import CONTENT_ATTRS, Attachment, Poll, Status
 from emoji import emojize
 
 
@@ -33,6 +70,8 @@ class TGResponse:
     params: dict
     result: Optional[Any] = None
     error: Optional[str] = None
+    error_code: Optional[int] = None
+    retry_after: Optional[float] = None
 
     @classmethod
     def from_dict(cls, data: dict, params: dict) -> "TGResponse":
@@ -41,10 +80,118 @@ class TGResponse:
             params=params,
             result=data.get("result"),
             error=data.get("description"),
+            error_code=data.get("error_code"),
+            retry_after=data.get("parameters", {}).get("retry_after"),
         )
 
 
-API_URL: str = "https://api.telegram.org/bot{}/{}"
+FileKey = Tuple[str, str, str]
+
+
+def _discard(task: "Task[IO[bytes]]"):
+    # Cancels a download that's no longer needed, or closes what it fetched
+    if task.cancel():
+        return
+    if not task.cancelled() and task.exception() is None:
+        task.result().close()
+
+
+class FileIdCache:
+    # file_ids of media that was already uploaded, keyed by (bot, attachment
+    # id, url) since a file_id can only be used by the bot that got it
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits: int = 0
+        self.uploads: int = 0
+        self._ids: "OrderedDict[FileKey, str]" = OrderedDict()
+        self._locks: Dict[FileKey, Tuple[Lock, int]] = {}
+        self._fetches: Dict[FileKey, Tuple["Task[IO[bytes]]", int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get(self, key: FileKey) -> Optional[str]:
+        file_id = self._ids.get(key)
+        if file_id is not None:
+            self._ids.move_to_end(key)
+        return file_id
+
+    def put(self, key: FileKey, file_id: str):
+        self._ids[key] = file_id
+        self._ids.move_to_end(key)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+        self.uploads += 1
+
+    @asynccontextmanager
+    async def locked(self, key: FileKey) -> AsyncIterator[None]:
+        # Only one chat uploads the file, the others wait for its file_id
+        lock, users = self._locks.get(key, (Lock(), 0))
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users > 1:
+                self._locks[key] = (lock, users - 1)
+            else:
+                del self._locks[key]
+
+    def fetch(
+        self,
+        key: FileKey,
+        download: Callable[[], Coroutine[Any, Any, IO[bytes]]],
+    ) -> "Task[IO[bytes]]":
+        # Chats posting the same media at once share one download of it,
+        # each one has to release it when done
+        task, users = self._fetches.get(key, (None, 0))
+        if task is None:
+            task = create_task(download())
+        self._fetches[key] = (task, users + 1)
+        return task
+
+    def release(self, key: FileKey):
+        task, users = self._fetches[key]
+        if users > 1:
+            self._fetches[key] = (task, users - 1)
+        else:
+            del self._fetches[key]
+            _discard(task)
+
+    def __repr__(self) -> str:
+        return (
+            "<FileIdCache size={size} hits={hits} uploads={uploads}>"
+        ).format(
+            size=len(self),
+            hits=self.hits,
+            uploads=self.uploads,
+        )
+
+
+class TelegramChat(NamedTuple):
+    chat_id: str
+    silent: bool
+    bucket: TokenBucket
+    template: Template
+    # the source is needed to render the template in another process
+    template_source: Optional[str] = None
+
+
+def _file_id(message: Dict[str, Any], kind: str) -> Optional[str]:
+    media = message.get(kind)
+    if isinstance(media, list):  # photos come in several sizes
+        media = media[-1] if media else None
+    return media.get("file_id") if media else None
+
+
+def _form_value(value: Any) -> str:
+    return value if isinstance(value, str) else dumps(value)
+
+
+API_SERVER: str = "https://api.telegram.org"
+API_URL: str = API_SERVER + "/bot{}/{}"
+BOT_RATE_LIMIT: float = 30.0
 MEDIA_COMPATIBILITY: Mapping[str, set] = {
     "image": {"image", "video"},
     "video": {"image", "video"},
@@ -66,6 +213,38 @@ MEDIA_SPOILER_SUPPORT: Mapping[str, bool] = {
     "audio": False,
     "unknown": False,
 }
+MEDIA_GROUP_SIZE: int = 10
+# prefetched media is kept in memory up to this size, then on disk
+SPOOL_SIZE: int = 8 << 20
+CHUNK_SIZE: int = 64 << 10
+
+
+def plan_media_groups(media: Iterable[Attachment]) -> List[List[Attachment]]:
+    # Splits attachments into media groups of up to MEDIA_GROUP_SIZE items
+    # of compatible types. Each attachment goes to the first group that can
+    # still take it, which is what taking compatible attachments round after
+    # round gives, but in one pass.
+    groups: List[Tuple[Set[str], List[Attachment]]] = []
+    for attachment in media:
+        if attachment.type not in MEDIA_COMPATIBILITY:
+            logger.warning(
+                "attachment %r is not in %r",
+                attachment.type,
+                MEDIA_COMPATIBILITY,
+            )
+            continue
+        for allowed, group in groups:
+            if attachment.type in allowed and len(group) < MEDIA_GROUP_SIZE:
+                allowed &= MEDIA_COMPATIBILITY[attachment.type]
+                group.append(attachment)
+                break
+        else:
+            groups.append(
+                (set(MEDIA_COMPATIBILITY[attachment.type]), [attachment])
+            )
+    return [group for _, group in groups]
+
+
 DEFAULT_TEMPLATE: str = """\
 {% if status.reblog %}\
 Boost from <a href="{{status.reblog.account.url}}">\
@@ -80,224 +259,653 @@ Boost from <a href="{{status.reblog.account.url}}">\
 
 
 class TelegramIntegration(BaseIntegration):
+    buckets: Dict[Tuple[str, str], TokenBucket] = {}
+    file_ids: ClassVar[FileIdCache] = FileIdCache()
+
     def __init__(
         self,
         token: str,
-        chat_id: str,
-        template: Optional[Template] = None,
+        chat_id: Union[str, Sequence[str]],
+        template: Union[str, Template, None] = None,
         silent: bool = True,
         retries: int = 5,
+        pool: Optional[PoolConfig] = None,
+        rate_limit: float = 1.0,
+        rate_burst: float = 3.0,
+        api_server: str = API_SERVER,
+        upload_media: bool = False,
     ):
         self.token = token
-        self.chat_id = chat_id
         self.silent = silent
         self.retries = retries
+        self.pool = pool or PoolConfig(retries=retries)
+        self.api_url = api_server.rstrip("/") + "/bot{}/{}"
+        self.upload_media = upload_media
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+
+        bot_uid = token.split(":")[0]
+        self.bot_bucket = self.buckets.setdefault(
+            (token, ""),
+            TokenBucket(BOT_RATE_LIMIT, BOT_RATE_LIMIT, f"tg:{bot_uid}"),
+        )
 
         if template is None:
-            self.template = Template(emojize(DEFAULT_TEMPLATE))
-        else:
-            self.template = template
+            template = emojize(DEFAULT_TEMPLATE)
+        self.template, self.template_source = self._load_template(template)
+
+        self.chats: List[TelegramChat] = []
+        for chat in [chat_id] if isinstance(chat_id, str) else chat_id:
+            self.add_chat(chat)
+
+    @staticmethod
+    def _load_template(
+        template: Union[str, Template],
+    ) -> Tuple[Template, Optional[str]]:
+        if isinstance(template, str):
+            return get_template(template), template
+        return template, None
+
+    def add_chat(
+        self,
+        chat_id: str,
+        template: Union[str, Template, None] = None,
+        silent: Optional[bool] = None,
+        rate_limit: Optional[float] = None,
+        rate_burst: Optional[float] = None,
+    ) -> TelegramChat:
+        # Chats share the integration settings unless they're overridden
+        bot_uid = self.token.split(":")[0]
+        rate = self.rate_limit if rate_limit is None else rate_limit
+        burst = self.rate_burst if rate_burst is None else rate_burst
+        bucket = self.buckets.setdefault(
+            (self.token, chat_id),
+            TokenBucket(rate, burst, f"tg:{bot_uid}:{chat_id}"),
+        )
+        # Modules posting to the same chat with the same bot share a bucket,
+        # the first one to create it sets the limits
+        if (bucket.rate, bucket.capacity) != (rate, max(1.0, burst)):
+            logger.warning(
+                "%s is already limited to %s/s (burst %s), "
+                "ignoring rate-limit=%s and rate-burst=%s",
+                bucket.name,
+                bucket.rate,
+                bucket.capacity,
+                rate,
+                burst,
+            )
+        chat = TelegramChat(
+            chat_id,
+            self.silent if silent is None else silent,
+            bucket,
+            *(
+                (self.template, self.template_source)
+                if template is None
+                else self._load_template(template)
+            ),
+        )
+        self.chats.append(chat)
+        return chat
+
+    @property
+    def chat_id(self) -> str:
+        return self.chats[0].chat_id
+
+    @property
+    def chat_bucket(self) -> TokenBucket:
+        return self.chats[0].bucket
+
+    @property
+    def content_formats(self) -> FrozenSet[VALID_OUTPUT_TYPES]:
+        formats: FrozenSet[VALID_OUTPUT_TYPES] = frozenset()
+        for chat in self.chats:
+            if chat.template_source is None:
+                formats |= {"html"}
+                continue
+            formats |= {
+                type_
+                for type_, attr in CONTENT_ATTRS.items()
+                if attr in chat.template_source
+            }
+        return formats
+
+    @property
+    def status_fields(self) -> Optional[FrozenSet[str]]:
+        fields: FrozenSet[str] = frozenset(
+            (
+                "reblog_or_status.media_attachments",
+                "reblog_or_status.poll",
+                "reblog_or_status.sensitive",
+            )
+        )
+        for chat in self.chats:
+            if chat.template_source is None:
+                return None
+            used = template_fields(chat.template_source)
+            if used is None:
+                return None
+            fields |= used
+        return fields
 
     @classmethod
     def from_section(cls, section: SectionProxy) -> "TelegramIntegration":
-        return cls(
+        integration = cls(
             token=section["token"],
-            chat_id=section["chat"],
-            template=Template(
-                emojize(section.get("template", DEFAULT_TEMPLATE))
-            ),
+            chat_id=(),
+            template=emojize(section.get("template", DEFAULT_TEMPLATE)),
             silent=section.getboolean("silent", True),
             retries=section.getint("http_retries", 5),
+            pool=PoolConfig.from_section(section),
+            rate_limit=section.getfloat("rate_limit", 1.0),
+            rate_burst=section.getfloat("rate_burst", 3.0),
+            api_server=section.get("api_server", API_SERVER),
+            upload_media=section.getboolean("upload_media", False),
         )
+        # Several chats can be listed, each of them can have its own
+        # [module/<name>/<chat>] section with overrides
+        for chat_id in section["chat"].split():
+            name = "%s/%s" % (section.name, chat_id)
+            if not section.parser.has_section(name):
+                integration.add_chat(chat_id)
+                continue
+            chat = section.parser[name]
+            integration.add_chat(
+                chat_id,
+                template=(
+                    emojize(chat["template"]) if "template" in chat else None
+                ),
+                silent=chat.getboolean("silent", None),
+                rate_limit=chat.getfloat("rate_limit", None),
+                rate_burst=chat.getfloat("rate_burst", None),
+            )
+        return integration
+
+    @property
+    def client(self) -> AsyncClient:
+        return get_client(self.api_url, self.pool)
+
+    def _file_key(self, media: Attachment) -> FileKey:
+        return (self.token.split(":")[0], media.id, media.url)
+
+    async def _multipart(
+        self,
+        boundary: str,
+        params: dict,
+        files: Dict[str, Attachment],
+        prefetched: Mapping[FileKey, IO[bytes]],
+    ) -> AsyncIterator[bytes]:
+        # Streams the attachments from the instance straight into the body
+        for name, value in params.items():
+            if value is None:
+                continue
+            yield (
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{_form_value(value)}\r\n"
+            ).encode()
+        for name, media in files.items():
+            filename = basename(urlsplit(media.url).path) or media.id
+            yield (
+                f"--{boundary}\r\n"
+                f"Content-Disposition: form-data; "
+                f'name="{name}"; filename="{filename}"\r\n'
+                "Content-Type: application/octet-stream\r\n\r\n"
+            ).encode()
+            if (body := prefetched.get(self._file_key(media))) is not None:
+                body.seek(0)
+                while chunk := body.read(CHUNK_SIZE):
+                    yield chunk
+            else:
+                source = get_client(media.url, self.pool)
+                async with source.stream("GET", media.url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes():
+                        yield chunk
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
 
     async def _tg_request(
-        self, client: AsyncClient, method: str, **kwargs
+        self,
+        client: AsyncClient,
+        chat: TelegramChat,
+        method: str,
+        cost: float = 1.0,
+        files: Optional[Dict[str, Attachment]] = None,
+        prefetched: Optional[Mapping[FileKey, IO[bytes]]] = None,
+        **kwargs,
     ) -> TGResponse:
-        url = API_URL.format(self.token, method)
+        url = self.api_url.format(self.token, method)
         logger.debug("TG request: %s(%r)", method, kwargs)
-        response = TGResponse.from_dict(
-            (await client.post(url, json=kwargs)).json(), kwargs
-        )
+        for attempt in range(self.retries + 1):
+            await chat.bucket.acquire(cost)
+            await self.bot_bucket.acquire(cost)
+            if files:
+                boundary = token_hex(16)
+                reply = await client.post(
+                    url,
+                    content=self._multipart(
+                        boundary, kwargs, files, prefetched or {}
+                    ),
+                    headers={
+                        "Content-Type": "multipart/form-data; boundary="
+                        + boundary
+                    },
+                )
+            else:
+                reply = await client.post(url, json=kwargs)
+            response = TGResponse.from_dict(reply.json(), kwargs)
+            if response.ok or response.retry_after is None:
+                break
+            logger.warning(
+                "TG flood control on %s, retrying in %ss (attempt %d)",
+                method,
+                response.retry_after,
+                attempt + 1,
+            )
+            chat.bucket.pause(response.retry_after)
         if not response.ok:
             logger.error("TG error: %r", response.error)
             logger.error("parameters: %r", kwargs)
-        else:
-            logger.debug("Result: %r", response.result)
+            # Raised so the delivery isn't marked as done in the outbox
+            raise DeliveryError(
+                f"{method} failed: {response.error}",
+                retryable=response.error_code is None
+                or response.error_code == 429
+                or response.error_code >= 500,
+            )
+        logger.debug("Result: %r", response.result)
         return response
 
     async def _post_plaintext(
-        self, client: AsyncClient, text: str
+        self, client: AsyncClient, chat: TelegramChat, text: str
     ) -> TGResponse:
         logger.debug("Sending HTML message: %r", text)
         return await self._tg_request(
             client,
+            chat,
             "sendMessage",
             parse_mode="HTML",
-            disable_notification=self.silent,
+            disable_notification=chat.silent,
             disable_web_page_preview=True,
-            chat_id=self.chat_id,
+            chat_id=chat.chat_id,
             text=text,
         )
 
     async def _post_media(
         self,
         client: AsyncClient,
+        chat: TelegramChat,
         text: str,
         media: Attachment,
         spoiler: bool = False,
+        prefetched: Optional[Mapping[FileKey, IO[bytes]]] = None,
     ) -> TGResponse:
         # Just to be safe
         if media.type not in MEDIA_MAPPING:
             logger.warning(
                 "Media %r has unknown type, falling back to plaintext", media
             )
-            return await self._post_plaintext(client, text)
+            return await self._post_plaintext(client, chat, text)
 
-        return await self._tg_request(
-            client,
-            "send%s" % MEDIA_MAPPING[media.type].title(),
+        kind = MEDIA_MAPPING[media.type]
+        params: Dict[str, Any] = dict(
             parse_mode="HTML",
-            disable_notification=self.silent,
+            disable_notification=chat.silent,
             disable_web_page_preview=True,
-            chat_id=self.chat_id,
+            chat_id=chat.chat_id,
             caption=text,
-            **{MEDIA_MAPPING[media.type]: media.url},
             **(
                 {"has_spoiler": spoiler}
                 if MEDIA_SPOILER_SUPPORT.get(media.type, False)
                 else {}
             ),
         )
+        method = "send%s" % kind.title()
+        if not self.upload_media:
+            params[kind] = media.url
+            return await self._tg_request(client, chat, method, **params)
+
+        key = self._file_key(media)
+        if (file_id := self.file_ids.get(key)) is None:
+            async with self.file_ids.locked(key):
+                if (file_id := self.file_ids.get(key)) is None:
+                    response = await self._tg_request(
+                        client,
+                        chat,
+                        method,
+                        files={kind: media},
+                        prefetched=prefetched,
+                        **params,
+                    )
+                    if response.ok and response.result is not None:
+                        if new_id := _file_id(response.result, kind):
+                            self.file_ids.put(key, new_id)
+                    return response
+        self.file_ids.hits += 1
+        params[kind] = file_id
+        return await self._tg_request(client, chat, method, **params)
 
     async def _post_mediagroup(
         self,
         client: AsyncClient,
+        chat: TelegramChat,
         text: str,
         media: List[Attachment],
         spoiler: bool = False,
-    ) -> Tuple[TGResponse, List[Attachment]]:
+        prefetched: Optional[Mapping[FileKey, IO[bytes]]] = None,
+    ) -> TGResponse:
         logger.debug("Sendind media group: %r (text=%r)", media, text)
-        media_list: List[dict] = []
-        allowed_medias = {"image", "gifv", "video", "audio", "unknown"}
-        unused: List[Attachment] = []
-        for attachment in media:
-            if attachment.type not in MEDIA_COMPATIBILITY:
-                logger.warning(
-                    "attachment %r is not in %r",
-                    attachment.type,
-                    MEDIA_COMPATIBILITY,
-                )
-                continue
-
-            if attachment.type not in allowed_medias or len(media_list) >= 10:
-                unused.append(attachment)
-                continue
-
-            allowed_medias &= MEDIA_COMPATIBILITY[attachment.type]
-
-            media_list.append(
-                {
-                    "type": MEDIA_MAPPING[attachment.type],
-                    "media": attachment.url,
-                    **(
-                        {"has_spoiler": spoiler}
-                        if MEDIA_SPOILER_SUPPORT.get(attachment.type, False)
-                        else {}
-                    ),
-                }
-            )
-
-            if len(media_list) == 1:
-                media_list[0].update(
-                    {
-                        "caption": text,
-                        "parse_mode": "HTML",
-                    }
-                )
-
-        return (
-            await self._tg_request(
+        media_list: List[dict] = [
+            {
+                "type": MEDIA_MAPPING[attachment.type],
+                "media": attachment.url,
+                **(
+                    {"has_spoiler": spoiler}
+                    if MEDIA_SPOILER_SUPPORT.get(attachment.type, False)
+                    else {}
+                ),
+            }
+            for attachment in media
+        ]
+        media_list[0].update({"caption": text, "parse_mode": "HTML"})
+
+        async with AsyncExitStack() as stack:
+            files: Dict[str, Attachment] = {}
+            if self.upload_media:
+                files = await self._attach_uploads(stack, media, media_list)
+            response = await self._tg_request(
                 client,
+                chat,
                 "sendMediaGroup",
-                disable_notification=self.silent,
+                cost=len(media_list),
+                files=files,
+                prefetched=prefetched,
+                disable_notification=chat.silent,
                 disable_web_page_preview=True,
-                chat_id=self.chat_id,
+                chat_id=chat.chat_id,
                 media=media_list,
-            ),
-            unused,
-        )
+            )
+            if files and response.ok and response.result is not None:
+                for item, message in zip(media, response.result):
+                    kind = MEDIA_MAPPING[item.type]
+                    if new_id := _file_id(message, kind):
+                        self.file_ids.put(self._file_key(item), new_id)
+        return response
+
+    async def _attach_uploads(
+        self,
+        stack: AsyncExitStack,
+        used: List[Attachment],
+        media_list: List[dict],
+    ) -> Dict[str, Attachment]:
+        # Replaces urls with cached file_ids, or with attach:// references to
+        # the files that have to be uploaded. Keys are locked in sorted order
+        # so two groups sharing media can't deadlock.
+        keys = {self._file_key(item) for item in used}
+        for key in sorted(keys):
+            if self.file_ids.get(key) is None:
+                await stack.enter_async_context(self.file_ids.locked(key))
+
+        files: Dict[str, Attachment] = {}
+        for i, (item, entry) in enumerate(zip(used, media_list)):
+            if (file_id := self.file_ids.get(self._file_key(item))) is None:
+                files["file%d" % i] = item
+                entry["media"] = "attach://file%d" % i
+            else:
+                entry["media"] = file_id
+                self.file_ids.hits += 1
+        return files
+
+    async def _download(self, media: Attachment) -> IO[bytes]:
+        body = SpooledTemporaryFile(SPOOL_SIZE)
+        try:
+            source = get_client(media.url, self.pool)
+            async with source.stream("GET", media.url) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes():
+                    body.write(chunk)
+        except BaseException:
+            body.close()
+            raise
+        return body
+
+    async def _prefetch(
+        self, media: List[Attachment]
+    ) -> Dict[FileKey, IO[bytes]]:
+        # Downloads the files of a media group that will have to be uploaded,
+        # they have to be released through file_ids afterwards
+        tasks: Dict[FileKey, "Task[IO[bytes]]"] = {}
+        for item in media:
+            key = self._file_key(item)
+            if key not in tasks and self.file_ids.get(key) is None:
+                tasks[key] = self.file_ids.fetch(
+                    key, partial(self._download, item)
+                )
+        if not tasks:
+            return {}
+        try:
+            await wait(tasks.values())
+            return {key: task.result() for key, task in tasks.items()}
+        except BaseException:
+            for key in tasks:
+                self.file_ids.release(key)
+            raise
+
+    async def _post_media_groups(
+        self,
+        client: AsyncClient,
+        chat: TelegramChat,
+        text: str,
+        groups: List[List[Attachment]],
+        ids: List[int],
+        spoiler: bool = False,
+    ):
+        # Groups are sent one by one so they keep their order in the chat,
+        # while the files of the next group are downloaded in the meantime
+        prefetch: Optional[Task] = None
+        if self.upload_media:
+            prefetch = create_task(self._prefetch(groups[0]))
+        try:
+            for i, group in enumerate(groups):
+                prefetched = {} if prefetch is None else await prefetch
+                prefetch = None
+                if self.upload_media and i + 1 < len(groups):
+                    prefetch = create_task(self._prefetch(groups[i + 1]))
+                try:
+                    # Telegram wants at least two items in a media group
+                    if len(group) == 1:
+                        res = await self._post_media(
+                            client,
+                            chat,
+                            text if i == 0 else "",
+                            group[0],
+                            spoiler,
+                            prefetched,
+                        )
+                        messages = [res.result] if res.result else []
+                    else:
+                        res = await self._post_mediagroup(
+                            client,
+                            chat,
+                            text if i == 0 else "",
+                            group,
+                            spoiler,
+                            prefetched,
+                        )
+                        messages = res.result or []
+                finally:
+                    for key in prefetched:
+                        self.file_ids.release(key)
+                if res.ok:
+                    ids.extend(message["message_id"] for message in messages)
+        finally:
+            # a prefetch still running releases its files when cancelled
+            if prefetch is not None and not prefetch.cancel():
+                if not prefetch.cancelled() and prefetch.exception() is None:
+                    for key in prefetch.result():
+                        self.file_ids.release(key)
 
     async def _post_poll(
-        self, client: AsyncClient, poll: Poll, reply_to: Optional[str] = None
+        self,
+        client: AsyncClient,
+        chat: TelegramChat,
+        poll: Poll,
+        reply_to: Optional[int] = None,
     ) -> TGResponse:
         logger.debug("Sending poll: %r", poll)
         return await self._tg_request(
             client,
+            chat,
             "sendPoll",
-            disable_notification=self.silent,
+            disable_notification=chat.silent,
             disable_web_page_preview=True,
-            chat_id=self.chat_id,
+            chat_id=chat.chat_id,
             question=f"Poll:{poll.id}",
             reply_to_message_id=reply_to,
             allows_multiple_answers=poll.multiple,
             options=[opt.title for opt in poll.options],
         )
 
-    async def __call__(self, status: Status) -> Optional[str]:
-        source = status.reblog or status
+    async def _post_status(
+        self,
+        client: AsyncClient,
+        chat: TelegramChat,
+        text: str,
+        source: Status,
+    ) -> List[int]:
+        ids: List[int] = []
+        try:
+            await self._post_parts(client, chat, text, source, ids)
+        except Exception as e:
+            # Once a part is out, retrying would post it again
+            if not ids:
+                raise
+            logger.error(
+                "Only %d message(s) got posted to %s: %r",
+                len(ids),
+                chat.chat_id,
+                e,
+            )
+        return ids
 
+    async def _post_parts(
+        self,
+        client: AsyncClient,
+        chat: TelegramChat,
+        text: str,
+        source: Status,
+        ids: List[int],
+    ):
         has_spoiler = source.sensitive
-        text = self.template.render({"status": status})
-
-        ids = []
-
-        async with AsyncClient(
-            transport=AsyncHTTPTransport(retries=self.retries)
-        ) as client:
-            if not source.media_attachments:
-                if (res := await self._post_plaintext(client, text)).ok:
-                    if res.result:
-                        ids.append(res.result["message_id"])
-
-            elif len(source.media_attachments) == 1:
-                if (
-                    res := await self._post_media(
-                        client, text, source.media_attachments[0], has_spoiler
-                    )
-                ).ok and res.result is not None:
-                    ids.append(res.result["message_id"])
-            else:
-                pending, i = source.media_attachments, 0
-                while len(pending) > 0 and i < 5:
-                    res, left = await self._post_mediagroup(
-                        client, text if i == 0 else "", pending, has_spoiler
-                    )
-                    if res.ok and res.result is not None:
-                        ids.extend([msg["message_id"] for msg in res.result])
-                    pending = left
-                    i += 1
-
-            if source.poll:
-                if (
-                    res := await self._post_poll(
-                        client, source.poll, reply_to=ids[0] if ids else None
-                    )
-                ).ok and res.result:
+
+        if not source.media_attachments:
+            if (res := await self._post_plaintext(client, chat, text)).ok:
+                if res.result:
                     ids.append(res.result["message_id"])
 
-        return str.join(",", map(str, ids))
+        elif len(source.media_attachments) == 1:
+            if (
+                res := await self._post_media(
+                    client,
+                    chat,
+                    text,
+                    source.media_attachments[0],
+                    has_spoiler,
+                )
+            ).ok and res.result is not None:
+                ids.append(res.result["message_id"])
+        elif groups := plan_media_groups(source.media_attachments):
+            await self._post_media_groups(
+                client, chat, text, groups, ids, has_spoiler
+            )
+        elif (res := await self._post_plaintext(client, chat, text)).ok:
+            if res.result:
+                ids.append(res.result["message_id"])
+
+        if source.poll:
+            if (
+                res := await self._post_poll(
+                    client,
+                    chat,
+                    source.poll,
+                    reply_to=ids[0] if ids else None,
+                )
+            ).ok and res.result:
+                ids.append(res.result["message_id"])
+
+    async def __call__(self, status: Status) -> Optional[str]:
+        return await self._post(status, self.chats)
+
+    async def retry(
+        self, status: Status, targets: Sequence[str]
+    ) -> Optional[str]:
+        chats = [chat for chat in self.chats if chat.chat_id in targets]
+        return await self._post(status, chats)
+
+    async def _post(
+        self, status: Status, chats: List[TelegramChat]
+    ) -> Optional[str]:
+        source = status.reblog or status
+
+        # Every distinct template is rendered once per status, for all
+        # chats and modules using it
+        with STAGE_SECONDS.time(stage="render", module=self.name):
+            texts = await gather(
+                *[
+                    render_status(chat.template, status, chat.template_source)
+                    for chat in chats
+                ]
+            )
+
+        client = self.client
+        results = await gather(
+            *[
+                self._post_status(client, chat, text, source)
+                for chat, text in zip(chats, texts)
+            ],
+            return_exceptions=True,
+        )
+
+        if len(chats) == 1:
+            if isinstance(results[0], BaseException):
+                raise results[0]
+            return str.join(",", map(str, results[0]))
+
+        # Only the chats that failed on something that may pass are to be
+        # retried, the others already got the status
+        posted: List[str] = []
+        errors: List[BaseException] = []
+        failed: List[str] = []
+        for chat, result in zip(chats, results):
+            if isinstance(result, BaseException):
+                logger.error("Failed to post to %s: %r", chat.chat_id, result)
+                errors.append(result)
+                if is_retryable(result):
+                    failed.append(chat.chat_id)
+                result = []
+            posted.append(chat.chat_id + ":" + str.join(",", map(str, result)))
+        if errors:
+            raise DeliveryError(
+                "Failed to post to %d of %d chats (%s)"
+                % (len(errors), len(chats), str.join(";", posted)),
+                retryable=bool(failed),
+                targets=failed,
+            ) from errors[0]
+        return str.join(";", posted)
 
     def __repr__(self) -> str:
         bot_uid, key = self.token.split(":")
         return (
             "<TelegramIntegration "
-            "chat_id={chat!r} "
+            "chats={chats!r} "
             "template={template!r} "
             "token={bot_uid}:{key} "
-            "silent={silent!r}>"
+            "silent={silent!r} "
+            "upload_media={upload_media!r}>"
         ).format(
-            chat=self.chat_id,
+            chats=[chat.chat_id for chat in self.chats],
             silent=self.silent,
+            upload_media=self.upload_media,
             template=self.template,
             bot_uid=bot_uid,
             key=str.join("", ("X" for _ in key)),
@@ -0,0 +1,346 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from asyncio import AbstractServer, StreamReader, StreamWriter, start_server
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import partial
+from logging import getLogger
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+logger = getLogger("metrics")
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+LAG_BUCKETS: Tuple[float, ...] = (
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    900.0,
+    3600.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, _escape(value))
+        for name, value in zip(names, values)
+    )
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    type: str = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s %s" % (self.name, self.type),
+        ]
+        for suffix, values, value in self.samples():
+            names = self.label_names
+            if suffix == "_bucket":
+                names = names + ("le",)
+            lines.append(
+                "%s%s%s %s"
+                % (self.name, suffix, _labels(names, values), _number(value))
+            )
+        return lines
+
+    def __repr__(self) -> str:
+        return "<%s %s>" % (self.__class__.__name__, self.name)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        for key, value in self.values.items():
+            yield "", key, value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {}
+        self.callbacks: Dict[LabelValues, Callable[[], Optional[float]]] = {}
+
+    def set(self, value: float, **labels: str):
+        self.values[self._key(labels)] = value
+
+    def set_function(self, func: Callable[[], Optional[float]], **labels):
+        # evaluated when the metrics are scraped
+        self.callbacks[self._key(labels)] = func
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        yield from (("", key, value) for key, value in self.values.items())
+        for key, func in self.callbacks.items():
+            value = func()
+            if value is not None:
+                yield "", key, value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: counts per bucket (not cumulative), +Inf last
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        for key, counts in self.counts.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                yield "_bucket", key + (_number(bound),), total
+            yield "_sum", key, self.sums[key]
+            yield "_count", key, total
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise KeyError(f"metric {metric.name!r} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = Histogram(
+    "mastoposter_stage_seconds",
+    "Time spent in each processing stage",
+    ("stage", "module"),
+)
+FRAMES = Counter(
+    "mastoposter_frames_total",
+    "WebSocket frames received",
+    ("source",),
+)
+FRAME_BYTES = Counter(
+    "mastoposter_frame_bytes_total",
+    "Size of WebSocket frames received",
+    ("source",),
+)
+DELIVERIES = Counter(
+    "mastoposter_deliveries_total",
+    "Statuses passed to integrations",
+    ("module", "outcome"),
+)
+DELIVERY_LAG = Histogram(
+    "mastoposter_delivery_lag_seconds",
+    "Time from status creation to the end of its delivery",
+    ("module", "outcome"),
+    LAG_BUCKETS,
+)
+PREFILTERED = Counter(
+    "mastoposter_prefilter_rejected_total",
+    "Statuses rejected before parsing",
+    ("source", "reason"),
+)
+QUEUE_DEPTH = Gauge(
+    "mastoposter_queue_depth",
+    "Statuses waiting in the delivery queue",
+)
+CONNECTION = Gauge(
+    "mastoposter_connection",
+    "Streaming connection health",
+    ("source", "field"),
+)
+PIPELINE = Gauge(
+    "mastoposter_pipeline",
+    "Delivery queue counters",
+    ("field",),
+)
+DEDUP = Gauge(
+    "mastoposter_dedup",
+    "Duplicate detection counters",
+    ("field",),
+)
+OUTBOX = Gauge(
+    "mastoposter_outbox",
+    "Outbox counters",
+    ("field",),
+)
+HTTP_CLIENT = Gauge(
+    "mastoposter_http_client",
+    "HTTP requests and connections per host",
+    ("host", "field"),
+)
+
+for _metric in (
+    STAGE_SECONDS,
+    FRAMES,
+    FRAME_BYTES,
+    DELIVERIES,
+    DELIVERY_LAG,
+    PREFILTERED,
+    QUEUE_DEPTH,
+    CONNECTION,
+    PIPELINE,
+    DEDUP,
+    OUTBOX,
+    HTTP_CLIENT,
+):
+    REGISTRY.register(_metric)
+
+
+def export_fields(
+    gauge: Gauge, obj: Any, fields: Iterable[str], **labels: str
+) -> None:
+    # attributes of obj, read when the metrics are scraped
+    for field in fields:
+        gauge.set_function(partial(getattr, obj, field), field=field, **labels)
+
+
+def lag_since(created_at: datetime) -> float:
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created_at).total_seconds()
+
+
+async def _handle(reader: StreamReader, writer: StreamWriter):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/metrics":
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            (
+                "HTTP/1.1 %s\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                "Content-Length: %d\r\n"
+                "Connection: close\r\n\r\n" % (status, len(body))
+            ).encode()
+            + body
+        )
+        await writer.drain()
+    except (ConnectionError, UnicodeDecodeError) as e:
+        logger.debug("Metrics request failed: %r", e)
+    finally:
+        writer.close()
+
+
+async def serve_metrics(address: str) -> AbstractServer:
+    host, _, port = address.rpartition(":")
+    server = await start_server(_handle, host or "127.0.0.1", int(port))
+    logger.info("Serving metrics on http://%s/metrics", address)
+    return server
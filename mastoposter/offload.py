@@ -0,0 +1,135 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from asyncio import Future, ensure_future, get_running_loop
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Literal,
+    Optional,
+    TypeVar,
+    cast,
+)
+
+from bs4 import BeautifulSoup
+from jinja2 import Template
+
+from mastoposter.templates import get_source, get_template
+from mastoposter.text import VALID_OUTPUT_TYPES, node_process_many
+from mastoposter.types import CONTENT_ATTRS, Status
+
+logger = getLogger("offload")
+
+T = TypeVar("T")
+ExecutorKind = Literal["thread", "process", "none"]
+
+kind: ExecutorKind = "thread"
+workers: Optional[int] = None
+_executor: Optional[Executor] = None
+
+
+def configure(new_kind: str = "thread", new_workers: Optional[int] = None):
+    global kind, workers
+    if new_kind not in ("thread", "process", "none"):
+        raise ValueError(f"invalid executor kind {new_kind!r}")
+    shutdown()
+    kind, workers = new_kind, new_workers  # type: ignore
+    logger.info("Rendering in %s pool (workers=%r)", kind, workers)
+
+
+def get_executor() -> Optional[Executor]:
+    global _executor
+    if _executor is None and kind != "none":
+        if kind == "process":
+            _executor = ProcessPoolExecutor(workers)
+        else:
+            _executor = ThreadPoolExecutor(workers, "render")
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def offload(func: Callable[..., T], *args: Any) -> T:
+    executor = get_executor()
+    if executor is None:
+        return func(*args)
+    return await get_running_loop().run_in_executor(executor, func, *args)
+
+
+def _convert(
+    content: str, types: FrozenSet[VALID_OUTPUT_TYPES]
+) -> Dict[VALID_OUTPUT_TYPES, str]:
+    soup = BeautifulSoup(content, features="lxml")
+    return {
+        type_: text.rstrip()
+        for type_, text in node_process_many(soup, types).items()
+    }
+
+
+def _render(source: str, context: Dict[str, Any]) -> str:
+    # Runs in the worker, so every process compiles the template only once
+    return get_template(source).render(context)
+
+
+async def convert(status: Status, type_: VALID_OUTPUT_TYPES) -> str:
+    attr = CONTENT_ATTRS[type_]
+    if attr in status.__dict__:
+        return cast(str, status.__dict__[attr])
+    if kind == "process":
+        # Status.content_* are cached_property, store the results the same
+        # way, along with the other formats that will be needed later
+        types = status.missing_formats(type_)
+        for other, text in (
+            await offload(_convert, status.content, types)
+        ).items():
+            status.__dict__[CONTENT_ATTRS[other]] = text
+        return cast(str, status.__dict__[attr])
+    return await offload(getattr, status, attr)
+
+
+async def render(
+    template: Template, context: Dict[str, Any], source: Optional[str] = None
+) -> str:
+    if source is None:
+        source = get_source(template)
+    if kind == "process" and source is not None:
+        return await offload(_render, source, context)
+    return await offload(template.render, context)
+
+
+async def render_status(
+    template: Template, status: Status, source: Optional[str] = None
+) -> str:
+    # Sinks rendering the same template for the same status share the
+    # result, even while the first render is still running
+    renders: Dict[Any, "Future[str]"] = status.__dict__.setdefault(
+        "_renders", {}
+    )
+    key = template.name or id(template)
+    if key not in renders:
+        renders[key] = ensure_future(
+            render(template, {"status": status}, source)
+        )
+    return await renders[key]
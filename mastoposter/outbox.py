@@ -0,0 +1,288 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from asyncio import Future, Task, create_task, get_running_loop, sleep
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from pickle import dumps, loads
+from sqlite3 import Connection, connect
+from time import time
+from typing import (
+    Any,
+    Callable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from mastoposter.types import Status
+
+logger = getLogger("outbox")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status_id TEXT NOT NULL,
+    module TEXT NOT NULL,
+    status BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    done_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    targets TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (id) WHERE done_at IS NULL;
+"""
+
+
+# columns added after the first version of the schema
+COLUMNS = [
+    ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+    ("targets", "TEXT"),
+]
+
+
+class OutboxJob(NamedTuple):
+    id: int
+    module: str
+    status: Status
+    # failed deliveries so far
+    attempts: int = 0
+    # targets of the module still waiting for the status, or all of them
+    targets: Optional[List[str]] = None
+
+
+class Outbox:
+    def __init__(
+        self,
+        path: str,
+        batch_delay: float = 0.01,
+        retention: float = 86400.0,
+        max_attempts: int = 5,
+    ):
+        self.path = path
+        self.batch_delay = batch_delay
+        self.retention = retention
+        self.max_attempts = max(1, max_attempts)
+
+        self.added: int = 0
+        self.completed: int = 0
+        self.retried: int = 0
+        self.dropped: int = 0
+        self.flushes: int = 0
+
+        self._db: Optional[Connection] = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="outbox")
+        self._new: List[Tuple[Tuple[str, str, bytes, float], Future]] = []
+        self._done: List[int] = []
+        self._failed: List[Tuple[Optional[str], int]] = []
+        # jobs being delivered right now, pending() leaves them out
+        self._active: Set[int] = set()
+        self._flush_task: Optional[Task] = None
+
+    async def _run(self, func: Callable[..., Any], *args) -> Any:
+        return await get_running_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    def _open(self):
+        self._db = connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        columns = [
+            row[1] for row in self._db.execute("PRAGMA table_info(jobs)")
+        ]
+        # outboxes made by older versions
+        for column, definition in COLUMNS:
+            if column not in columns:
+                self._db.execute(
+                    f"ALTER TABLE jobs ADD COLUMN {column} {definition}"
+                )
+        self._db.execute(
+            "DELETE FROM jobs WHERE done_at < ?", (time() - self.retention,)
+        )
+        self._db.commit()
+
+    async def open(self):
+        await self._run(self._open)
+        logger.info("Opened outbox %s", self.path)
+
+    def _pending(self) -> List[Tuple[int, str, bytes, int, Optional[str]]]:
+        assert self._db is not None
+        return self._db.execute(
+            "SELECT id, module, status, attempts, targets FROM jobs "
+            "WHERE done_at IS NULL ORDER BY id"
+        ).fetchall()
+
+    async def pending(self) -> List[OutboxJob]:
+        # Unfinished jobs nobody is delivering, they count as being
+        # delivered until done() or failed() is called for them
+        await self.flush()
+        jobs: List[OutboxJob] = []
+        for job_id, module, data, attempts, targets in await self._run(
+            self._pending
+        ):
+            if job_id in self._active:
+                continue
+            self._active.add(job_id)
+            try:
+                jobs.append(
+                    OutboxJob(
+                        job_id,
+                        module,
+                        loads(data),
+                        attempts,
+                        None if targets is None else targets.split(),
+                    )
+                )
+            except Exception as e:
+                logger.error("Job #%d can't be loaded: %r", job_id, e)
+                self.done(job_id)
+        return jobs
+
+    def _write(
+        self,
+        new: List[Tuple[str, str, bytes, float]],
+        done: List[int],
+        failed: List[Tuple[Optional[str], int]],
+    ) -> List[int]:
+        assert self._db is not None
+        ids: List[int] = []
+        with self._db:
+            for row in new:
+                cursor = self._db.execute(
+                    "INSERT INTO jobs (status_id, module, status, created_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    row,
+                )
+                ids.append(cursor.lastrowid or 0)
+            self._db.executemany(
+                "UPDATE jobs SET attempts = attempts + 1, "
+                "targets = COALESCE(?, targets) WHERE id = ?",
+                failed,
+            )
+            now = time()
+            self._db.executemany(
+                "UPDATE jobs SET done_at = ? WHERE id = ?",
+                [(now, job_id) for job_id in done],
+            )
+        return ids
+
+    async def _flush_later(self):
+        await sleep(self.batch_delay)
+        self._flush_task = None
+        await self.flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = create_task(self._flush_later())
+
+    async def flush(self):
+        new, self._new = self._new, []
+        done, self._done = self._done, []
+        failed, self._failed = self._failed, []
+        if not new and not done and not failed:
+            return
+        try:
+            ids = await self._run(
+                self._write, [row for row, _ in new], done, failed
+            )
+        except Exception as e:
+            logger.exception("Failed to write to the outbox: %r", e)
+            for _, future in new:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.flushes += 1
+        logger.debug("Outbox flush: %d new, %d done", len(new), len(done))
+        for job_id, (_, future) in zip(ids, new):
+            if not future.done():
+                future.set_result(job_id)
+
+    async def add(self, status: Status, modules: List[str]) -> List[int]:
+        if not modules:
+            return []
+        data, now = dumps(status), time()
+        loop = get_running_loop()
+        futures: List[Future] = []
+        for module in modules:
+            futures.append(loop.create_future())
+            self._new.append(((status.id, module, data, now), futures[-1]))
+        self.added += len(modules)
+        self._schedule_flush()
+        ids = [await future for future in futures]
+        self._active.update(ids)
+        return ids
+
+    def done(self, job_id: int):
+        self._active.discard(job_id)
+        self._done.append(job_id)
+        self.completed += 1
+        self._schedule_flush()
+
+    def failed(
+        self,
+        job_id: int,
+        attempts: int,
+        retryable: bool,
+        targets: Sequence[str] = (),
+    ) -> bool:
+        # Counts a failed delivery. The job is kept for a retry unless the
+        # error is permanent or it ran out of attempts. With targets, only
+        # those are retried from now on.
+        self._active.discard(job_id)
+        self._failed.append((str.join(" ", targets) or None, job_id))
+        attempts += 1
+        if retryable and attempts < self.max_attempts:
+            self.retried += 1
+            self._schedule_flush()
+            return True
+        logger.warning(
+            "Dropping job #%d after %d attempt(s)%s",
+            job_id,
+            attempts,
+            "" if retryable else ", the error is permanent",
+        )
+        self._done.append(job_id)
+        self.dropped += 1
+        self._schedule_flush()
+        return False
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown()
+        logger.info("Closed outbox %s", self.path)
+
+    def __repr__(self) -> str:
+        return (
+            "<Outbox {path!r} added={added} completed={completed} "
+            "retried={retried} dropped={dropped} flushes={flushes}>"
+        ).format(
+            path=self.path,
+            added=self.added,
+            completed=self.completed,
+            retried=self.retried,
+            dropped=self.dropped,
+            flushes=self.flushes,
+        )
@@ -0,0 +1,275 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from asyncio import CancelledError, Queue, Task, create_task, gather, sleep
+from logging import getLogger
+from time import monotonic
+from typing import AsyncIterable, Dict, List, Optional, Sequence, Tuple
+
+from mastoposter import execute_integrations
+from mastoposter.checkpoint import Checkpoint
+from mastoposter.dedup import SeenCache
+from mastoposter.outbox import Outbox
+from mastoposter.integrations import FilteredIntegration
+from mastoposter.integrations.base import DeliveryError, is_retryable
+from mastoposter.metrics import (
+    DEDUP,
+    OUTBOX,
+    PIPELINE,
+    QUEUE_DEPTH,
+    export_fields,
+)
+from mastoposter.types import Status
+
+logger = getLogger("pipeline")
+
+# Statuses tagged with names of the sources they came from
+Feed = AsyncIterable[Tuple[Sequence[str], Status]]
+# Sources, status and the modules to deliver to, None being all of them
+Job = Tuple[Sequence[str], Status, Optional[List[FilteredIntegration]]]
+
+
+async def untagged(source: AsyncIterable[Status]) -> Feed:
+    async for status in source:
+        yield (), status
+
+
+class Pipeline:
+    def __init__(
+        self,
+        sinks: List[FilteredIntegration],
+        queue_size: int = 100,
+        workers: int = 1,
+        checkpoints: Optional[Dict[str, Checkpoint]] = None,
+        seen: Optional[SeenCache] = None,
+        outbox: Optional[Outbox] = None,
+        retry_interval: float = 300.0,
+    ):
+        self.sinks = sinks
+        self.checkpoints = checkpoints or {}
+        self.seen = seen
+        self.outbox = outbox
+        self.retry_interval = retry_interval
+        self.workers = max(1, workers)
+        self.queue: "Queue[Job]" = Queue(maxsize=max(0, queue_size))
+        self.backpressure_count: int = 0
+        self.backpressure_time: float = 0.0
+        self.delivered_count: int = 0
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def put(
+        self,
+        status: Status,
+        sources: Sequence[str] = (),
+        sinks: Optional[List[FilteredIntegration]] = None,
+    ):
+        if not self.queue.full():
+            self.queue.put_nowait((sources, status, sinks))
+            logger.debug("Queued %s (depth=%d)", status.uri, self.depth)
+            return
+
+        self.backpressure_count += 1
+        logger.warning(
+            "Delivery queue is full (depth=%d), pausing ingestion",
+            self.depth,
+        )
+        started = monotonic()
+        await self.queue.put((sources, status, sinks))
+        blocked = monotonic() - started
+        self.backpressure_time += blocked
+        logger.warning("Ingestion resumed after %.3fs", blocked)
+
+    async def _worker(self, idx: int):
+        logger.debug("Delivery worker #%d started", idx)
+        while True:
+            sources, status, sinks = await self.queue.get()
+            try:
+                logger.info(
+                    await execute_integrations(
+                        status,
+                        self.sinks if sinks is None else sinks,
+                        self.outbox,
+                        sources,
+                    )
+                )
+                self.delivered_count += 1
+                for name in sources:
+                    if name in self.checkpoints:
+                        self.checkpoints[name].update(status.id)
+                if self.seen is not None:
+                    self.seen.done(status)
+            except CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(
+                    "Worker #%d failed on %s: %r", idx, status.uri, e
+                )
+                if self.seen is not None:
+                    self.seen.done(status, delivered=False)
+            finally:
+                self.queue.task_done()
+
+    async def replay(self):
+        if self.outbox is None:
+            return
+        sinks = {sink.name: sink for sink in self.sinks}
+        jobs = await self.outbox.pending()
+        if jobs:
+            logger.info("Replaying %d unfinished deliveries", len(jobs))
+        for job in jobs:
+            if job.module not in sinks:
+                logger.warning(
+                    "Dropping job #%d: module %r no longer exists",
+                    job.id,
+                    job.module,
+                )
+                self.outbox.done(job.id)
+                continue
+            sink = sinks[job.module].sink
+            try:
+                if job.targets:
+                    result = await sink.retry(job.status, job.targets)
+                else:
+                    result = await sink(job.status)
+            except Exception as e:
+                logger.exception(
+                    "Replaying job #%d (%s -> %s) failed: %r",
+                    job.id,
+                    job.status.uri,
+                    job.module,
+                    e,
+                )
+                self.outbox.failed(
+                    job.id,
+                    job.attempts,
+                    is_retryable(e),
+                    e.targets if isinstance(e, DeliveryError) else (),
+                )
+                continue
+            logger.info(
+                "Replayed job #%d (%s -> %s): %r",
+                job.id,
+                job.status.uri,
+                job.module,
+                result,
+            )
+            self.outbox.done(job.id)
+
+    async def _retry(self):
+        # Failed deliveries are retried while running, not only on startup
+        while True:
+            await sleep(self.retry_interval)
+            await self.replay()
+
+    def _redelivery(
+        self, status: Status, sources: Sequence[str]
+    ) -> Optional[Tuple[List[str], List[FilteredIntegration]]]:
+        # A status seen before may still be new to some of the sources it
+        # came from now. Those get their checkpoints moved, and modules
+        # limited to them get it unless an earlier source already had it.
+        assert self.seen is not None
+        names = set(sources)
+        for sink in self.sinks:
+            names.update(sink.sources or ())
+        earlier = self.seen.sources_seen(status, names)
+        fresh = [name for name in sources if name not in earlier]
+        if not fresh:
+            return None
+        self.seen.queued(status)
+        self.seen.add_sources(status, fresh)
+        sinks = [
+            sink
+            for sink in self.sinks
+            if sink.sources is not None
+            and not sink.sources.isdisjoint(fresh)
+            and sink.sources.isdisjoint(earlier)
+        ]
+        logger.info(
+            "%s was already seen, delivering it to %d module(s) of %s",
+            status.uri,
+            len(sinks),
+            ", ".join(fresh),
+        )
+        return fresh, sinks
+
+    async def _ingest(self, feed: Feed):
+        async for sources, status in feed:
+            if self.seen is None:
+                await self.put(status, sources)
+            elif not self.seen.check(status, pending=True):
+                self.seen.add_sources(status, sources)
+                await self.put(status, sources)
+            elif (redelivery := self._redelivery(status, sources)) is not None:
+                await self.put(status, *redelivery)
+
+    async def run(self, source: AsyncIterable[Status]):
+        await self.run_feeds([untagged(source)])
+
+    async def run_feeds(self, feeds: List[Feed]):
+        QUEUE_DEPTH.set_function(lambda: self.depth)
+        export_fields(
+            PIPELINE,
+            self,
+            ("backpressure_count", "backpressure_time", "delivered_count"),
+        )
+        if self.seen is not None:
+            export_fields(DEDUP, self.seen, ("hits", "misses", "boost_hits"))
+        if self.outbox is not None:
+            export_fields(
+                OUTBOX,
+                self.outbox,
+                ("added", "completed", "retried", "dropped", "flushes"),
+            )
+            await self.outbox.open()
+            await self.replay()
+        workers = [create_task(self._worker(i)) for i in range(self.workers)]
+        if self.outbox is not None and self.retry_interval > 0:
+            workers.append(create_task(self._retry()))
+        logger.info(
+            "Started %d delivery worker(s), queue size is %d",
+            self.workers,
+            self.queue.maxsize,
+        )
+        readers: List[Task] = [create_task(self._ingest(f)) for f in feeds]
+        try:
+            await gather(*readers)
+            await self.queue.join()
+        finally:
+            for reader in readers:
+                reader.cancel()
+            for worker in workers:
+                worker.cancel()
+            await gather(*workers, return_exceptions=True)
+            # statuses still queued aren't saved, the checkpoints will
+            # bring them back after a restart
+            if self.seen is not None:
+                self.seen.save()
+            # after the workers, so their last done marks are written
+            if self.outbox is not None:
+                await self.outbox.close()
+
+    def __repr__(self) -> str:
+        return (
+            "<Pipeline workers={workers} depth={depth}/{size} "
+            "backpressure={bp}>"
+        ).format(
+            workers=self.workers,
+            depth=self.depth,
+            size=self.queue.maxsize,
+            bp=self.backpressure_count,
+        )
@@ -0,0 +1,99 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from logging import getLogger
+from typing import Any, Dict, List
+
+from mastoposter.filters import run_filters_raw
+from mastoposter.integrations import FilteredIntegration
+from mastoposter.metrics import PREFILTERED
+
+logger = getLogger("prefilter")
+
+
+class Prefilter:
+    # Cheap checks on the raw API dict, so most of the statuses we'd drop
+    # anyway never go through Status.from_dict.
+    def __init__(
+        self,
+        user: str,
+        modules: List[FilteredIntegration],
+        replies_to_other_accounts_should_not_be_skipped: bool = False,
+        name: str = "main",
+    ):
+        self.name = name
+        self.user = user
+        self.modules = modules
+        self.replies = replies_to_other_accounts_should_not_be_skipped
+        self.passed: int = 0
+        self.rejected: Dict[str, int] = {}
+
+    @property
+    def rejected_count(self) -> int:
+        return sum(self.rejected.values())
+
+    def _reject(self, reason: str) -> bool:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        PREFILTERED.inc(source=self.name, reason=reason)
+        return False
+
+    def __call__(self, data: Dict[str, Any]) -> bool:
+        uri = data.get("uri")
+        logger.info("New status: %s", uri)
+
+        account_id = data["account"]["id"]
+        if account_id != self.user and self.user != "all":
+            logger.info(
+                "Skipping status %s (account.id=%r != %r)",
+                uri,
+                account_id,
+                self.user,
+            )
+            return self._reject("account")
+
+        # TODO: add option/filter to handle that
+        if data.get("visibility") in ("direct",):
+            logger.info(
+                "Skipping post %s (status.visibility=%r)",
+                uri,
+                data["visibility"],
+            )
+            return self._reject("visibility")
+
+        # TODO: find a better way to handle threads
+        reply_to = data.get("in_reply_to_account_id")
+        if (
+            reply_to is not None and reply_to != self.user
+        ) and not self.replies:
+            logger.info(
+                "Skipping post %s because it's a reply to another person",
+                uri,
+            )
+            return self._reject("reply")
+
+        if self.modules and all(
+            run_filters_raw(module.filters, data) is False
+            for module in self.modules
+        ):
+            logger.info("Skipping post %s: rejected by all filters", uri)
+            return self._reject("filters")
+
+        self.passed += 1
+        return True
+
+    def __repr__(self) -> str:
+        return (
+            "<Prefilter {name} passed={passed} rejected={rejected}>"
+        ).format(name=self.name, passed=self.passed, rejected=self.rejected)
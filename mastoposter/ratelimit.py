@@ -0,0 +1,103 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from asyncio import Lock, sleep
+from logging import getLogger
+from time import monotonic
+from typing import Mapping, Optional
+
+logger = getLogger("ratelimit")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1.0, name: str = ""):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.name = name
+        self.tokens: float = self.capacity
+        self.updated: float = monotonic()
+        self.blocked_until: float = 0.0
+        self.waited: float = 0.0
+        self._lock = Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    async def acquire(self, cost: float = 1.0):
+        cost = min(cost, self.capacity)
+        async with self._lock:
+            started = monotonic()
+            while True:
+                if (delay := self.blocked_until - monotonic()) > 0:
+                    await sleep(delay)
+                self._refill()
+                if self.tokens >= cost:
+                    break
+                await sleep((cost - self.tokens) / self.rate)
+            self.tokens -= cost
+            if (waited := monotonic() - started) > 0.001:
+                self.waited += waited
+                logger.debug("%s: waited %.3fs", self.name, waited)
+
+    def pause(self, delay: float):
+        logger.warning("%s: paused for %.1fs", self.name, delay)
+        self.blocked_until = max(self.blocked_until, monotonic() + delay)
+        self.tokens = 0.0
+
+    def __repr__(self) -> str:
+        return "<TokenBucket {name} rate={rate}/s capacity={cap}>".format(
+            name=self.name, rate=self.rate, cap=self.capacity
+        )
+
+
+class HeaderBucket:
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.remaining: Optional[int] = None
+        self.reset_at: float = 0.0
+        self.waited: float = 0.0
+        self.lock = Lock()
+
+    async def wait(self):
+        delay = self.reset_at - monotonic()
+        if delay <= 0:
+            return
+        if self.remaining is not None and self.remaining > 0:
+            return
+        logger.debug("%s: waiting %.3fs for reset", self.name, delay)
+        self.waited += delay
+        await sleep(delay)
+
+    def update(self, headers: Mapping[str, str]):
+        if "x-ratelimit-remaining" in headers:
+            self.remaining = int(headers["x-ratelimit-remaining"])
+        if "x-ratelimit-reset-after" in headers:
+            self.reset_at = monotonic() + float(
+                headers["x-ratelimit-reset-after"]
+            )
+
+    def pause(self, delay: float):
+        logger.warning("%s: paused for %.1fs", self.name, delay)
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, monotonic() + delay)
+
+    def __repr__(self) -> str:
+        return "<HeaderBucket {name} remaining={remaining}>".format(
+            name=self.name, remaining=self.remaining
+        )
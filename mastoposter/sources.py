@@ -14,22 +14,122 @@ GNU General Public License for more details.
 """
 
 from asyncio import exceptions, sleep
-from json import loads
 from logging import getLogger
-from typing import AsyncGenerator
+from time import monotonic
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 from urllib.parse import urlencode
+
+from httpx import HTTPError
+
+from mastoposter.checkpoint import Checkpoint, status_id_key
+from mastoposter.clients import PoolConfig, get_client
+from mastoposter.codec import get_codec
+from mastoposter.health import Backoff, ConnectionHealth
+from mastoposter.metrics import FRAME_BYTES, FRAMES, STAGE_SECONDS
 from mastoposter.types import Status
 
 logger = getLogger("sources")
 
+RawPredicate = Callable[[Dict[str, Any]], bool]
+# Names of the sources that take a raw status, none means it's dropped
+RawTagger = Callable[[Dict[str, Any]], List[str]]
+# A status with the names of the sources that took it
+Tagged = Tuple[List[str], Status]
+
+
+async def timeline_source(
+    url: str,
+    checkpoint: Checkpoint,
+    access_token: str,
+    retries: int = 5,
+    page_size: int = 40,
+    max_pages: int = 10,
+    tagger: Optional[RawTagger] = None,
+    query: Optional[Dict[str, str]] = None,
+) -> AsyncGenerator[Tagged, None]:
+    since_id = checkpoint.last_id
+    if since_id is None:
+        logger.info("No checkpoint yet, nothing to backfill")
+        return
+
+    logger.info("Backfilling statuses since %s", since_id)
+    statuses: List[Tagged] = []
+    client = get_client(url, PoolConfig(retries=retries))
+
+    async def fetch(min_id: str) -> List[Dict[str, Any]]:
+        params: Dict[str, Any] = {
+            **(query or {}),
+            "min_id": min_id,
+            "limit": page_size,
+        }
+        rq = await client.get(
+            url,
+            params=params,
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+        rq.raise_for_status()
+        page: List[Dict[str, Any]] = rq.json()
+        return page
+
+    # Pages go forward from the checkpoint, so when the page limit is hit
+    # it's the newest statuses that are left out, not the ones in the gap
+    min_id = since_id
+    for _ in range(max_pages):
+        page = await fetch(min_id)
+        for data in page:
+            if status_id_key(data["id"]) <= status_id_key(since_id):
+                continue
+            tags = [] if tagger is None else tagger(data)
+            if tagger is None or tags:
+                statuses.append((tags, Status.from_dict(data)))
+        if len(page) < page_size:
+            break
+        min_id = max((data["id"] for data in page), key=status_id_key)
+    else:
+        if await fetch(min_id):
+            logger.warning(
+                "Backfill stopped after %d pages, statuses newer than %s "
+                "were not fetched",
+                max_pages,
+                min_id,
+            )
+
+    logger.info("Backfilled %d statuses", len(statuses))
+    statuses.sort(key=lambda tagged: status_id_key(tagged[1].id))
+    for tagged in statuses:
+        yield tagged
+
 
 async def websocket_source(
     url: str, reconnect: bool = False, reconnect_delay: float = 1.0,
-    connect_timeout: float = 60.0, **params
-) -> AsyncGenerator[Status, None]:
-    from websockets.client import connect
+    connect_timeout: float = 60.0,
+    backfill: Optional[Callable[[], AsyncIterable[Tagged]]] = None,
+    json_codec: str = "auto",
+    tagger: Optional[RawTagger] = None,
+    reconnect_max_delay: float = 300.0,
+    stable_after: float = 60.0,
+    ping_interval: Optional[float] = 20.0,
+    ping_timeout: Optional[float] = 20.0,
+    health: Optional[ConnectionHealth] = None,
+    **params
+) -> AsyncGenerator[Tagged, None]:
+    from websockets.asyncio.client import connect
     from websockets.exceptions import WebSocketException
 
+    codec = get_codec(json_codec)
+    backoff = Backoff(reconnect_delay, reconnect_max_delay)
+    if health is None:
+        health = ConnectionHealth()
+
     param_dict = {"stream": "list", **params}
     public_param_dict = param_dict.copy()
     public_param_dict["access_token"] = 'SCRUBBED'
@@ -38,31 +138,93 @@ async def websocket_source(
     while True:
         try:
             logger.info("attempting to connect to %s", public_url)
-            async with connect(url, open_timeout=connect_timeout) as ws:
+            started = monotonic()
+            async with connect(
+                url,
+                open_timeout=connect_timeout,
+                ping_interval=ping_interval,
+                ping_timeout=ping_timeout,
+            ) as ws:
+                health.on_connect(monotonic() - started)
                 logger.info("Connected to WebSocket")
-                while (msg := await ws.recv()) is not None:
-                    event = loads(msg)
-                    logger.debug("data: %r", event)
-                    if "error" in event:
-                        raise Exception(event["error"])
-                    if event["event"] == "update":
-                        yield Status.from_dict(loads(event["payload"]))
+                if backfill is not None:
+                    try:
+                        async for tagged in backfill():
+                            yield tagged
+                    except HTTPError as e:
+                        logger.error("Backfill failed: %r", e)
+                # frames are kept as bytes, the codecs decode UTF-8 JSON
+                # themselves and skip building an intermediate str
+                while (msg := await ws.recv(decode=False)) is not None:
+                    health.on_frame()
+                    FRAMES.inc(source=health.name)
+                    FRAME_BYTES.inc(len(msg), source=health.name)
+                    with STAGE_SECONDS.time(stage="decode", module=""):
+                        event = codec.decode_event(msg)
+                        if event.event == "update" and event.payload:
+                            data = codec.decode(event.payload)
+                    logger.debug(
+                        "event: %r (%d bytes)", event.event, len(msg)
+                    )
+                    if event.error is not None:
+                        raise Exception(event.error)
+                    if event.event == "update" and event.payload:
+                        tags = [] if tagger is None else tagger(data)
+                        if tagger is None or tags:
+                            with STAGE_SECONDS.time(stage="parse", module=""):
+                                status = Status.from_dict(data)
+                            yield tags, status
                     else:
-                        logger.warn("unknown event type %r", event["event"])
+                        logger.warn("unknown event type %r", event.event)
         except (
             WebSocketException,
             TimeoutError,
             exceptions.TimeoutError,
             ConnectionError,
         ) as e:
+            if health.on_disconnect(e) >= stable_after:
+                backoff.reset()
             if not reconnect:
                 raise
             else:
-                logger.warn("%r caught, reconnecting", e)
-                await sleep(reconnect_delay)
+                delay = backoff.next_delay()
+                logger.warning("%r caught, reconnecting in %.1fs", e, delay)
+                await sleep(delay)
         else:
+            if health.on_disconnect() >= stable_after:
+                backoff.reset()
             logger.info(
                 "WebSocket closed connection without any errors, "
                 "but we're not done yet"
             )
-            await sleep(reconnect_delay)
+            await sleep(backoff.next_delay())
+
+
+class SharedSource:
+    # One streaming connection feeding several configured sources that
+    # would've opened exactly the same one. Each source keeps its own
+    # prefilter, statuses are tagged with the names of those that took them.
+    def __init__(
+        self, source: Callable[..., AsyncGenerator[Tagged, None]], **kwargs
+    ):
+        self.source = source
+        self.kwargs = kwargs
+        self.members: Dict[str, Optional[RawPredicate]] = {}
+
+    def add(self, name: str, prefilter: Optional[RawPredicate] = None):
+        self.members[name] = prefilter
+
+    def tags(self, data: Dict[str, Any]) -> List[str]:
+        return [
+            name
+            for name, prefilter in self.members.items()
+            if prefilter is None or prefilter(data)
+        ]
+
+    def feed(self) -> AsyncGenerator[Tagged, None]:
+        return self.source(tagger=self.tags, **self.kwargs)
+
+    def __repr__(self) -> str:
+        return "<SharedSource {members}>".format(
+            members=" ".join(self.members)
+        )
@@ -0,0 +1,103 @@
+"""
+mastoposter - configurable reposter from Mastodon-compatible Fediverse servers
+Copyright (C) 2022-2023 hatkidchan <hatkidchan@gmail.com>
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+
+from hashlib import sha1
+from logging import getLogger
+from os import makedirs
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FunctionLoader,
+    Template,
+    nodes,
+)
+
+logger = getLogger("templates")
+
+# Templates are named by the hash of their source, so modules with the same
+# template text share one compiled template
+_sources: Dict[str, str] = {}
+
+
+def _load(name: str) -> Optional[Tuple[str, None, None]]:
+    if name not in _sources:
+        return None
+    return _sources[name], None, None
+
+
+environment = Environment(loader=FunctionLoader(_load))
+
+
+def configure(bytecode_cache: Optional[str] = None):
+    if bytecode_cache:
+        makedirs(bytecode_cache, exist_ok=True)
+        environment.bytecode_cache = FileSystemBytecodeCache(bytecode_cache)
+        logger.info("Caching template bytecode in %s", bytecode_cache)
+    else:
+        environment.bytecode_cache = None
+    if environment.cache is not None:
+        environment.cache.clear()
+
+
+def get_template(source: str) -> Template:
+    name = sha1(source.encode()).hexdigest()
+    _sources.setdefault(name, source)
+    return environment.get_template(name)
+
+
+def get_source(template: Template) -> Optional[str]:
+    return _sources.get(template.name or "")
+
+
+def _attr_path(node: nodes.Node, name: str) -> Optional[List[str]]:
+    # status.a.b["c"] -> ["a", "b", "c"], None for anything else
+    path: List[str] = []
+    while True:
+        if isinstance(node, nodes.Getattr):
+            path.append(node.attr)
+        elif (
+            isinstance(node, nodes.Getitem)
+            and isinstance(node.arg, nodes.Const)
+            and isinstance(node.arg.value, str)
+        ):
+            path.append(node.arg.value)
+        else:
+            break
+        node = node.node
+    if isinstance(node, nodes.Name) and node.name == name:
+        return path[::-1]
+    return None
+
+
+def template_fields(
+    source: str, name: str = "status"
+) -> Optional[FrozenSet[str]]:
+    # Attribute paths the template reads from `name`, like
+    # "reblog.account.name". None if the whole object is used somewhere
+    # (printed, passed to a macro, ...) and anything could be read from it.
+    paths: Set[str] = set()
+    pending: List[nodes.Node] = [environment.parse(source)]
+    while pending:
+        node = pending.pop()
+        path = _attr_path(node, name)
+        if path:
+            paths.add(".".join(path))
+            continue
+        if path is not None and node.ctx == "load":  # type: ignore
+            return None
+        pending.extend(node.iter_child_nodes())
+    return frozenset(paths)
@@ -13,8 +13,18 @@ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 GNU General Public License for more details.
 """
 
-from typing import Callable, Iterable, Literal, Optional
-from bs4.element import Tag, PageElement
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Union,
+)
+from bs4.element import NavigableString, PageElement, Tag
 
 VALID_OUTPUT_TYPES = Literal["plain", "html", "markdown"]
 BULLET = "\u2022"
@@ -34,23 +44,79 @@ def md_escape(text: str) -> str:
     )
 
 
-node_processors: dict[
-    tuple[VALID_OUTPUT_TYPES, str],
-    list[
-        Callable[
-            [
-                PageElement,
-            ],
-            Optional[str],
-        ]
-    ],
-] = {}
+def is_spoiler(tag: Tag) -> bool:
+    return "_mfm_blur_" in tag.attrs.get("class", "")
+
+
+Converter = Callable[[PageElement], Optional[str]]
+PartsConverter = Callable[[Tag, List[str]], Optional[str]]
+
+
+class Constant:
+    # replaces the tag and everything inside of it
+    def __init__(self, text: str):
+        self.text = text
+
+    def __call__(self, el: PageElement) -> str:
+        return self.text
+
+
+class Wrap:
+    # prefix + converted children + suffix
+    def __init__(
+        self, prefix: str, suffix: str, output_type: VALID_OUTPUT_TYPES
+    ):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.output_type = output_type
+
+    def __call__(self, el: Tag) -> str:
+        content = nodes_process(el.children, self.output_type)
+        return self.prefix + content + self.suffix
+
+
+class Parts:
+    # gets the tag and a list of its converted children, tags that don't
+    # pass `when` are treated as if they had no converter
+    def __init__(
+        self,
+        function: PartsConverter,
+        output_type: VALID_OUTPUT_TYPES,
+        when: Optional[Callable[[Tag], bool]] = None,
+    ):
+        self.function = function
+        self.output_type = output_type
+        self.when = when
+
+    def __call__(self, el: Tag) -> Optional[str]:
+        if self.when is not None and not self.when(el):
+            return None
+        return self.function(
+            el, [node_process(child, self.output_type) for child in el]
+        )
+
+
+node_processors: dict[tuple[VALID_OUTPUT_TYPES, str], list[Converter]] = {}
 
 
 def register_converter(tag: str, output_type: VALID_OUTPUT_TYPES = "plain"):
     def decorate(function):
         node_processors.setdefault((output_type, tag), [])
         node_processors[output_type, tag].append(function)
+        _tables.clear()
+        return function
+
+    return decorate
+
+
+def register_parts_converter(
+    tag: str,
+    output_type: VALID_OUTPUT_TYPES = "plain",
+    when: Optional[Callable[[Tag], bool]] = None,
+):
+    def decorate(function: PartsConverter) -> PartsConverter:
+        converter = Parts(function, output_type, when)
+        register_converter(tag, output_type)(converter)
         return function
 
     return decorate
@@ -59,6 +125,7 @@ def register_converter(tag: str, output_type: VALID_OUTPUT_TYPES = "plain"):
 def register_text_node_converter(output_type: VALID_OUTPUT_TYPES = "plain"):
     def decorate(function):
         node_processors[output_type, ":text:"] = [function]
+        _tables.clear()
         return function
 
     return decorate
@@ -70,25 +137,235 @@ def register_fmt_converter(
     output_type: VALID_OUTPUT_TYPES = "plain",
     separator: str = "",
 ):
-    def fmt_tag(el: Tag) -> str:
-        if "%s" in format:
-            return format % nodes_process(el.children, output_type, separator)
-        return format
+    converter: Union[Constant, Wrap, Parts]
+    if "%s" not in format:
+        converter = Constant(format)
+    elif not separator and format.count("%") == 1:
+        prefix, suffix = format.split("%s")
+        converter = Wrap(prefix, suffix, output_type)
+    else:
 
-    register_converter(tag, output_type)(fmt_tag)
+        def fmt_parts(el: Tag, parts: List[str]) -> str:
+            return format % str.join(separator, parts)
+
+        converter = Parts(fmt_parts, output_type)
+    register_converter(tag, output_type)(converter)
+
+
+class _Rule:
+    # Compiled converters of one tag: opaque callables tried on the way in,
+    # then either a constant, a wrap, or a list of converters that need the
+    # children converted first (tried on the way out).
+    __slots__ = ("before", "constant", "wrap", "after", "when")
+
+    def __init__(self, converters: List[Converter]):
+        self.before: List[Converter] = []
+        self.constant: Optional[str] = None
+        self.wrap: Optional[Wrap] = None
+        self.after: List[Converter] = []
+        self.when: Optional[Callable[[Tag], bool]] = None
+        for i, conv in enumerate(converters):
+            if isinstance(conv, Constant):
+                if conv.text:
+                    self.constant = conv.text
+                    break
+            elif isinstance(conv, Wrap) and (conv.prefix or conv.suffix):
+                self.wrap = conv
+                break
+            elif isinstance(conv, (Parts, Wrap)):
+                self.after = converters[i:]
+                if len(self.after) == 1 and isinstance(conv, Parts):
+                    self.when = conv.when
+                break
+            else:
+                self.before.append(conv)
+
+
+class _Exit:
+    __slots__ = ("el", "rule", "start", "bounds")
+
+    def __init__(self, el: Tag, rule: _Rule, start: int):
+        self.el = el
+        self.rule = rule
+        self.start = start
+        self.bounds: List[int] = []
+
+
+_Table = Tuple[Dict[str, _Rule], Optional[Converter]]
+_tables: Dict[str, _Table] = {}
+
+
+def _table(type_: VALID_OUTPUT_TYPES) -> _Table:
+    if type_ not in _tables:
+        rules: Dict[str, _Rule] = {}
+        for (output_type, tag), converters in node_processors.items():
+            if output_type == type_ and tag != ":text:":
+                rules[tag] = _Rule(converters)
+        text = node_processors.get((type_, ":text:"), [None])[0]
+        _tables[type_] = (rules, text)
+    return _tables[type_]
+
+
+def _finish(frame: _Exit, buf: List[str]):
+    start, bounds = frame.start, frame.bounds
+    bounds.append(len(buf))
+    parts = [str.join("", buf[a:b]) for a, b in zip(bounds, bounds[1:])]
+    del buf[start:]
+    for conv in frame.rule.after:
+        if isinstance(conv, Parts):
+            result = conv.function(frame.el, parts)
+        else:
+            result = conv(frame.el)
+        if result:
+            buf.append(result)
+            return
+    buf.append(str.join("", parts))
+
+
+def _enter(item: Tag, rule: _Rule, buf: List[str], stack: List[Any]):
+    for conv in rule.before:
+        if result := conv(item):
+            buf.append(result)
+            return
+    if rule.constant is not None:
+        buf.append(rule.constant)
+    elif rule.wrap is not None:
+        buf.append(rule.wrap.prefix)
+        stack.append(rule.wrap.suffix)
+        stack.extend(reversed(item.contents))
+    elif rule.after and (rule.when is None or rule.when(item)):
+        frame = _Exit(item, rule, len(buf))
+        stack.append(frame)
+        # the frame's bounds list goes before every child and marks where
+        # its output starts
+        for child in reversed(item.contents):
+            stack.append(child)
+            stack.append(frame.bounds)
+    else:
+        stack.extend(reversed(item.contents))
 
 
 def node_process(el: PageElement, type_: VALID_OUTPUT_TYPES) -> str:
-    if isinstance(el, Tag):
-        if (type_, el.name) in node_processors:
-            for func in node_processors[type_, el.name]:
-                result = func(el)
-                if result:
-                    return result
-        return nodes_process(el.children, type_)
-    if (type_, ":text:") in node_processors:
-        return node_processors[type_, ":text:"][0](el) or str(el)
-    return str(el)
+    # Walks the tree with an explicit stack instead of recursion, so deep
+    # nesting can't hit the recursion limit. Besides elements, the stack
+    # holds plain strings (suffixes of Wrap rules), child boundary lists and
+    # exit frames of Parts rules.
+    rules, text = _table(type_)
+    buf: List[str] = []
+    stack: List[Any] = [el]
+    while stack:
+        item = stack.pop()
+        cls = type(item)
+        if cls is NavigableString:
+            buf.append(text(item) or item if text is not None else item)
+        elif cls is Tag or isinstance(item, Tag):
+            rule = rules.get(item.name)
+            if rule is None:
+                stack.extend(reversed(item.contents))
+            else:
+                _enter(item, rule, buf, stack)
+        elif cls is str:
+            buf.append(item)
+        elif cls is list:
+            item.append(len(buf))
+        elif cls is _Exit:
+            _finish(item, buf)
+        elif text is not None:
+            buf.append(text(item) or str(item))
+        else:
+            buf.append(str(item))
+    return str.join("", buf)
+
+
+class _Leave:
+    __slots__ = ("actions",)
+
+    def __init__(self, actions: List[Tuple[int, Any]]):
+        self.actions = actions
+
+
+def node_process_many(
+    el: PageElement, types: Iterable[VALID_OUTPUT_TYPES]
+) -> Dict[VALID_OUTPUT_TYPES, str]:
+    # Same as node_process for every type, but in one traversal. Each type
+    # writes into its own buffer; once a converter has produced the whole
+    # tag, its type is muted until the walk leaves that tag while the other
+    # types keep descending into it.
+    order: List[VALID_OUTPUT_TYPES] = list(dict.fromkeys(types))
+    if len(order) == 1:
+        return {order[0]: node_process(el, order[0])}
+    bufs: List[List[str]] = [[] for _ in order]
+    rules: Dict[str, List[Tuple[int, _Rule, List[str]]]] = {}
+    texts: List[Tuple[List[str], Optional[Converter]]] = []
+    for i, type_ in enumerate(order):
+        type_rules, text = _table(type_)
+        for name, rule in type_rules.items():
+            rules.setdefault(name, []).append((i, rule, bufs[i]))
+        texts.append((bufs[i], text))
+    muted = [0] * len(order)
+    muted_count = 0
+    stack: List[Any] = [el]
+    while stack:
+        item = stack.pop()
+        cls = type(item)
+        if cls is NavigableString or not (
+            cls is Tag or cls is _Leave or cls is list or isinstance(item, Tag)
+        ):
+            for i, (buf, text) in enumerate(texts):
+                if muted_count and muted[i]:
+                    continue
+                elif text is not None:
+                    buf.append(text(item) or str(item))
+                else:
+                    buf.append(str(item))
+        elif cls is _Leave:
+            for i, action in item.actions:
+                if action is None:
+                    muted[i] -= 1
+                    muted_count -= 1
+                elif type(action) is str:
+                    bufs[i].append(action)
+                else:
+                    _finish(action, bufs[i])
+        elif cls is list:
+            for bounds, buf in item:
+                bounds.append(len(buf))
+        elif (tag_rules := rules.get(item.name)) is None:
+            stack.extend(reversed(item.contents))
+        else:
+            actions: List[Tuple[int, Any]] = []
+            marks: List[Tuple[List[int], List[str]]] = []
+            for i, rule, buf in tag_rules:
+                if muted_count and muted[i]:
+                    continue
+                for conv in rule.before:
+                    if result := conv(item):
+                        break
+                else:
+                    result = rule.constant
+                if result is not None:
+                    buf.append(result)
+                    muted[i] += 1
+                    muted_count += 1
+                    actions.append((i, None))
+                elif rule.wrap is not None:
+                    buf.append(rule.wrap.prefix)
+                    actions.append((i, rule.wrap.suffix))
+                elif rule.after and (rule.when is None or rule.when(item)):
+                    frame = _Exit(item, rule, len(buf))
+                    actions.append((i, frame))
+                    marks.append((frame.bounds, buf))
+            if actions:
+                stack.append(_Leave(actions))
+                if 0 not in muted:
+                    continue
+            if marks:
+                for child in reversed(item.contents):
+                    stack.append(child)
+                    stack.append(marks)
+            else:
+                stack.extend(reversed(item.contents))
+    return {type_: str.join("", buf) for type_, buf in zip(order, bufs)}
 
 
 def nodes_process(
@@ -99,7 +376,14 @@ def nodes_process(
     return str.join(separator, (node_process(el, type_) for el in els))
 
 
-__all__ = ["node_process", "nodes_process", "md_escape", "BULLET", "STRIPE"]
+__all__ = [
+    "node_process",
+    "node_process_many",
+    "nodes_process",
+    "md_escape",
+    "BULLET",
+    "STRIPE",
+]
 
 import mastoposter.text.html  # noqa F401
 import mastoposter.text.markdown  # noqa F401
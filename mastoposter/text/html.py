@@ -15,16 +15,15 @@ GNU General Public License for more details.
 
 from bs4 import NavigableString
 from mastoposter.text import (
-    nodes_process,
-    register_converter,
+    is_spoiler,
+    register_parts_converter,
     register_fmt_converter,
     register_text_node_converter,
-    node_process,
     STRIPE,
     BULLET,
 )
 
-from typing import Optional
+from typing import List
 from bs4.element import Tag
 from html import escape
 
@@ -34,11 +33,11 @@ def proc_text_node_to_html(txt: NavigableString) -> str:
     return escape(txt)
 
 
-@register_converter("a", "html")
-def proc_tag_a_to_html(tag: Tag):
+@register_parts_converter("a", "html")
+def proc_tag_a_to_html(tag: Tag, parts: List[str]):
     return '<a href="%s">%s</a>' % (
         escape(tag.attrs.get("href", "#")),
-        nodes_process(tag.children, "html"),
+        str.join("", parts),
     )
 
 
@@ -56,46 +55,39 @@ register_fmt_converter("\n<pre>%s</pre>\n", "pre", "html")
 register_fmt_converter("<code>%s</code>", "code", "html")
 
 
-@register_converter("span", "html")
-def proc_tag_span_to_html(tag: Tag) -> Optional[str]:
-    if "_mfm_blur_" in tag.attrs.get("class", ""):
-        return '<span class="tg-spoiler">%s</span>' % nodes_process(
-            tag.children, "html"
-        )
-    return None
+@register_parts_converter("span", "html", when=is_spoiler)
+def proc_tag_span_to_html(tag: Tag, parts: List[str]) -> str:
+    return '<span class="tg-spoiler">%s</span>' % str.join("", parts)
 
 
-@register_converter("blockquote", "html")
-def proc_tag_blockquote_to_html(tag: Tag) -> str:
+@register_parts_converter("blockquote", "html")
+def proc_tag_blockquote_to_html(tag: Tag, parts: List[str]) -> str:
     return str.join(
         "\n",
         (
             STRIPE + " " + line
-            for line in nodes_process(tag.children, "html").strip().split("\n")
+            for line in str.join("", parts).strip().split("\n")
         ),
     )
 
 
-@register_converter("ul", "html")
-def proc_tag_ul_to_html(tag: Tag) -> str:
+@register_parts_converter("ul", "html")
+def proc_tag_ul_to_html(tag: Tag, parts: List[str]) -> str:
     return "\n" + str.join(
         "\n",
         (
-            BULLET
-            + " "
-            + node_process(el, "html").replace("\n", "\n   ").rstrip()
-            for el in tag.children
+            BULLET + " " + part.replace("\n", "\n   ").rstrip()
+            for part in parts
         ),
     )
 
 
-@register_converter("ol", "html")
-def proc_tag_li_to_html(tag: Tag) -> str:
+@register_parts_converter("ol", "html")
+def proc_tag_li_to_html(tag: Tag, parts: List[str]) -> str:
     return "\n" + str.join(
         "\n",
         (
-            "%d. %s"
-            % (i, node_process(el, "html").replace("\n", "\n   ").rstrip())
-            for i, el in enumerate(tag.children, 1)
+            "%d. %s" % (i, part.replace("\n", "\n   ").rstrip())
+            for i, part in enumerate(parts, 1)
         ),
     )
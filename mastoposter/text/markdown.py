@@ -1,19 +1,18 @@
 from mastoposter.text import (
-    nodes_process,
-    register_converter,
+    is_spoiler,
+    register_parts_converter,
     register_fmt_converter,
-    node_process,
 )
 
-from typing import Optional
+from typing import List
 from bs4.element import Tag
 from html import escape
 
 
-@register_converter("a", "markdown")
-def proc_tag_a_to_markdown(tag: Tag):
+@register_parts_converter("a", "markdown")
+def proc_tag_a_to_markdown(tag: Tag, parts: List[str]):
     return "[%s](%s)" % (
-        nodes_process(tag.children, "markdown"),
+        str.join("", parts),
         escape(tag.attrs.get("href", "#")),
     )
 
@@ -32,44 +31,33 @@ register_fmt_converter("\n```%s```\n", "pre", "markdown")
 register_fmt_converter("`%s`", "code", "markdown")
 
 
-@register_converter("span", "markdown")
-def proc_tag_span_to_markdown(tag: Tag) -> Optional[str]:
-    if "_mfm_blur_" in tag.attrs.get("class", ""):
-        return "||%s||" % nodes_process(tag.children, "markdown")
-    return None
+@register_parts_converter("span", "markdown", when=is_spoiler)
+def proc_tag_span_to_markdown(tag: Tag, parts: List[str]) -> str:
+    return "||%s||" % str.join("", parts)
 
 
-@register_converter("blockquote", "markdown")
-def proc_tag_blockquote_to_markdown(tag: Tag) -> str:
+@register_parts_converter("blockquote", "markdown")
+def proc_tag_blockquote_to_markdown(tag: Tag, parts: List[str]) -> str:
     return str.join(
         "\n",
-        (
-            "> " + line
-            for line in nodes_process(tag.children, "markdown")
-            .strip()
-            .split("\n")
-        ),
+        ("> " + line for line in str.join("", parts).strip().split("\n")),
     )
 
 
-@register_converter("ul", "markdown")
-def proc_tag_ul_to_markdown(tag: Tag) -> str:
+@register_parts_converter("ul", "markdown")
+def proc_tag_ul_to_markdown(tag: Tag, parts: List[str]) -> str:
     return "\n" + str.join(
         "\n",
-        (
-            "* " + node_process(el, "markdown").replace("\n", "\n   ").rstrip()
-            for el in tag.children
-        ),
+        ("* " + part.replace("\n", "\n   ").rstrip() for part in parts),
     )
 
 
-@register_converter("ol", "markdown")
-def proc_tag_li_to_markdown(tag: Tag) -> str:
+@register_parts_converter("ol", "markdown")
+def proc_tag_li_to_markdown(tag: Tag, parts: List[str]) -> str:
     return "\n" + str.join(
         "\n",
         (
-            "%d. %s"
-            % (i, node_process(el, "markdown").replace("\n", "\n   ").rstrip())
-            for i, el in enumerate(tag.children, 1)
+            "%d. %s" % (i, part.replace("\n", "\n   ").rstrip())
+            for i, part in enumerate(parts, 1)
         ),
     )
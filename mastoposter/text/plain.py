@@ -14,21 +14,20 @@ GNU General Public License for more details.
 """
 
 from mastoposter.text import (
-    nodes_process,
-    register_converter,
+    register_parts_converter,
     register_fmt_converter,
-    node_process,
     STRIPE,
     BULLET,
 )
 
+from typing import List
 from bs4.element import Tag
 
 
-@register_converter("a", "plain")
-def proc_tag_a_to_plain(tag: Tag):
+@register_parts_converter("a", "plain")
+def proc_tag_a_to_plain(tag: Tag, parts: List[str]):
     return "%s (%s)" % (
-        nodes_process(tag.children, "plain"),
+        str.join("", parts),
         tag.attrs.get("href", "#"),
     )
 
@@ -37,39 +36,34 @@ register_fmt_converter("%s\n\n", "p", "plain")
 register_fmt_converter("\n", "br", "plain")
 
 
-@register_converter("blockquote", "plain")
-def proc_tag_blockquote_to_plain(tag: Tag) -> str:
+@register_parts_converter("blockquote", "plain")
+def proc_tag_blockquote_to_plain(tag: Tag, parts: List[str]) -> str:
     return str.join(
         "\n",
         (
             STRIPE + " " + line
-            for line in nodes_process(tag.children, "plain")
-            .strip()
-            .split("\n")
+            for line in str.join("", parts).strip().split("\n")
         ),
     )
 
 
-@register_converter("ul", "plain")
-def proc_tag_ul_to_plain(tag: Tag) -> str:
+@register_parts_converter("ul", "plain")
+def proc_tag_ul_to_plain(tag: Tag, parts: List[str]) -> str:
     return "\n" + str.join(
         "\n",
         (
-            BULLET
-            + " "
-            + node_process(el, "plain").replace("\n", "\n   ").rstrip()
-            for el in tag.children
+            BULLET + " " + part.replace("\n", "\n   ").rstrip()
+            for part in parts
         ),
     )
 
 
-@register_converter("ol", "plain")
-def proc_tag_li_to_plain(tag: Tag) -> str:
+@register_parts_converter("ol", "plain")
+def proc_tag_li_to_plain(tag: Tag, parts: List[str]) -> str:
     return "\n" + str.join(
         "\n",
         (
-            "%d. %s"
-            % (i, node_process(el, "plain").replace("\n", "\n   ").rstrip())
-            for i, el in enumerate(tag.children, 1)
+            "%d. %s" % (i, part.replace("\n", "\n   ").rstrip())
+            for i, part in enumerate(parts, 1)
         ),
     )
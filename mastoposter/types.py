@@ -13,13 +13,46 @@ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 GNU General Public License for more details.
 """
 
-from dataclasses import dataclass, field, fields
+from dataclasses import MISSING, dataclass, field, fields
 from datetime import datetime
-from typing import Any, Callable, Optional, List, Literal, TypeVar
+from functools import cached_property
+from json import dumps, loads
+from logging import getLogger
+from time import perf_counter
+from tracemalloc import get_traced_memory, start, stop
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Optional,
+    List,
+    Literal,
+    NamedTuple,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    cast,
+)
 
 from bs4 import BeautifulSoup
 
-from mastoposter.text import node_process
+from mastoposter.text import (
+    VALID_OUTPUT_TYPES,
+    node_process,
+    node_process_many,
+)
+
+logger = getLogger("types")
+
+CONTENT_ATTRS: Dict[VALID_OUTPUT_TYPES, str] = {
+    "html": "content_flathtml",
+    "markdown": "content_markdown",
+    "plain": "content_plaintext",
+}
 
 
 def _date(val: str) -> datetime:
@@ -41,38 +74,179 @@ def _int_or_none(val: Optional[str]) -> Optional[int]:
     return _fnil(int, val)
 
 
-@dataclass
+def _list_of(fn: Callable[[Any], T]) -> Callable[[Any], List[T]]:
+    return lambda val: [fn(item) for item in val or ()]
+
+
+class _LazyField:
+    # Non-data descriptor: the raw value sits in obj._raw_<name> until the
+    # first access, then the decoded one is stored in the instance __dict__
+    # and shadows the descriptor, just like functools.cached_property does.
+    # Fields dropped by the projection have no raw value at all and read as
+    # if the status didn't have them.
+    def __init__(self, name: str, decode: Callable[[Any], Any]):
+        self.name = name
+        self.raw_name = "_raw_" + name
+        self.decode = decode
+
+    def __get__(self, obj: Any, cls: Any = None) -> Any:
+        if obj is None:
+            return self
+        if self.raw_name in obj.__dict__:
+            value = self.decode(obj.__dict__[self.raw_name])
+            obj.__dict__[self.raw_name] = None
+        else:
+            if (type(obj), self.name) not in _dropped_reads:
+                _dropped_reads.add((type(obj), self.name))
+                logger.warning(
+                    "%s.%s was dropped by the projection and reads as empty",
+                    type(obj).__name__,
+                    self.name,
+                )
+            value = self.missing()
+        obj.__dict__[self.name] = value
+        return value
+
+    def missing(self) -> Any:
+        try:
+            return self.decode(None)
+        except (TypeError, AttributeError, ValueError):
+            return None
+
+
+_dropped_reads: Set[Tuple[Any, str]] = set()
+
+
+def _build_from_dict(
+    cls: Any, lazy: FrozenSet[str], dropped: FrozenSet[str] = frozenset()
+):
+    env: Dict[str, Any] = {"_cls": cls, "_new": object.__new__}
+    converters: Dict[str, Any] = cls._converters
+    values: Dict[str, str] = {}
+    for f in fields(cls):
+        name = f.name
+        if name in converters:
+            env["_c_" + name] = converters[name]
+            value = "data.get(%r)" % name
+            if name not in lazy:
+                value = "_c_%s(%s)" % (name, value)
+        elif f.default is not MISSING:
+            env["_d_" + name] = f.default
+            value = "data.get(%r, _d_%s)" % (name, name)
+        elif f.default_factory is not MISSING:
+            env["_f_" + name] = f.default_factory
+            value = "data[%r] if %r in data else _f_%s()" % (
+                name,
+                name,
+                name,
+            )
+        else:
+            value = "data[%r]" % name
+        if name not in dropped:
+            values[name] = value
+
+    if lazy or dropped:
+        body = [
+            "    obj = _new(_cls)",
+            *(
+                "    obj.%s%s = %s"
+                % ("_raw_" if name in lazy else "", name, value)
+                for name, value in values.items()
+            ),
+            "    return obj",
+        ]
+    else:
+        body = [
+            "    return _cls(",
+            *("        %s," % value for value in values.values()),
+            "    )",
+        ]
+    source = "def from_dict(data):\n" + "\n".join(body) + "\n"
+    exec(compile(source, "<%s.from_dict>" % cls.__qualname__, "exec"), env)
+    setattr(cls, "from_dict", staticmethod(env["from_dict"]))
+
+    # descriptors stay when a field stops being lazy: objects decoded before
+    # still hold the raw value, and decoded values shadow the descriptor
+    for name in lazy | dropped:
+        if not isinstance(cls.__dict__.get(name), _LazyField):
+            setattr(cls, name, _LazyField(name, converters[name]))
+    cls._lazy = lazy
+    cls._dropped = dropped
+
+
+def _decoded_state(obj: Any) -> Dict[str, Any]:
+    # Lazy fields are decoded and dropped ones filled in before pickling,
+    # whoever loads the object may use a different projection
+    for key in [key for key in obj.__dict__ if key.startswith("_raw_")]:
+        if key[5:] not in obj.__dict__:
+            getattr(obj, key[5:])
+    state = {
+        key: value
+        for key, value in obj.__dict__.items()
+        if not key.startswith("_raw_")
+    }
+    for f in fields(obj):
+        if f.name not in state:
+            state[f.name] = type(obj).__dict__[f.name].missing()
+    return state
+
+
+def _decoder(
+    lazy: Iterable[str] = (), **converters: Any
+) -> Callable[[Type[T]], Type[T]]:
+    # Generates a specialized from_dict once per class instead of walking
+    # dataclasses.fields() for every object. Fields with a converter are
+    # read with data.get() and passed through it, the rest are taken as-is.
+    # A converter given as a string names a nested dataclass. Lazy fields
+    # keep the raw value and are converted on first access, so the class
+    # must have a __dict__ (no slots).
+
+    def decorate(cls: Type[T]) -> Type[T]:
+        for name, converter in converters.items():
+            if isinstance(converter, str):
+                converters[name] = getattr(cls, converter).from_dict
+        setattr(cls, "_converters", converters)
+        setattr(cls, "_lazy", frozenset())
+        setattr(cls, "_dropped", frozenset())
+        _build_from_dict(cls, frozenset(lazy))
+        return cls
+
+    return decorate
+
+
+@_decoder(verified_at=_date_or_none)
+@dataclass(slots=True)
 class Field:
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "Field"]]
     name: str
     value: str
     verified_at: Optional[datetime] = None
 
-    @classmethod
-    def from_dict(cls, data: dict) -> "Field":
-        return cls(
-            name=data["name"],
-            value=data["value"],
-            verified_at=_date_or_none(data.get("verified_at")),
-        )
-
 
-@dataclass
+@_decoder()
+@dataclass(slots=True)
 class Emoji:
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "Emoji"]]
     shortcode: str
     url: str
     static_url: str
     visible_in_picker: bool
     category: Optional[str] = None
 
-    @classmethod
-    def from_dict(cls, data: dict) -> "Emoji":
-        return cls(
-            **{f.name: data[f.name] for f in fields(cls) if f.name in data}
-        )
-
 
+@_decoder(
+    lazy=("moved",),
+    emojis=_list_of(lambda val: Emoji.from_dict(val)),
+    discoverable=bool,
+    created_at=_date,
+    last_status_at=_date_or_none,
+    moved=lambda val: _fnil(Account.from_dict, val),
+    fields=_list_of(lambda val: Field.from_dict(val)),
+    bot=bool,
+)
 @dataclass
 class Account:
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "Account"]]
     id: str
     username: str
     acct: str
@@ -95,31 +269,8 @@ class Account:
     fields: Optional[List[Field]] = None
     bot: Optional[bool] = None
 
-    @classmethod
-    def from_dict(cls, data: dict) -> "Account":
-        return cls(
-            id=data["id"],
-            username=data["username"],
-            acct=data["acct"],
-            url=data["url"],
-            display_name=data["display_name"],
-            note=data["note"],
-            avatar=data["avatar"],
-            avatar_static=data["avatar_static"],
-            header=data["header"],
-            header_static=data["header_static"],
-            locked=data["locked"],
-            emojis=list(map(Emoji.from_dict, data["emojis"])),
-            discoverable=data.get("discoverable", False),
-            created_at=_date(data["created_at"]),
-            last_status_at=_date_or_none(data.get("last_status_at")),
-            statuses_count=data["statuses_count"],
-            followers_count=data["followers_count"],
-            following_count=data["following_count"],
-            moved=_fnil(Account.from_dict, data.get("moved")),
-            fields=list(map(Field.from_dict, data.get("fields", []))),
-            bot=bool(data.get("bot")),
-        )
+    def __getstate__(self) -> dict:
+        return _decoded_state(self)
 
     @property
     def name(self) -> str:
@@ -135,15 +286,33 @@ class Account:
         return name.strip() or self.username
 
 
-@dataclass
+@_decoder(
+    original="AttachmentMetaImageDimensions",
+    small="AttachmentMetaImageDimensions",
+    focus=lambda val: _fnil(AttachmentMetaImage.Vec2F.from_dict, val),
+)
+@dataclass(slots=True)
 class AttachmentMetaImage:
-    @dataclass
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "AttachmentMetaImage"]]
+
+    @_decoder()
+    @dataclass(slots=True)
     class Vec2F:
+        from_dict: ClassVar[
+            Callable[[Dict[str, Any]], "AttachmentMetaImage.Vec2F"]
+        ]
         x: float
         y: float
 
-    @dataclass
+    @_decoder()
+    @dataclass(slots=True)
     class AttachmentMetaImageDimensions:
+        from_dict: ClassVar[
+            Callable[
+                [Dict[str, Any]],
+                "AttachmentMetaImage.AttachmentMetaImageDimensions",
+            ]
+        ]
         width: int
         height: int
         size: str
@@ -151,30 +320,41 @@ class AttachmentMetaImage:
 
     original: AttachmentMetaImageDimensions
     small: AttachmentMetaImageDimensions
-    focus: Vec2F
-
-    @classmethod
-    def from_dict(cls, data: dict) -> "AttachmentMetaImage":
-        return cls(
-            **{f.name: data[f.name] for f in fields(cls) if f.name in data},
-            original=cls.AttachmentMetaImageDimensions(**data["original"]),
-            small=cls.AttachmentMetaImageDimensions(**data["small"]),
-            focus=cls.Vec2F(**data["focus"]),
-        )
+    focus: Optional[Vec2F] = None
 
 
-@dataclass
+@_decoder(
+    original="AttachmentMetaVideoOriginal",
+    small="AttachmentMetaVideoSmall",
+)
+@dataclass(slots=True)
 class AttachmentMetaVideo:
-    @dataclass
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "AttachmentMetaVideo"]]
+
+    @_decoder()
+    @dataclass(slots=True)
     class AttachmentMetaVideoOriginal:
+        from_dict: ClassVar[
+            Callable[
+                [Dict[str, Any]],
+                "AttachmentMetaVideo.AttachmentMetaVideoOriginal",
+            ]
+        ]
         width: int
         height: int
         duration: float
         bitrate: int
-        frame_rate: Optional[str]  # XXX Gargron wtf?
+        frame_rate: Optional[str] = None  # XXX Gargron wtf?
 
-    @dataclass
+    @_decoder()
+    @dataclass(slots=True)
     class AttachmentMetaVideoSmall:
+        from_dict: ClassVar[
+            Callable[
+                [Dict[str, Any]],
+                "AttachmentMetaVideo.AttachmentMetaVideoSmall",
+            ]
+        ]
         width: int
         height: int
         size: str
@@ -193,17 +373,11 @@ class AttachmentMetaVideo:
     original: AttachmentMetaVideoOriginal
     small: AttachmentMetaVideoSmall
 
-    @classmethod
-    def from_dict(cls, data: dict) -> "AttachmentMetaVideo":
-        return cls(
-            **data,
-            original=cls.AttachmentMetaVideoOriginal(**data["original"]),
-            small=cls.AttachmentMetaVideoSmall(**data["small"]),
-        )
-
 
-@dataclass
+@_decoder()
+@dataclass(slots=True)
 class Attachment:
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "Attachment"]]
     id: str
     type: Literal["unknown", "image", "gifv", "video", "audio"]
     url: str
@@ -215,56 +389,48 @@ class Attachment:
     blurhash: Optional[str] = None
     text_url: Optional[str] = None  # XXX: DEPRECATED
 
-    @classmethod
-    def from_dict(cls, data: dict) -> "Attachment":
-        return cls(
-            **{f.name: data[f.name] for f in fields(cls) if f.name in data}
-        )
 
-
-@dataclass
+@_decoder()
+@dataclass(slots=True)
 class Application:
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "Application"]]
     name: str
     website: Optional[str] = None
     vapid_key: Optional[str] = None
 
-    @classmethod
-    def from_dict(cls, data: dict) -> "Application":
-        return cls(
-            **{f.name: data[f.name] for f in fields(cls) if f.name in data}
-        )
-
 
-@dataclass
+@_decoder()
+@dataclass(slots=True)
 class Mention:
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "Mention"]]
     id: str
     username: str
     acct: str
     url: str
 
-    @classmethod
-    def from_dict(cls, data: dict) -> "Mention":
-        return cls(
-            **{f.name: data[f.name] for f in fields(cls) if f.name in data}
-        )
-
 
-@dataclass
+@_decoder()
+@dataclass(slots=True)
 class Tag:
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "Tag"]]
     name: str
     url: str
 
-    @classmethod
-    def from_dict(cls, data: dict) -> "Tag":
-        return cls(
-            **{f.name: data[f.name] for f in fields(cls) if f.name in data}
-        )
-
 
-@dataclass
+@_decoder(
+    expires_at=_date_or_none,
+    voters_count=_int_or_none,
+    options=_list_of(lambda val: Poll.PollOption.from_dict(val)),
+    emojis=_list_of(lambda val: Emoji.from_dict(val)),
+)
+@dataclass(slots=True)
 class Poll:
-    @dataclass
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "Poll"]]
+
+    @_decoder()
+    @dataclass(slots=True)
     class PollOption:
+        from_dict: ClassVar[Callable[[Dict[str, Any]], "Poll.PollOption"]]
         title: str
         votes_count: Optional[int] = None
 
@@ -277,21 +443,21 @@ class Poll:
     options: List[PollOption] = field(default_factory=list)
     emojis: List[Emoji] = field(default_factory=list)
 
-    @classmethod
-    def from_dict(cls, data: dict) -> "Poll":
-        return cls(
-            id=data["id"],
-            expires_at=_date_or_none(data.get("expires_at")),
-            expired=data["expired"],
-            multiple=data["multiple"],
-            votes_count=data["votes_count"],
-            voters_count=_int_or_none(data.get("voters_count")),
-            options=[cls.PollOption(**opt) for opt in data["options"]],
-        )
-
 
+@_decoder(
+    lazy=("application", "poll"),
+    created_at=_date,
+    account=lambda val: Account.from_dict(val),
+    media_attachments=_list_of(lambda val: Attachment.from_dict(val)),
+    mentions=_list_of(lambda val: Mention.from_dict(val)),
+    tags=_list_of(lambda val: Tag.from_dict(val)),
+    application=lambda val: _fnil(Application.from_dict, val),
+    reblog=lambda val: _fnil(Status.from_dict, val),
+    poll=lambda val: _fnil(Poll.from_dict, val),
+)
 @dataclass
 class Status:
+    from_dict: ClassVar[Callable[[Dict[str, Any]], "Status"]]
     id: str
     uri: str
     created_at: datetime
@@ -316,35 +482,15 @@ class Status:
     language: Optional[str] = None
     text: Optional[str] = None
 
-    @classmethod
-    def from_dict(cls, data: dict) -> "Status":
-        return cls(
-            id=data["id"],
-            uri=data["uri"],
-            created_at=_date(data["created_at"]),
-            account=Account.from_dict(data["account"]),
-            content=data["content"],
-            visibility=data["visibility"],
-            sensitive=data["sensitive"],
-            spoiler_text=data["spoiler_text"],
-            media_attachments=list(
-                map(Attachment.from_dict, data["media_attachments"])
-            ),
-            application=_fnil(Application.from_dict, data.get("application")),
-            reblogs_count=data["reblogs_count"],
-            favourites_count=data["favourites_count"],
-            replies_count=data["replies_count"],
-            url=data.get("url"),
-            in_reply_to_id=data.get("in_reply_to_id"),
-            in_reply_to_account_id=data.get("in_reply_to_account_id"),
-            reblog=_fnil(Status.from_dict, data.get("reblog")),
-            poll=_fnil(Poll.from_dict, data.get("poll")),
-            card=data.get("card"),
-            language=data.get("language"),
-            text=data.get("text"),
-            mentions=[Mention.from_dict(m) for m in data.get("mentions", [])],
-            tags=[Tag.from_dict(m) for m in data.get("tags", [])],
-        )
+    # Formats the loaded filters and integrations need, all of them are
+    # converted together on the first access to any content_* property
+    content_formats: ClassVar[FrozenSet[VALID_OUTPUT_TYPES]] = frozenset()
+
+    def __getstate__(self) -> dict:
+        state = _decoded_state(self)
+        state.pop("content_soup", None)
+        state.pop("_renders", None)
+        return state
 
     @property
     def reblog_or_status(self) -> "Status":
@@ -354,20 +500,140 @@ class Status:
     def link(self) -> str:
         return self.account.url + "/" + str(self.id)
 
-    @property
+    @cached_property
+    def content_soup(self) -> BeautifulSoup:
+        return BeautifulSoup(self.content, features="lxml")
+
+    def missing_formats(
+        self, type_: VALID_OUTPUT_TYPES
+    ) -> FrozenSet[VALID_OUTPUT_TYPES]:
+        if type_ not in self.content_formats:
+            return frozenset((type_,))
+        return frozenset(
+            other
+            for other in self.content_formats
+            if CONTENT_ATTRS[other] not in self.__dict__
+        )
+
+    def _convert(self, type_: VALID_OUTPUT_TYPES) -> str:
+        types = self.missing_formats(type_)
+        if len(types) == 1:
+            return node_process(self.content_soup, type_).rstrip()
+        for other, text in node_process_many(self.content_soup, types).items():
+            self.__dict__[CONTENT_ATTRS[other]] = text.rstrip()
+        return cast(str, self.__dict__[CONTENT_ATTRS[type_]])
+
+    @cached_property
     def content_flathtml(self) -> str:
-        return node_process(
-            BeautifulSoup(self.content, features="lxml"), "html"
-        ).rstrip()
+        return self._convert("html")
 
-    @property
+    @cached_property
     def content_markdown(self) -> str:
-        return node_process(
-            BeautifulSoup(self.content, features="lxml"), "markdown"
-        ).rstrip()
+        return self._convert("markdown")
 
-    @property
+    @cached_property
     def content_plaintext(self) -> str:
-        return node_process(
-            BeautifulSoup(self.content, features="lxml"), "plain"
-        ).rstrip()
+        return self._convert("plain")
+
+
+# Fields the core reads from every status: dedup, checkpoints and metrics
+CORE_FIELDS: FrozenSet[str] = frozenset(("id", "uri", "created_at", "reblog"))
+
+_NESTED: Dict[Any, Dict[str, Any]] = {
+    Status: {"account": Account, "reblog": Status},
+    Account: {"moved": Account},
+}
+# properties and the fields they read
+_PROPERTIES: Dict[Any, Dict[str, Iterable[str]]] = {
+    Status: {
+        "link": ("account.url", "id"),
+        "content_soup": ("content",),
+        "content_flathtml": ("content",),
+        "content_markdown": ("content",),
+        "content_plaintext": ("content",),
+    },
+    Account: {
+        "name": ("display_name", "username"),
+        "name_emojiless": ("display_name", "username", "emojis"),
+    },
+}
+_BASE_LAZY: Dict[Any, FrozenSet[str]] = {
+    cls: cls._lazy for cls in _NESTED  # type: ignore
+}
+
+
+def _project(cls: Any, path: List[str], used: Dict[Any, Set[str]]):
+    if not path:
+        return
+    name, rest = path[0], path[1:]
+    if cls is Status and name == "reblog_or_status":
+        used[Status].add("reblog")
+        _project(Status, rest, used)
+    elif name in _PROPERTIES[cls]:
+        for other in _PROPERTIES[cls][name]:
+            _project(cls, other.split("."), used)
+    else:
+        used[cls].add(name)
+        if name in _NESTED[cls]:
+            _project(_NESTED[cls][name], rest, used)
+
+
+def set_projection(paths: Optional[Iterable[str]]) -> Dict[str, List[str]]:
+    # Fields that have a converter and aren't in `paths` ("reblog.account.
+    # name" and such) are dropped while decoding, neither converted nor kept.
+    # None means anything can be read and restores full decoding with the
+    # default lazy fields.
+    used: Dict[Any, Set[str]] = {cls: set() for cls in _NESTED}
+    for path in paths or ():
+        _project(Status, path.split("."), used)
+
+    result: Dict[str, List[str]] = {}
+    for cls in _NESTED:
+        dropped: FrozenSet[str] = frozenset()
+        if paths is not None:
+            dropped = frozenset(
+                name
+                for name, converter in cls._converters.items()  # type: ignore
+                if converter is not bool and name not in used[cls]
+            )
+        _build_from_dict(cls, _BASE_LAZY[cls] - dropped, dropped)
+        result[cls.__name__] = sorted(dropped)
+    return result
+
+
+class ProjectionSavings(NamedTuple):
+    full_time: float
+    projected_time: float
+    full_memory: int
+    projected_memory: int
+
+
+def _measure(samples: List[bytes]) -> Tuple[float, int]:
+    data = [loads(sample) for sample in samples]
+    started = perf_counter()
+    for item in data:
+        Status.from_dict(item)
+    elapsed = perf_counter() - started
+
+    # raw values of lazy fields stay in memory, so the JSON has to be parsed
+    # inside the measurement too, dropped fields are freed with it
+    start()
+    try:
+        kept = [Status.from_dict(loads(sample)) for sample in samples]
+        memory = get_traced_memory()[0]
+    finally:
+        stop()
+    del kept
+    return elapsed, memory
+
+
+def measure_projection(
+    statuses: List[Dict[str, Any]], paths: Optional[Iterable[str]]
+) -> ProjectionSavings:
+    samples = [dumps(status).encode() for status in statuses]
+    paths = None if paths is None else list(paths)
+    set_projection(None)
+    full = _measure(samples)
+    set_projection(paths)
+    projected = _measure(samples)
+    return ProjectionSavings(full[0], projected[0], full[1], projected[1])
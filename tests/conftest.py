@@ -0,0 +1,70 @@
+from copy import deepcopy
+from typing import Any, Callable, Dict
+
+from pytest import fixture
+
+from mastoposter.types import Status
+
+ACCOUNT: Dict[str, Any] = {
+    "id": "1",
+    "username": "user",
+    "acct": "user",
+    "url": "https://example.com/@user",
+    "display_name": "User",
+    "note": "",
+    "avatar": "https://example.com/avatar.png",
+    "avatar_static": "https://example.com/avatar.png",
+    "header": "https://example.com/header.png",
+    "header_static": "https://example.com/header.png",
+    "locked": False,
+    "emojis": [],
+    "discoverable": True,
+    "created_at": "2022-01-01T00:00:00.000Z",
+    "last_status_at": "2022-01-01",
+    "statuses_count": 1,
+    "followers_count": 0,
+    "following_count": 0,
+    "fields": [],
+}
+
+STATUS: Dict[str, Any] = {
+    "id": "100",
+    "uri": "https://example.com/users/user/statuses/100",
+    "created_at": "2022-01-01T00:00:00.000Z",
+    "account": ACCOUNT,
+    "content": "<p>Hello, <b>world</b>!</p>",
+    "visibility": "public",
+    "sensitive": False,
+    "spoiler_text": "",
+    "media_attachments": [],
+    "reblogs_count": 0,
+    "favourites_count": 0,
+    "replies_count": 0,
+    "mentions": [],
+    "tags": [],
+    "url": "https://example.com/@user/100",
+    "in_reply_to_id": None,
+    "in_reply_to_account_id": None,
+    "reblog": None,
+    "poll": None,
+    "card": None,
+    "language": "en",
+}
+
+
+def _status_dict(**kwargs) -> Dict[str, Any]:
+    data = deepcopy(STATUS)
+    data.update(kwargs)
+    if "uri" not in kwargs:
+        data["uri"] = STATUS["uri"].replace("100", str(data["id"]))
+    return data
+
+
+@fixture
+def status_dict() -> Callable[..., Dict[str, Any]]:
+    return _status_dict
+
+
+@fixture
+def status() -> Callable[..., Status]:
+    return lambda **kwargs: Status.from_dict(_status_dict(**kwargs))
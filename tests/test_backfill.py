@@ -0,0 +1,156 @@
+from asyncio import run
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from threading import Thread
+from typing import Any, Dict, Iterator, List
+from urllib.parse import parse_qs, urlparse
+
+from pytest import fixture
+
+from mastoposter.checkpoint import Checkpoint
+from mastoposter.clients import close_clients
+from mastoposter.sources import SharedSource, timeline_source
+
+
+class TimelineHandler(BaseHTTPRequestHandler):
+    statuses: List[Dict[str, Any]] = []
+    requests: List[Dict[str, List[str]]] = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        self.requests.append(query)
+        min_id = int(query["min_id"][0])
+        limit = int(query["limit"][0])
+        # the statuses right after min_id, still newest first
+        page = [s for s in self.statuses if min_id < int(s["id"])][-limit:]
+        body = dumps(page).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@fixture
+def timeline(status_dict) -> Iterator[str]:
+    # newest first, as Mastodon returns them
+    TimelineHandler.statuses = [
+        status_dict(id=str(i)) for i in range(120, 100, -1)
+    ]
+    TimelineHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TimelineHandler)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield "http://127.0.0.1:%d/api/v1/timelines/list/1" % server.server_port
+    server.shutdown()
+
+
+async def collect(url: str, checkpoint: Checkpoint, **kwargs) -> List[str]:
+    try:
+        return [
+            status.id
+            async for _, status in timeline_source(
+                url, checkpoint, access_token="token", **kwargs
+            )
+        ]
+    finally:
+        await close_clients()
+
+
+def test_backfill_oldest_first(timeline):
+    checkpoint = Checkpoint()
+    checkpoint.last_id = "110"
+    ids = run(collect(timeline, checkpoint, page_size=4))
+    assert ids == [str(i) for i in range(111, 121)]
+    assert len(TimelineHandler.requests) == 3
+    assert TimelineHandler.requests[1]["min_id"] == ["114"]
+
+
+def test_backfill_page_limit(timeline, caplog):
+    checkpoint = Checkpoint()
+    checkpoint.last_id = "100"
+    ids = run(collect(timeline, checkpoint, page_size=5, max_pages=2))
+    # the newest statuses are the ones left out
+    assert ids == [str(i) for i in range(101, 111)]
+    assert "statuses newer than 110 were not fetched" in caplog.text
+
+
+def test_backfill_last_page_full(timeline, caplog):
+    checkpoint = Checkpoint()
+    checkpoint.last_id = "112"
+    ids = run(collect(timeline, checkpoint, page_size=4, max_pages=2))
+    assert ids == [str(i) for i in range(113, 121)]
+    assert len(TimelineHandler.requests) == 3
+    assert "not fetched" not in caplog.text
+
+
+def test_backfill_prefilter(timeline):
+    checkpoint = Checkpoint()
+    checkpoint.last_id = "110"
+    ids = run(
+        collect(
+            timeline,
+            checkpoint,
+            page_size=4,
+            tagger=lambda data: ["even"] * (int(data["id"]) % 2 == 0),
+        )
+    )
+    assert ids == [str(i) for i in range(112, 121, 2)]
+    assert len(TimelineHandler.requests) == 3
+
+
+def test_backfill_tags(timeline):
+    shared = SharedSource(timeline_source)
+    shared.add("even", lambda data: int(data["id"]) % 2 == 0)
+    shared.add("three", lambda data: int(data["id"]) % 3 == 0)
+    checkpoint = Checkpoint()
+    checkpoint.last_id = "113"
+
+    async def main():
+        try:
+            return [
+                (tags, status.id)
+                async for tags, status in timeline_source(
+                    timeline,
+                    checkpoint,
+                    access_token="token",
+                    page_size=4,
+                    tagger=shared.tags,
+                )
+            ]
+        finally:
+            await close_clients()
+
+    # each status keeps the tags it was given, whatever came after it
+    assert run(main()) == [
+        (["even", "three"], "114"),
+        (["even"], "116"),
+        (["three"], "117"),
+        (["even"], "118"),
+        (["even", "three"], "120"),
+    ]
+
+
+def test_backfill_query(timeline):
+    checkpoint = Checkpoint()
+    checkpoint.last_id = "118"
+    ids = run(collect(timeline, checkpoint, query={"local": "true"}))
+    assert ids == ["119", "120"]
+    assert TimelineHandler.requests[0]["local"] == ["true"]
+
+
+def test_backfill_without_checkpoint(timeline):
+    assert run(collect(timeline, Checkpoint())) == []
+    assert TimelineHandler.requests == []
+
+
+def test_checkpoint_persistence(tmp_path):
+    path = str(tmp_path / "checkpoint")
+    checkpoint = Checkpoint(path)
+    assert checkpoint.last_id is None
+    checkpoint.update("99")
+    checkpoint.update("100")
+    checkpoint.update("98")
+    assert Checkpoint(path).last_id == "100"
@@ -0,0 +1,52 @@
+from asyncio import run
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Iterator
+
+from pytest import fixture
+
+from mastoposter.clients import (
+    PoolConfig,
+    close_clients,
+    get_client,
+    stats,
+)
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@fixture
+def server_url() -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield "http://127.0.0.1:%d/" % server.server_port
+    server.shutdown()
+
+
+def test_client_is_shared_and_reused(server_url):
+    async def main():
+        try:
+            client = get_client(server_url)
+            assert get_client(server_url + "other") is client
+            assert get_client(server_url, PoolConfig(retries=1)) is not client
+            for _ in range(3):
+                assert (await client.get(server_url)).text == "ok"
+        finally:
+            await close_clients()
+
+    run(main())
+    host_stats = stats[server_url.split("/")[2]]
+    assert host_stats.requests == 3
+    assert host_stats.connections == 1
+    assert host_stats.reused == 2
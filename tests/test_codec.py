@@ -0,0 +1,33 @@
+from json import dumps
+
+from pytest import importorskip, mark, raises
+
+from mastoposter.codec import get_codec
+from mastoposter.types import Status
+
+
+@mark.parametrize("name", ["json", "orjson", "msgspec"])
+def test_decode_stream_frames(name, status_dict):
+    if name != "json":
+        importorskip(name)
+    codec = get_codec(name)
+    payload = status_dict(id="42")
+    frame = dumps(
+        {"stream": ["list", "1"], "event": "update", "payload": dumps(payload)}
+    )
+    for msg in (frame, frame.encode()):
+        event = codec.decode_event(msg)
+        assert event.event == "update"
+        assert event.error is None
+        assert event.payload is not None
+        assert Status.from_dict(codec.decode(event.payload)).id == "42"
+
+    error = codec.decode_event('{"error": "Invalid access token"}')
+    assert error.event is None
+    assert error.error == "Invalid access token"
+
+
+def test_unknown_codec():
+    assert get_codec("auto").name in ("json", "orjson", "msgspec")
+    with raises(KeyError):
+        get_codec("simdjson")
@@ -0,0 +1,61 @@
+from mastoposter.dedup import SeenCache
+
+
+def test_seen_by_id_and_uri(status):
+    seen = SeenCache()
+    assert not seen.check(status(id="1"))
+    assert seen.check(status(id="1"))
+    assert seen.check(status(id="2", uri=status(id="1").uri))
+    assert not seen.check(status(id="3"))
+    assert (seen.hits, seen.misses) == (2, 2)
+
+
+def test_lru_eviction(status):
+    seen = SeenCache(max_size=4)
+    for i in range(3):
+        assert not seen.check(status(id=str(i)))
+    assert len(seen) == 4
+    assert not seen.check(status(id="0"))
+
+
+def test_ttl_expiry(status):
+    seen = SeenCache(ttl=0)
+    assert not seen.check(status(id="1"))
+    assert not seen.check(status(id="1"))
+
+
+def test_boost_window(status_dict, status):
+    seen = SeenCache()
+    original = status_dict(id="1")
+    assert not seen.check(status(id="10", reblog=original))
+    assert seen.check(status(id="11", reblog=original))
+    assert seen.boost_hits == 1
+
+    seen = SeenCache(boost_window=0)
+    assert not seen.check(status(id="10", reblog=original))
+    assert not seen.check(status(id="11", reblog=original))
+
+
+def test_snapshot(tmp_path, status):
+    path = str(tmp_path / "seen.json")
+    seen = SeenCache(snapshot=path)
+    assert not seen.check(status(id="1"))
+    seen.save()
+    assert SeenCache(snapshot=path).check(status(id="1"))
+
+
+def test_snapshot_skips_pending(tmp_path, status):
+    path = str(tmp_path / "seen.json")
+    seen = SeenCache(snapshot=path)
+    assert not seen.check(status(id="1"), pending=True)
+    assert not seen.check(status(id="2"), pending=True)
+    assert seen.check(status(id="1"), pending=True)
+    seen.done(status(id="1"))
+    seen.done(status(id="2"), delivered=False)
+    assert not seen.check(status(id="2"))
+    assert not seen.check(status(id="3"), pending=True)
+    seen.save()
+
+    seen = SeenCache(snapshot=path)
+    assert seen.check(status(id="1")) and seen.check(status(id="2"))
+    assert not seen.check(status(id="3"))
@@ -0,0 +1,107 @@
+from asyncio import gather, run
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from threading import Thread
+from time import monotonic
+from typing import Iterator, List, Tuple
+
+from httpx import HTTPStatusError
+from pytest import fixture, raises
+
+from mastoposter.clients import close_clients
+from mastoposter.integrations import DiscordIntegration
+
+
+class FakeWebhook(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    calls: List[Tuple[float, str]] = []
+    limit: int = 2
+    reset_after: float = 0.3
+    reset_at: float = 0.0
+    remaining: int = 2
+    flood: int = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        cls = FakeWebhook
+        now = monotonic()
+        cls.calls.append((now, self.path))
+        if now >= cls.reset_at:
+            cls.remaining, cls.reset_at = cls.limit, now + cls.reset_after
+        if cls.flood > 0 or cls.remaining <= 0:
+            cls.flood = max(0, cls.flood - 1)
+            status, body = 429, {"retry_after": 0.2, "global": False}
+        else:
+            cls.remaining -= 1
+            status, body = 200, {"id": str(len(cls.calls))}
+        data = dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-RateLimit-Bucket", "shared")
+        self.send_header("X-RateLimit-Remaining", str(cls.remaining))
+        self.send_header(
+            "X-RateLimit-Reset-After", "%.3f" % (cls.reset_at - now)
+        )
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@fixture
+def webhook() -> Iterator[str]:
+    FakeWebhook.calls = []
+    FakeWebhook.flood = 0
+    FakeWebhook.reset_at = 0.0
+    DiscordIntegration.buckets.clear()
+    DiscordIntegration.bucket_ids.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeWebhook)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield "http://127.0.0.1:%d/api/webhooks/1/token" % server.server_port
+    server.shutdown()
+
+
+def deliver(*calls):
+    async def main():
+        try:
+            return await gather(*calls)
+        finally:
+            await close_clients()
+
+    return run(main())
+
+
+def test_waits_for_bucket_reset(webhook, status):
+    dc = DiscordIntegration(webhook + "?wait=true")
+    deliver(*[dc(status(id=str(i))) for i in range(5)])
+    assert len(FakeWebhook.calls) == 5
+    times = [t for t, _ in FakeWebhook.calls]
+    assert times[2] - times[0] >= 0.25
+    assert times[4] - times[2] >= 0.25
+
+
+def test_retries_on_429(webhook, status):
+    FakeWebhook.flood = 1
+    dc = DiscordIntegration(webhook + "?wait=true")
+    deliver(dc(status()))
+    assert len(FakeWebhook.calls) == 2
+    assert FakeWebhook.calls[1][0] - FakeWebhook.calls[0][0] >= 0.2
+
+
+def test_error_is_raised(webhook, status):
+    FakeWebhook.flood = 1
+    dc = DiscordIntegration(webhook + "?wait=true", retries=0)
+    with raises(HTTPStatusError):
+        deliver(dc(status()))
+
+
+def test_shared_bucket(webhook, status):
+    first = DiscordIntegration(webhook + "?wait=true")
+    thread = DiscordIntegration(webhook + "?wait=true&thread_id=1")
+    other = DiscordIntegration(webhook.replace("/1/", "/2/"))
+    assert first.bucket is thread.bucket
+    assert first.bucket is not other.bucket
+    deliver(first(status()), other(status()))
+    assert first.bucket is other.bucket
@@ -0,0 +1,197 @@
+from configparser import ConfigParser
+from typing import Dict
+
+from mastoposter.filters import run_filters
+from mastoposter.filters.base import BaseFilter, FilterContext, FilterInstance
+from mastoposter.filters.combined import CombinedFilter
+from mastoposter.types import Status
+
+CONFIG = """
+[filter/spoiler]
+type = spoiler
+regexp = ^CW
+
+[filter/public]
+type = visibility
+options = public
+
+[filter/either]
+type = combined
+filters = spoiler public
+operator = any
+
+[filter/one]
+type = combined
+filters = spoiler public
+operator = single
+"""
+
+calls: Dict[str, int] = {}
+
+
+def load(*names: str) -> Dict[str, FilterInstance]:
+    config = ConfigParser()
+    config.read_string(CONFIG)
+    filters = {
+        name.lstrip("~!"): BaseFilter.new_instance(
+            name, config["filter/" + name.lstrip("~!")]
+        )
+        for name in names
+    }
+    for fil in filters.values():
+        fil.filter.post_init(filters, config)
+    return filters
+
+
+def counting(fil: FilterInstance) -> FilterInstance:
+    original = fil.filter.evaluate
+
+    def evaluate(ctx: FilterContext) -> bool:
+        calls[fil.name] = calls.get(fil.name, 0) + 1
+        return original(ctx)
+
+    fil.filter.evaluate = evaluate  # type: ignore
+    return fil
+
+
+def test_run_filters_short_circuits(status):
+    calls.clear()
+    spoiler, public = map(counting, load("spoiler", "public").values())
+    assert not run_filters([spoiler, public], status())
+    assert calls == {"spoiler": 1}
+    assert run_filters([public], status())
+    assert calls == {"spoiler": 1, "public": 1}
+
+
+def test_results_are_memoized_per_status(status):
+    calls.clear()
+    spoiler, public = map(counting, load("spoiler", "~public").values())
+    ctx = FilterContext(status(spoiler_text="CW: test"))
+    assert run_filters([spoiler], ctx.status, ctx)
+    assert not run_filters([spoiler, public], ctx.status, ctx)
+    assert calls == {"spoiler": 1, "public": 1}
+    assert ctx.hits == 1
+
+
+def test_combined_shares_memo(status):
+    filters = load("either", "spoiler")
+    ctx = FilterContext(status(spoiler_text="CW"))
+    assert run_filters([filters["either"]], ctx.status, ctx)
+    assert run_filters([filters["spoiler"]], ctx.status, ctx)
+    assert ctx.hits == 1
+
+
+def test_combined_operators(status):
+    either = load("either")["either"]
+    one = load("one")["one"]
+    assert isinstance(either.filter, CombinedFilter)
+
+    cw_public: Status = status(spoiler_text="CW")
+    cw_private: Status = status(spoiler_text="CW", visibility="private")
+    private: Status = status(visibility="private")
+
+    assert run_filters([either], cw_public)
+    assert run_filters([either], cw_private)
+    assert not run_filters([either], private)
+
+    assert not run_filters([one], cw_public)
+    assert run_filters([one], cw_private)
+    assert not run_filters([one], private)
+    assert one.filter(cw_private)
+
+
+def test_combined_status_fields():
+    either = load("either")["either"].filter
+    assert either.status_fields == {"spoiler_text", "visibility"}
+    either.filters[1].filter.status_fields = None  # type: ignore
+    assert either.status_fields is None
+
+
+def test_account_matcher_is_fnmatch():
+    from fnmatch import fnmatch
+
+    from mastoposter.filters.matcher import AccountMatcher
+
+    masks = [
+        "@name",
+        "@name@instance",
+        "@*@example.com",
+        "@bot?@*",
+        "@[ab]ot@x.org",
+        "@*@*.social",
+    ]
+    accounts = [
+        "@name",
+        "@name@instance",
+        "@user@example.com",
+        "@user@sub.example.com",
+        "@@example.com",
+        "@example.com",
+        "@bot1@anywhere",
+        "@bot@anywhere",
+        "@aot@x.org",
+        "@cot@x.org",
+        "@user@mastodon.social",
+        "@user@social",
+    ]
+    for i in range(len(masks) + 1):
+        matcher = AccountMatcher(masks[:i])
+        for acct in accounts:
+            assert matcher.match(acct) == any(
+                fnmatch(acct, mask) for mask in masks[:i]
+            ), (acct, masks[:i])
+
+
+def test_mention_and_boost_filters(status, status_dict):
+    from mastoposter.filters import BoostFilter, MentionFilter
+
+    mentions = [{"id": "2", "username": "a", "acct": "a@b.c", "url": ""}]
+    mention = MentionFilter({"@x@y", "@*@b.c"})
+    assert mention(status(mentions=mentions))
+    assert not mention(status())
+    assert not MentionFilter({"@x"})(status(mentions=mentions))
+
+    account = dict(status_dict()["account"], acct="bot@b.c")
+    boost = status(reblog=status_dict(account=account))
+    assert BoostFilter(["@*@b.c"])(boost)
+    assert not BoostFilter(["@bot"])(boost)
+    assert BoostFilter([])(boost)
+    assert not BoostFilter([])(status())
+
+
+def test_keyword_matcher():
+    from mastoposter.filters.keywords import KeywordMatcher
+
+    matcher = KeywordMatcher(["he", "she", "his", "hers", "Straße"])
+    assert matcher.search("uSHErs") == "she"
+    assert matcher.search("ahishers") == "his"
+    assert matcher.search("STRASSE") == "strasse"
+    assert matcher.search("hi there") == "he"
+    assert matcher.search("nothing") is None
+
+    words = KeywordMatcher(["cat", "hot dog"], whole_words=True)
+    assert words.search("concatenate") is None
+    assert words.search("a cat!") == "cat"
+    assert words.search("hot dogs") is None
+    assert words.search("two hot dog") == "hot dog"
+
+    exact = KeywordMatcher(["Cat"], ignore_case=False)
+    assert exact.search("cat") is None
+    assert exact.search("Cat") == "Cat"
+
+
+def test_keywords_content_filter(tmp_path, status):
+    from mastoposter.filters import TextFilter
+
+    path = tmp_path / "words.txt"
+    path.write_text("# comment\nspoiler word\n\nhello\n")
+    config = ConfigParser()
+    config.read_string(
+        "[filter/words]\ntype = content\nwhole_words = yes\n"
+        "keywords_file = %s\n" % path
+    )
+    fil = BaseFilter.new_instance("words", config["filter/words"]).filter
+    assert isinstance(fil, TextFilter)
+    assert fil(status(content="<p>Hello, world</p>"))
+    assert fil(status(content="<p>nope</p>", spoiler_text="Spoiler word"))
+    assert not fil(status(content="<p>hellooo</p>"))
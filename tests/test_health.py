@@ -0,0 +1,69 @@
+from asyncio import run
+from json import dumps
+from typing import List
+
+from mastoposter.health import Backoff, ConnectionHealth
+from mastoposter.metrics import FRAME_BYTES
+from mastoposter.sources import websocket_source
+
+
+def test_backoff_bounds():
+    backoff = Backoff(1.0, 10.0)
+    for attempt in range(8):
+        assert 0 <= backoff.next_delay() <= min(10.0, 2**attempt)
+    assert backoff.attempt == 8
+    backoff.reset()
+    assert backoff.next_delay() <= 1.0
+
+
+def test_health_counters():
+    health = ConnectionHealth("test")
+    assert not health.connected and health.last_frame_age is None
+    health.on_connect(0.1)
+    health.on_frame()
+    health.on_frame()
+    assert health.connected and health.frames == 2
+    assert health.last_frame_age is not None
+    health.on_disconnect(ConnectionError("boom"))
+    health.on_connect(0.2)
+    assert health.reconnects == 1 and health.failures == 1
+    assert health.last_error == "ConnectionError('boom')"
+    assert health.connect_latency == 0.2
+
+
+def test_websocket_reconnects(status_dict):
+    from websockets.asyncio.server import serve
+
+    async def handler(ws):
+        status = status_dict(id=str(len(ids) + 1), content="ü")
+        payload = dumps(status, ensure_ascii=False)
+        frame = dumps(
+            {"event": "update", "payload": payload}, ensure_ascii=False
+        )
+        sent.append(len(frame.encode()))
+        await ws.send(frame)
+        await ws.close()
+
+    ids: List[str] = []
+    sent: List[int] = []
+    health = ConnectionHealth("reconnects")
+
+    async def main():
+        async with serve(handler, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            async for _, status in websocket_source(
+                "ws://127.0.0.1:%d" % port,
+                reconnect=True,
+                reconnect_delay=0.01,
+                health=health,
+                json_codec="json",
+            ):
+                ids.append(status.id)
+                if len(ids) == 3:
+                    break
+
+    run(main())
+    assert ids == ["1", "2", "3"]
+    assert health.connects == 3 and health.reconnects == 2
+    assert health.frames == 3
+    assert FRAME_BYTES.values[("reconnects",)] == sum(sent)
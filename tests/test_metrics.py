@@ -0,0 +1,123 @@
+from asyncio import open_connection, run
+from configparser import ConfigParser
+from typing import Optional
+
+from mastoposter import execute_integrations, load_integrations_from
+from mastoposter.dedup import SeenCache
+from mastoposter.integrations import FilteredIntegration
+from mastoposter.integrations.base import BaseIntegration
+from mastoposter.metrics import (
+    DELIVERIES,
+    DELIVERY_LAG,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    serve_metrics,
+)
+from mastoposter.outbox import Outbox
+from mastoposter.pipeline import Pipeline
+from mastoposter.types import Status
+
+
+class Failing(BaseIntegration):
+    def __init__(self):
+        pass
+
+    async def __call__(self, status: Status) -> Optional[str]:
+        raise RuntimeError("nope")
+
+
+class Working(BaseIntegration):
+    def __init__(self):
+        pass
+
+    async def __call__(self, status: Status) -> Optional[str]:
+        return status.id
+
+
+def test_histogram_render():
+    hist = Histogram("test_seconds", "Test", ("stage",), (0.1, 1.0))
+    hist.observe(0.05, stage="a")
+    hist.observe(0.1, stage="a")
+    hist.observe(5, stage="a")
+    assert hist.render() == [
+        "# HELP test_seconds Test",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="a",le="0.1"} 2',
+        'test_seconds_bucket{stage="a",le="1"} 2',
+        'test_seconds_bucket{stage="a",le="+Inf"} 3',
+        'test_seconds_sum{stage="a"} 5.15',
+        'test_seconds_count{stage="a"} 3',
+    ]
+
+
+def test_counter_and_gauge():
+    counter = Counter("test_total", "Test", ("name",))
+    counter.inc(name='a "quoted"\nname')
+    counter.inc(2, name='a "quoted"\nname')
+    assert counter.render()[-1] == 'test_total{name="a \\"quoted\\"\\nname"} 3'
+    gauge = Gauge("test_gauge", "Test")
+    gauge.set_function(lambda: None)
+    assert gauge.render()[2:] == []
+    gauge.set_function(lambda: 1.5)
+    assert gauge.render()[2:] == ["test_gauge 1.5"]
+
+
+def test_delivery_metrics(status):
+    sinks = [
+        FilteredIntegration(Working(), [], "working"),
+        FilteredIntegration(Failing(), [], "failing"),
+    ]
+    run(execute_integrations(status(), sinks))
+    assert DELIVERIES.values[("working", "ok")] >= 1
+    assert DELIVERIES.values[("failing", "error")] >= 1
+    assert sum(DELIVERY_LAG.counts[("failing", "error")]) >= 1
+
+
+def test_component_gauges(tmp_path, status):
+    pipeline = Pipeline(
+        [FilteredIntegration(Working(), [], "working")],
+        seen=SeenCache(),
+        outbox=Outbox(str(tmp_path / "outbox.db")),
+    )
+
+    async def source():
+        yield status(id="1")
+        yield status(id="1")
+
+    run(pipeline.run(source()))
+    metrics = REGISTRY.render().splitlines()
+    assert 'mastoposter_pipeline{field="delivered_count"} 1' in metrics
+    assert 'mastoposter_dedup{field="hits"} 1' in metrics
+    assert 'mastoposter_dedup{field="misses"} 1' in metrics
+    assert 'mastoposter_outbox{field="completed"} 1' in metrics
+
+
+def test_module_name_label():
+    conf = ConfigParser()
+    conf.read_string(
+        "[main]\nmodules = hook\n"
+        "[module/hook]\ntype = discord\n"
+        "webhook = https://discord.com/api/webhooks/1/x?wait=true\n"
+    )
+    (module,) = load_integrations_from(conf)
+    assert module.name == module.sink.name == "hook"
+
+
+def test_metrics_server():
+    async def get(path: str) -> bytes:
+        server = await serve_metrics("127.0.0.1:0")
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await open_connection("127.0.0.1", port)
+        writer.write(b"GET %s HTTP/1.1\r\nHost: x\r\n\r\n" % path.encode())
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+
+    response = run(get("/metrics"))
+    assert response.startswith(b"HTTP/1.1 200 OK")
+    assert b"# TYPE mastoposter_stage_seconds histogram" in response
+    assert run(get("/")).startswith(b"HTTP/1.1 404")
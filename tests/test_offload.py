@@ -0,0 +1,55 @@
+from asyncio import gather, run
+from pickle import dumps, loads
+
+from jinja2 import Template
+from pytest import mark
+
+from mastoposter import offload
+from mastoposter.templates import get_template
+
+CONTENT = '<p>Hello, <a href="https://example.com">world</a></p>'
+SOURCE = "{{ status.content_plaintext }} by {{ status.account.name }}"
+
+
+@mark.parametrize("kind", ["none", "thread", "process"])
+def test_offload(kind, status):
+    async def main():
+        s = status(content=CONTENT)
+        markdown = await offload.convert(s, "markdown")
+        text = await offload.render(Template(SOURCE), {"status": s}, SOURCE)
+        return s, markdown, text
+
+    offload.configure(kind, 1)
+    try:
+        s, markdown, text = run(main())
+    finally:
+        offload.configure("thread")
+    assert markdown == s.content_markdown
+    assert "content_markdown" in s.__dict__
+    assert text == "Hello, world (https://example.com) by User"
+
+
+def test_render_status_memoized(status, monkeypatch):
+    calls = []
+
+    def render(context):
+        calls.append(context["status"].id)
+        return "text"
+
+    template = get_template("{{ status.id }}")
+    monkeypatch.setattr(template, "render", render)
+
+    async def main(s):
+        return await gather(
+            *[offload.render_status(template, s) for _ in range(5)]
+        )
+
+    offload.configure("none")
+    try:
+        s = status()
+        assert run(main(s)) == ["text"] * 5
+        assert run(main(s)) == ["text"] * 5
+        assert calls == ["100"]
+        assert "_renders" not in loads(dumps(s)).__dict__
+    finally:
+        offload.configure("thread")
@@ -0,0 +1,147 @@
+from asyncio import gather, run, sleep
+from typing import List, Optional
+
+from mastoposter import execute_integrations
+from mastoposter.integrations import FilteredIntegration
+from mastoposter.integrations.base import BaseIntegration, DeliveryError
+from mastoposter.outbox import Outbox
+from mastoposter.pipeline import Pipeline
+from mastoposter.types import Status
+
+
+class RecordingIntegration(BaseIntegration):
+    def __init__(self, fail: bool = False, error: Optional[Exception] = None):
+        self.fail = fail
+        self.error = error or ConnectionError("nope")
+        self.received: List[str] = []
+
+    async def __call__(self, status: Status) -> Optional[str]:
+        if self.fail:
+            raise self.error
+        self.received.append(status.id)
+        return status.id
+
+
+def test_outbox_batches_and_persists(tmp_path, status):
+    path = str(tmp_path / "outbox.db")
+
+    async def first():
+        outbox = Outbox(path)
+        await outbox.open()
+        ids = await gather(
+            *[outbox.add(status(id=str(i)), ["a", "b"]) for i in range(10)]
+        )
+        for a, _ in ids[:5]:
+            outbox.done(a)
+        await outbox.close()
+        return outbox
+
+    outbox = run(first())
+    assert outbox.added == 20
+    assert outbox.flushes <= 2
+
+    async def second():
+        outbox = Outbox(path)
+        await outbox.open()
+        try:
+            return await outbox.pending()
+        finally:
+            await outbox.close()
+
+    jobs = run(second())
+    assert [(j.module, j.status.id) for j in jobs[:3]] == [
+        ("b", "0"),
+        ("b", "1"),
+        ("b", "2"),
+    ]
+    assert len(jobs) == 15
+
+
+def test_failed_deliveries_are_replayed(tmp_path, status):
+    path = str(tmp_path / "outbox.db")
+    good, bad = RecordingIntegration(), RecordingIntegration(fail=True)
+    sinks = [
+        FilteredIntegration(good, [], "good"),
+        FilteredIntegration(bad, [], "bad"),
+    ]
+
+    async def deliver():
+        outbox = Outbox(path)
+        await outbox.open()
+        s = status()
+        s.content_plaintext
+        await execute_integrations(s, sinks, outbox)
+        await outbox.close()
+
+    run(deliver())
+    assert good.received == ["100"]
+
+    bad.fail = False
+
+    async def no_statuses():
+        return
+        yield
+
+    run(Pipeline(sinks, outbox=Outbox(path)).run(no_statuses()))
+    assert good.received == ["100"]
+    assert bad.received == ["100"]
+
+    bad.received.clear()
+    run(Pipeline(sinks, outbox=Outbox(path)).run(no_statuses()))
+    assert bad.received == []
+
+
+def test_failed_deliveries_are_dropped(tmp_path, status):
+    path = str(tmp_path / "outbox.db")
+    flaky = RecordingIntegration(fail=True)
+    rejected = RecordingIntegration(
+        fail=True, error=DeliveryError("chat not found")
+    )
+    sinks = [
+        FilteredIntegration(flaky, [], "flaky"),
+        FilteredIntegration(rejected, [], "rejected"),
+    ]
+
+    async def deliver():
+        outbox = Outbox(path, max_attempts=2)
+        await outbox.open()
+        await execute_integrations(status(), sinks, outbox)
+        await outbox.close()
+        return outbox
+
+    # the permanent error is dropped at once, the other one is retried
+    outbox = run(deliver())
+    assert (outbox.retried, outbox.dropped) == (1, 1)
+
+    async def replay():
+        outbox = Outbox(path, max_attempts=2)
+        await outbox.open()
+        try:
+            await Pipeline(sinks, outbox=outbox).replay()
+            return await outbox.pending()
+        finally:
+            await outbox.close()
+
+    # out of attempts after the replay
+    assert run(replay()) == []
+
+
+def test_failed_deliveries_are_retried_while_running(tmp_path, status):
+    path = str(tmp_path / "outbox.db")
+    sink = RecordingIntegration(fail=True)
+    pipeline = Pipeline(
+        [FilteredIntegration(sink, [], "sink")],
+        outbox=Outbox(path),
+        retry_interval=0.05,
+    )
+
+    async def source():
+        yield status()
+        await sleep(0.02)
+        sink.fail = False
+        await sleep(0.1)
+
+    run(pipeline.run(source()))
+    assert sink.received == ["100"]
+    assert pipeline.outbox is not None
+    assert pipeline.outbox.completed == 1
@@ -0,0 +1,156 @@
+from asyncio import Event, TimeoutError, run, sleep, wait_for
+from typing import List, Optional
+
+from mastoposter.checkpoint import Checkpoint
+from mastoposter.dedup import SeenCache
+from mastoposter.integrations import FilteredIntegration
+from mastoposter.integrations.base import BaseIntegration
+from mastoposter.pipeline import Pipeline
+from mastoposter.types import Status
+
+
+class SlowIntegration(BaseIntegration):
+    def __init__(self, release: Event):
+        self.release = release
+        self.received: List[str] = []
+
+    async def __call__(self, status: Status) -> Optional[str]:
+        await self.release.wait()
+        self.received.append(status.id)
+        return status.id
+
+
+def test_pipeline_delivers_in_order(status):
+    sink = SlowIntegration(Event())
+    sink.release.set()
+    pipeline = Pipeline([FilteredIntegration(sink, [])], queue_size=2)
+
+    async def source():
+        for i in range(5):
+            yield status(id=str(i))
+
+    run(pipeline.run(source()))
+    assert sink.received == ["0", "1", "2", "3", "4"]
+    assert pipeline.delivered_count == 5
+
+
+def test_pipeline_backpressure(status):
+    sink = SlowIntegration(Event())
+    pipeline = Pipeline([FilteredIntegration(sink, [])], queue_size=2)
+    read: List[str] = []
+
+    async def source():
+        for i in range(5):
+            read.append(str(i))
+            yield status(id=str(i))
+
+    async def release_later():
+        await sleep(0.05)
+        # one status is held by the worker, two more are queued
+        assert read == ["0", "1", "2", "3"]
+        assert pipeline.depth == 2
+        sink.release.set()
+
+    async def main():
+        from asyncio import gather
+
+        await gather(pipeline.run(source()), release_later())
+
+    run(main())
+    assert pipeline.backpressure_count > 0
+    assert sink.received == ["0", "1", "2", "3", "4"]
+
+
+def test_pipeline_routes_sources(status):
+    release = Event()
+    release.set()
+    a, b, both = (SlowIntegration(release) for _ in range(3))
+    pipeline = Pipeline(
+        [
+            FilteredIntegration(a, [], "a", frozenset(["a"])),
+            FilteredIntegration(b, [], "b", frozenset(["b"])),
+            FilteredIntegration(both, [], "both"),
+        ]
+    )
+
+    async def feed(name: str, ids: List[str]):
+        for id in ids:
+            yield [name], status(id=id)
+
+    run(pipeline.run_feeds([feed("a", ["1", "2"]), feed("b", ["3"])]))
+    assert a.received == ["1", "2"]
+    assert b.received == ["3"]
+    assert sorted(both.received) == ["1", "2", "3"]
+
+
+def test_pipeline_dedup_per_source(status):
+    release = Event()
+    release.set()
+    a, b, ab, both = (SlowIntegration(release) for _ in range(4))
+    checkpoints = {"a": Checkpoint(), "b": Checkpoint()}
+    pipeline = Pipeline(
+        [
+            FilteredIntegration(a, [], "a", frozenset(["a"])),
+            FilteredIntegration(b, [], "b", frozenset(["b"])),
+            FilteredIntegration(ab, [], "ab", frozenset(["a", "b"])),
+            FilteredIntegration(both, [], "both"),
+        ],
+        checkpoints=checkpoints,
+        seen=SeenCache(),
+    )
+
+    async def feed():
+        # the same status over two connections, then once more over one
+        yield ["a"], status(id="1")
+        yield ["b"], status(id="1")
+        yield ["a", "b"], status(id="1")
+
+    run(pipeline.run_feeds([feed()]))
+    assert a.received == ["1"]
+    assert b.received == ["1"]
+    assert ab.received == ["1"]
+    assert both.received == ["1"]
+    assert checkpoints["a"].last_id == checkpoints["b"].last_id == "1"
+
+
+def test_pipeline_restart_keeps_queued_statuses(tmp_path, status):
+    checkpoint_path = str(tmp_path / "checkpoint")
+    snapshot = str(tmp_path / "seen.json")
+
+    def start(sink: SlowIntegration) -> Pipeline:
+        return Pipeline(
+            [FilteredIntegration(sink, [])],
+            checkpoints={"main": Checkpoint(checkpoint_path)},
+            seen=SeenCache(snapshot=snapshot),
+        )
+
+    async def feed(checkpoint: Checkpoint):
+        # what backfill gives after the checkpoint, then nothing more
+        for id in ["1", "2", "3", "4"]:
+            if checkpoint.last_id is None or id > checkpoint.last_id:
+                yield ["main"], status(id=id)
+
+    async def main(pipeline: Pipeline):
+        feeds = [feed(pipeline.checkpoints["main"])]
+        try:
+            await wait_for(pipeline.run_feeds(feeds), 0.2)
+        except TimeoutError:
+            pass
+
+    class OneAtATime(SlowIntegration):
+        async def __call__(self, status: Status) -> Optional[str]:
+            if status.id != "1":
+                await self.release.wait()
+            self.received.append(status.id)
+            return status.id
+
+    # 1 is delivered, then the process stops with 2-4 still queued
+    first = OneAtATime(Event())
+    run(main(start(first)))
+    assert first.received == ["1"]
+
+    release = Event()
+    release.set()
+    second = SlowIntegration(release)
+    run(main(start(second)))
+    assert second.received == ["2", "3", "4"]
@@ -0,0 +1,108 @@
+from configparser import ConfigParser
+from typing import List
+
+from mastoposter.filters import run_filters_raw
+from mastoposter.filters.base import BaseFilter, FilterInstance
+from mastoposter.integrations import FilteredIntegration
+from mastoposter.prefilter import Prefilter
+from mastoposter.types import Status
+
+CONFIG = """
+[filter/public]
+type = visibility
+options = public
+
+[filter/boost]
+type = boost
+list = @friend@example.org
+
+[filter/mention]
+type = mention
+list = @admin@*
+
+[filter/spoiler]
+type = spoiler
+regexp = ^CW
+
+[filter/both]
+type = combined
+filters = public spoiler
+operator = all
+
+[filter/either]
+type = combined
+filters = public spoiler
+operator = any
+"""
+
+
+def load(*names: str) -> List[FilterInstance]:
+    config = ConfigParser()
+    config.read_string(CONFIG)
+    filters = {
+        name.lstrip("~!"): BaseFilter.new_instance(
+            name, config["filter/" + name.lstrip("~!")]
+        )
+        for name in names
+    }
+    for fil in filters.values():
+        fil.filter.post_init(filters, config)
+    return list(filters.values())
+
+
+def module(*names: str) -> FilteredIntegration:
+    return FilteredIntegration(None, load(*names), "test")  # type: ignore
+
+
+def test_raw_checks_agree(status_dict):
+    boost = status_dict(id="2")
+    boost["account"] = dict(boost["account"], acct="friend@example.org")
+    samples = [
+        status_dict(),
+        status_dict(visibility="unlisted"),
+        status_dict(reblog=boost),
+        status_dict(mentions=[{"acct": "admin@example.com"}]),
+    ]
+    for data in samples:
+        data.setdefault("mentions", [])
+        data["mentions"] = [
+            dict(id="1", username="u", url="u", **m) for m in data["mentions"]
+        ]
+        status = Status.from_dict(data)
+        for fil in load("public", "~public", "boost", "mention", "both"):
+            raw = fil.check_raw(data)
+            if raw is not None:
+                assert raw == fil.filter(status) ^ fil.inverse
+
+
+def test_run_filters_raw(status_dict):
+    assert run_filters_raw(load("public"), status_dict()) is True
+    assert run_filters_raw(load("~public"), status_dict()) is False
+    assert run_filters_raw(load("spoiler"), status_dict()) is None
+    assert run_filters_raw(load("public", "spoiler"), status_dict()) is None
+    private = status_dict(visibility="private")
+    assert run_filters_raw(load("both"), private) is False
+    assert run_filters_raw(load("either"), private) is None
+
+
+def test_prefilter_global_checks(status_dict):
+    prefilter = Prefilter("1", [])
+    assert prefilter(status_dict())
+    assert not prefilter(status_dict(visibility="direct"))
+    assert not prefilter(status_dict(in_reply_to_account_id="2"))
+    other = status_dict()
+    other["account"] = dict(other["account"], id="2")
+    assert not prefilter(other)
+    assert Prefilter("all", [])(other)
+    assert Prefilter("1", [], True)(status_dict(in_reply_to_account_id="2"))
+    assert prefilter.passed == 1
+    assert prefilter.rejected == {"visibility": 1, "reply": 1, "account": 1}
+
+
+def test_prefilter_modules(status_dict):
+    prefilter = Prefilter("1", [module("~public"), module("boost")])
+    assert not prefilter(status_dict())
+    assert prefilter(status_dict(visibility="unlisted"))
+    prefilter = Prefilter("1", [module("~public"), module("spoiler")])
+    assert prefilter(status_dict())
+    assert prefilter.rejected_count == 0
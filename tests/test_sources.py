@@ -0,0 +1,72 @@
+from asyncio import run
+from configparser import ConfigParser
+from typing import Any, Dict, List, Optional
+
+from mastoposter.__main__ import load_sources
+from mastoposter.sources import RawTagger, SharedSource
+from mastoposter.types import Status
+
+CONFIG = """
+[main]
+instance = example.com
+token = main-token
+list = 1
+auto_reconnect = yes
+sources = first second
+
+[source/first]
+instance = example.org
+token = first-token
+list = 2
+
+[source/second]
+instance = example.net
+token = second-token
+stream = user
+auto_reconnect = no
+"""
+
+
+def test_load_sources():
+    conf = ConfigParser()
+    conf.read_string(CONFIG)
+    sources = load_sources(conf)
+    assert list(sources) == ["first", "second"]
+    assert sources["first"]["token"] == "first-token"
+    assert sources["first"].getboolean("auto_reconnect")
+    assert not sources["second"].getboolean("auto_reconnect")
+    assert "list" not in sources["second"]
+
+
+def test_load_sources_legacy():
+    conf = ConfigParser()
+    conf.read_string(CONFIG.replace("sources = first second", ""))
+    sources = load_sources(conf)
+    assert list(sources) == ["main"]
+    assert sources["main"]["token"] == "main-token"
+
+
+def test_shared_source(status_dict):
+    events: List[Dict[str, Any]] = [
+        status_dict(id="1", visibility="public"),
+        status_dict(id="2", visibility="unlisted"),
+        status_dict(id="3", visibility="private"),
+    ]
+    opened: List[Dict[str, Any]] = []
+
+    async def source(tagger: Optional[RawTagger] = None, **kwargs):
+        opened.append(kwargs)
+        for data in events:
+            tags = [] if tagger is None else tagger(data)
+            if tagger is None or tags:
+                yield tags, Status.from_dict(data)
+
+    shared = SharedSource(source, url="wss://example.com")
+    shared.add("public", lambda data: data["visibility"] == "public")
+    shared.add("listed", lambda data: data["visibility"] != "private")
+
+    async def collect():
+        return [(list(names), s.id) async for names, s in shared.feed()]
+
+    assert run(collect()) == [(["public", "listed"], "1"), (["listed"], "2")]
+    assert opened == [{"url": "wss://example.com"}]
@@ -0,0 +1,427 @@
+from asyncio import gather, run
+from configparser import ConfigParser
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from threading import Thread
+from time import monotonic
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+from pytest import fixture, raises
+
+from mastoposter.clients import close_clients
+from mastoposter import execute_integrations
+from mastoposter.integrations import FilteredIntegration, TelegramIntegration
+from mastoposter.integrations.base import DeliveryError
+from mastoposter.integrations.telegram import FileIdCache, plan_media_groups
+from mastoposter.outbox import Outbox
+from mastoposter.pipeline import Pipeline
+
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    calls: List[Tuple[float, str, Dict[str, Any]]] = []
+    uploads: Dict[str, bytes] = {}
+    downloads: List[str] = []
+    flood: int = 0
+    # methods answered with a permanent error
+    rejected: Set[str] = set()
+    # chats answered with the given error code
+    broken: Dict[str, int] = {}
+
+    def read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding") != "chunked":
+            return self.rfile.read(int(self.headers["Content-Length"]))
+        body = b""
+        while size := int(self.rfile.readline().strip(), 16):
+            body += self.rfile.read(size)
+            self.rfile.readline()
+        self.rfile.readline()
+        return body
+
+    def read_params(self) -> Dict[str, Any]:
+        body = self.read_body()
+        content_type = self.headers["Content-Type"]
+        if not content_type.startswith("multipart/form-data"):
+            return loads(body)
+        message = BytesParser().parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+        )
+        params: Dict[str, Any] = {}
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            data = part.get_payload(decode=True)
+            if part.get_filename():
+                FakeBotAPI.uploads[name] = data
+                params[name] = "upload:" + part.get_filename()
+            elif name == "media":
+                params[name] = loads(data)
+            else:
+                params[name] = data.decode()
+        for item in params.get("media", ()):
+            if item["media"].startswith("attach://"):
+                item["media"] = params[item["media"][9:]]
+        return params
+
+    def reply_media(self, method: str, message: Dict[str, Any], media: Any):
+        kind = method[4:].lower()
+        file_id = "id:%s" % media.rsplit("/", 1)[-1].rsplit(":", 1)[-1]
+        message[kind] = {"file_id": file_id}
+        if kind == "photo":
+            message[kind] = [{"file_id": "thumb"}, message[kind]]
+
+    def do_GET(self):
+        FakeBotAPI.downloads.append(self.path)
+        body = b"data:" + self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        params = self.read_params()
+        FakeBotAPI.calls.append((monotonic(), method, params))
+        if FakeBotAPI.flood > 0:
+            FakeBotAPI.flood -= 1
+            reply: Dict[str, Any] = {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 0.2},
+            }
+        elif method in FakeBotAPI.rejected:
+            reply = {
+                "ok": False,
+                "error_code": 400,
+                "description": "Bad Request: chat not found",
+            }
+        elif params.get("chat_id") in FakeBotAPI.broken:
+            reply = {
+                "ok": False,
+                "error_code": FakeBotAPI.broken[params["chat_id"]],
+                "description": "Something went wrong",
+            }
+        elif method == "sendMediaGroup":
+            result = []
+            for item in params["media"]:
+                result.append({"message_id": len(self.calls)})
+                self.reply_media(
+                    "send" + item["type"], result[-1], item["media"]
+                )
+            reply = {"ok": True, "result": result}
+        else:
+            reply = {"ok": True, "result": {"message_id": len(self.calls)}}
+            for kind in ("photo", "video", "animation", "audio", "document"):
+                if kind in params:
+                    self.reply_media(method, reply["result"], params[kind])
+        body = dumps(reply).encode()
+        self.send_response(reply.get("error_code", 200))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@fixture
+def bot_api() -> Iterator[str]:
+    FakeBotAPI.calls = []
+    FakeBotAPI.uploads = {}
+    FakeBotAPI.downloads = []
+    FakeBotAPI.flood = 0
+    FakeBotAPI.rejected = set()
+    FakeBotAPI.broken = {}
+    TelegramIntegration.buckets.clear()
+    TelegramIntegration.file_ids = FileIdCache()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBotAPI)
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield "http://127.0.0.1:%d" % server.server_port
+    server.shutdown()
+
+
+def deliver(integration: TelegramIntegration, *statuses) -> List[str]:
+    async def main():
+        try:
+            return await gather(*[integration(s) for s in statuses])
+        finally:
+            await close_clients()
+
+    return run(main())
+
+
+def test_retry_after_flood_control(bot_api, status):
+    FakeBotAPI.flood = 2
+    tg = TelegramIntegration("1:token", "@chat", api_server=bot_api)
+    assert deliver(tg, status()) == ["3"]
+    times = [t for t, _, _ in FakeBotAPI.calls]
+    assert len(times) == 3
+    assert times[1] - times[0] >= 0.2
+    assert times[2] - times[1] >= 0.2
+
+
+def test_error_is_raised(bot_api, status):
+    FakeBotAPI.flood = 1
+    tg = TelegramIntegration("1:token", "@a", api_server=bot_api, retries=0)
+    with raises(DeliveryError, match="sendMessage failed") as error:
+        deliver(tg, status())
+    assert error.value.retryable
+
+    FakeBotAPI.rejected = {"sendMessage"}
+    with raises(DeliveryError, match="chat not found") as error:
+        deliver(tg, status())
+    assert not error.value.retryable
+
+
+def test_partly_posted_status_is_not_failed(bot_api, status, caplog):
+    FakeBotAPI.rejected = {"sendPoll"}
+    poll = {
+        "id": "1",
+        "expires_at": None,
+        "expired": False,
+        "multiple": False,
+        "votes_count": 0,
+        "voters_count": None,
+        "options": [{"title": "yes", "votes_count": 0}],
+    }
+    tg = TelegramIntegration("1:token", "@a", api_server=bot_api)
+    media = [image(bot_api, "%d.png" % i) for i in range(11)]
+    (result,) = deliver(tg, status(media_attachments=media, poll=poll))
+    assert len(result.split(",")) == 11
+    assert "Only 11 message(s) got posted to @a" in caplog.text
+
+
+def test_per_chat_rate_limit(bot_api, status, caplog):
+    tg = TelegramIntegration(
+        "1:token", "@chat", api_server=bot_api, rate_limit=10, rate_burst=1
+    )
+    other = TelegramIntegration(
+        "1:token", "@other", api_server=bot_api, rate_limit=10, rate_burst=1
+    )
+    assert "already limited" not in caplog.text
+    assert TelegramIntegration("1:token", "@chat").chat_bucket is (
+        tg.chat_bucket
+    )
+    assert "tg:1:@chat is already limited to 10/s (burst 1.0)" in caplog.text
+    started = monotonic()
+    deliver(tg, *[status(id=str(i)) for i in range(4)])
+    assert monotonic() - started >= 0.3
+
+    started = monotonic()
+    deliver(other, status())
+    assert monotonic() - started < 0.1
+    assert {p["chat_id"] for _, _, p in FakeBotAPI.calls} == {
+        "@chat",
+        "@other",
+    }
+
+
+def image(bot_api: str, name: str) -> Dict[str, Any]:
+    url = "%s/media/%s" % (bot_api, name)
+    return {"id": name, "type": "image", "url": url, "preview_url": url}
+
+
+def test_upload_media_once(bot_api, status):
+    chats = [
+        TelegramIntegration(
+            "1:token", chat, api_server=bot_api, upload_media=True
+        )
+        for chat in ("@a", "@b", "@c")
+    ]
+    s = status(media_attachments=[image(bot_api, "cat.png")])
+
+    async def main():
+        try:
+            return await gather(*[chat(s) for chat in chats])
+        finally:
+            await close_clients()
+
+    assert len(run(main())) == 3
+    assert FakeBotAPI.downloads == ["/media/cat.png"]
+    assert FakeBotAPI.uploads == {"photo": b"data:/media/cat.png"}
+    photos = [params["photo"] for _, _, params in FakeBotAPI.calls]
+    assert photos == ["upload:cat.png", "id:cat.png", "id:cat.png"]
+    assert TelegramIntegration.file_ids.uploads == 1
+    assert TelegramIntegration.file_ids.hits == 2
+
+    # file_ids belong to the bot that uploaded the file
+    other = TelegramIntegration(
+        "2:token", "@a", api_server=bot_api, upload_media=True
+    )
+    deliver(other, s)
+    assert len(FakeBotAPI.downloads) == 2
+
+
+def test_upload_media_group(bot_api, status):
+    media = [image(bot_api, "1.png"), image(bot_api, "2.png")]
+    tg = TelegramIntegration(
+        "1:token", "@a", api_server=bot_api, upload_media=True
+    )
+    deliver(tg, status(media_attachments=media[:1]))
+    deliver(tg, status(id="101", media_attachments=media))
+
+    _, method, params = FakeBotAPI.calls[-1]
+    assert method == "sendMediaGroup"
+    assert [item["media"] for item in params["media"]] == [
+        "id:1.png",
+        "upload:2.png",
+    ]
+    assert FakeBotAPI.uploads["file1"] == b"data:/media/2.png"
+    assert FakeBotAPI.downloads == ["/media/1.png", "/media/2.png"]
+    assert len(TelegramIntegration.file_ids) == 2
+
+
+def test_upload_media_group_to_several_chats(bot_api, status):
+    chats = [
+        TelegramIntegration(
+            "1:token", chat, api_server=bot_api, upload_media=True
+        )
+        for chat in ("@a", "@b", "@c")
+    ]
+    media = [image(bot_api, "1.png"), image(bot_api, "2.png")]
+    s = status(media_attachments=media)
+
+    async def main():
+        try:
+            return await gather(*[chat(s) for chat in chats])
+        finally:
+            await close_clients()
+
+    assert len(run(main())) == 3
+    # every file is fetched once, however many chats post it
+    assert sorted(FakeBotAPI.downloads) == ["/media/1.png", "/media/2.png"]
+    assert TelegramIntegration.file_ids.uploads == 2
+    assert TelegramIntegration.file_ids.hits == 4
+    assert TelegramIntegration.file_ids._fetches == {}
+
+
+def test_plan_media_groups(status):
+    types = ["image", "gifv", "video", "pdf", "gifv"] + ["image"] * 11
+    media = status(
+        media_attachments=[
+            {"id": str(i), "type": type_, "url": "", "preview_url": ""}
+            for i, type_ in enumerate(types)
+        ]
+    ).media_attachments
+    groups = [
+        [item.id for item in group] for group in plan_media_groups(media)
+    ]
+    assert groups == [
+        ["0", "2", "5", "6", "7", "8", "9", "10", "11", "12"],
+        ["1", "4"],
+        ["13", "14", "15"],
+    ]
+
+
+def test_upload_media_groups_in_order(bot_api, status):
+    poll = {
+        "id": "1",
+        "expires_at": None,
+        "expired": False,
+        "multiple": False,
+        "votes_count": 0,
+        "voters_count": None,
+        "options": [{"title": "yes", "votes_count": 0}],
+    }
+    media = [image(bot_api, "%d.png" % i) for i in range(11)]
+    tg = TelegramIntegration(
+        "1:token", "@a", api_server=bot_api, upload_media=True
+    )
+    deliver(tg, status(media_attachments=media, poll=poll))
+
+    methods = [method for _, method, _ in FakeBotAPI.calls]
+    assert methods == ["sendMediaGroup", "sendPhoto", "sendPoll"]
+    assert FakeBotAPI.calls[1][2]["photo"] == "upload:10.png"
+    assert FakeBotAPI.calls[2][2]["reply_to_message_id"] == 1
+    assert sorted(FakeBotAPI.downloads) == sorted(
+        "/media/%d.png" % i for i in range(11)
+    )
+    assert len(TelegramIntegration.file_ids) == 11
+
+
+def test_media_urls_by_default(bot_api, status):
+    tg = TelegramIntegration("1:token", "@a", api_server=bot_api)
+    deliver(tg, status(media_attachments=[image(bot_api, "cat.png")]))
+    assert FakeBotAPI.calls[0][2]["photo"] == bot_api + "/media/cat.png"
+    assert FakeBotAPI.downloads == []
+
+
+def test_multiple_chats(bot_api, status, monkeypatch):
+    conf = ConfigParser()
+    conf.read_dict(
+        {
+            "module/tg": {
+                "token": "1:token",
+                "chat": "@a @b @c",
+                "template": "{{ status.id }}",
+                "api_server": bot_api,
+            },
+            "module/tg/@b": {"template": "b:{{ status.id }}", "silent": "no"},
+        }
+    )
+    tg = TelegramIntegration.from_section(conf["module/tg"])
+    assert [chat.chat_id for chat in tg.chats] == ["@a", "@b", "@c"]
+    assert tg.chats[0].template is tg.chats[2].template
+
+    renders: List[str] = []
+
+    async def render(template, context, source=None):
+        renders.append(source)
+        return template.render(context)
+
+    monkeypatch.setattr("mastoposter.offload.render", render)
+    (result,) = deliver(tg, status())
+    assert sorted(renders) == ["b:{{ status.id }}", "{{ status.id }}"]
+
+    sent = {p["chat_id"]: p for _, _, p in FakeBotAPI.calls}
+    assert sent["@a"]["text"] == sent["@c"]["text"] == "100"
+    assert sent["@b"]["text"] == "b:100"
+    assert sent["@b"]["disable_notification"] is False
+    assert sent["@a"]["disable_notification"] is True
+    assert [item.split(":")[0] for item in result.split(";")] == [
+        "@a",
+        "@b",
+        "@c",
+    ]
+    assert len(TelegramIntegration.buckets) == 4
+
+
+def test_failed_chats_are_retried(bot_api, status, tmp_path):
+    path = str(tmp_path / "outbox.db")
+    tg = TelegramIntegration(
+        "1:token", ["@a", "@b", "@c"], api_server=bot_api, retries=0
+    )
+    sinks = [FilteredIntegration(tg, [], "tg")]
+    # @b may work later, @c never will
+    FakeBotAPI.broken = {"@b": 500, "@c": 400}
+
+    async def deliver():
+        outbox = Outbox(path)
+        await outbox.open()
+        try:
+            return await execute_integrations(status(), sinks, outbox)
+        finally:
+            await outbox.close()
+            await close_clients()
+
+    (error,) = run(deliver())
+    assert isinstance(error, DeliveryError)
+    assert error.retryable and error.targets == ["@b"]
+
+    FakeBotAPI.broken = {}
+    FakeBotAPI.calls = []
+
+    async def replay():
+        outbox = Outbox(path)
+        await outbox.open()
+        try:
+            await Pipeline(sinks, outbox=outbox).replay()
+            return await outbox.pending()
+        finally:
+            await outbox.close()
+            await close_clients()
+
+    assert run(replay()) == []
+    assert [params["chat_id"] for _, _, params in FakeBotAPI.calls] == ["@b"]
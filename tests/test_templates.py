@@ -0,0 +1,30 @@
+from mastoposter import templates
+from mastoposter.templates import get_source, get_template, template_fields
+
+
+def test_same_source_same_template():
+    first = get_template("{{ status }}!")
+    assert get_template("{{ status }}!") is first
+    assert get_template("{{ status }}?") is not first
+    assert get_source(first) == "{{ status }}!"
+    assert first.render(status="hi") == "hi!"
+
+
+def test_bytecode_cache(tmp_path):
+    templates.configure(str(tmp_path / "cache"))
+    try:
+        get_template("{{ 1 + 2 }} bytecode")
+        assert len(list((tmp_path / "cache").iterdir())) == 1
+        templates.configure(str(tmp_path / "cache"))
+        assert get_template("{{ 1 + 2 }} bytecode").render() == "3 bytecode"
+    finally:
+        templates.configure(None)
+
+
+def test_template_fields():
+    assert template_fields(
+        "{% if status.reblog %}{{ status.reblog.account.name }}{% endif %}"
+        "{% for a in status['media_attachments'] %}{{ a.url }}{% endfor %}"
+    ) == {"reblog", "reblog.account.name", "media_attachments"}
+    assert template_fields("{{ status }}") is None
+    assert template_fields("{{ status.link }}{{ macro(status) }}") is None
@@ -16,7 +16,15 @@ GNU General Public License for more details.
 from bs4 import BeautifulSoup
 from pytest import mark
 
-from mastoposter.text import md_escape, node_process
+from mastoposter.text import (
+    _tables,
+    md_escape,
+    node_process,
+    node_process_many,
+    node_processors,
+    register_converter,
+    register_parts_converter,
+)
 
 
 def test_md_escape():
@@ -189,3 +197,54 @@ def test_node_to_html_tag_ol():
 def test_node_to_html_spoiler():
     soup = BeautifulSoup('<span class="_mfm_blur_">test</span>', features="lxml")
     assert node_process(soup, "html") == '<span class="tg-spoiler">test</span>'
+
+
+def test_node_process_deep_nesting():
+    html = "<b>" * 5000 + "deep" + "</b>" * 5000
+    soup = BeautifulSoup(html, features="lxml")
+    assert node_process(soup, "plain") == "deep"
+    assert node_process(soup, "markdown").startswith("****" * 100)
+
+
+def test_node_process_nested_lists():
+    soup = BeautifulSoup(
+        "<ul><li>a<ol><li><b>b</b></li><li>c</li></ol></li><li>d</li></ul>",
+        features="lxml",
+    )
+    assert node_process(soup, "markdown") == (
+        "\n* a\n   1. **b**\n   2. c\n* d"
+    )
+
+
+def test_node_process_custom_converters():
+    @register_converter("kbd", "plain")
+    def proc_tag_kbd_to_plain(tag):
+        return "[%s]" % tag.get_text() if tag.get_text() else None
+
+    @register_parts_converter("kbd", "plain")
+    def proc_tag_kbd_parts_to_plain(tag, parts):
+        return "<empty>"
+
+    try:
+        soup = BeautifulSoup(
+            "<p><kbd>Ctrl</kbd> <kbd></kbd></p>", features="lxml"
+        )
+        assert node_process(soup, "plain") == "[Ctrl] <empty>\n\n"
+    finally:
+        del node_processors["plain", "kbd"]
+        _tables.clear()
+
+
+def test_node_process_many():
+    soup = BeautifulSoup(
+        '<p>Hi <span class="h-card"><a href="https://x.y/@z">@<span>z'
+        "</span></a></span> <b>bold <i>both</i></b><br/>"
+        '<span class="_mfm_blur_">spoiler</span></p>'
+        "<blockquote><p>quote</p></blockquote>"
+        "<ol><li>one<ul><li>two</li></ul></li></ol>",
+        features="lxml",
+    )
+    result = node_process_many(soup, ["markdown", "plain", "html"])
+    assert list(result) == ["markdown", "plain", "html"]
+    for type_, text in result.items():
+        assert text == node_process(soup, type_)
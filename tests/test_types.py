@@ -0,0 +1,99 @@
+from pickle import dumps, loads
+
+from mastoposter.types import (
+    AttachmentMetaImage,
+    Status,
+    measure_projection,
+    set_projection,
+)
+
+
+def test_content_renderings(status):
+    s = status(content='<p>Hello, <a href="https://example.com">world</a></p>')
+    assert s.content_plaintext == "Hello, world (https://example.com)"
+    assert s.content_flathtml == (
+        'Hello, <a href="https://example.com">world</a>'
+    )
+    assert s.content_markdown == "Hello, [world](https://example.com)"
+
+
+def test_content_parsed_once(status):
+    s = status()
+    soup = s.content_soup
+    s.content_plaintext, s.content_flathtml, s.content_markdown
+    assert s.content_soup is soup
+    assert s.content_plaintext is s.content_plaintext
+
+
+def test_content_formats_converted_together(monkeypatch, status):
+    formats = frozenset(("plain", "html"))
+    monkeypatch.setattr(Status, "content_formats", formats)
+    s = status(content="<p>Hello, <b>world</b></p>")
+    assert s.content_plaintext == "Hello, world"
+    assert s.__dict__["content_flathtml"] == "Hello, <b>world</b>"
+    assert "content_markdown" not in s.__dict__
+
+
+def test_lazy_fields(status_dict):
+    poll = {
+        "id": "1",
+        "expires_at": None,
+        "expired": False,
+        "multiple": False,
+        "votes_count": 1,
+        "voters_count": "1",
+        "options": [{"title": "yes", "votes_count": 1}],
+    }
+    s = Status.from_dict(status_dict(poll=poll))
+    assert "poll" not in s.__dict__
+    assert s.poll is not None and s.poll.voters_count == 1
+    assert s.poll.options[0].title == "yes"
+    assert s.poll is s.poll
+    assert s.application is None
+    assert s.account.moved is None
+
+
+def test_pickle_roundtrip(status_dict):
+    s = Status.from_dict(status_dict(application={"name": "Web"}))
+    copy = loads(dumps(s))
+    assert copy == s
+    assert copy.application is not None and copy.application.name == "Web"
+
+
+def test_projection(status_dict, caplog):
+    data = status_dict(tags=[{"name": "tag", "url": "https://example.com"}])
+    try:
+        dropped = set_projection(["reblog_or_status.content_flathtml", "link"])
+        assert "tags" in dropped["Status"] and "emojis" in dropped["Account"]
+        assert "account" not in dropped["Status"]
+        s = Status.from_dict(data)
+        assert "tags" not in s.__dict__ and "_raw_tags" not in s.__dict__
+        assert s.link == "https://example.com/@user/100"
+        copy = loads(dumps(s))
+        assert copy.tags == [] and copy.account.emojis == []
+        assert s.tags == [] and "dropped by the projection" in caplog.text
+        set_projection(None)
+        assert Status.from_dict(data).tags[0].name == "tag"
+    finally:
+        set_projection(None)
+
+
+def test_projection_memory(status_dict):
+    tags = [
+        {"name": "tag%d" % i, "url": "https://example.com"} for i in range(9)
+    ]
+    statuses = [status_dict(id=str(i), tags=tags) for i in range(20)]
+    try:
+        savings = measure_projection(statuses, ["id", "uri", "content"])
+        assert savings.projected_memory < savings.full_memory
+    finally:
+        set_projection(None)
+
+
+def test_attachment_meta():
+    dims = {"width": 2, "height": 1, "size": "2x1", "aspect": 2.0}
+    meta = AttachmentMetaImage.from_dict(
+        {"original": dims, "small": dims, "focus": {"x": 0.0, "y": 0.5}}
+    )
+    assert meta.small.width == 2
+    assert meta.focus is not None and meta.focus.y == 0.5